@@ -0,0 +1,636 @@
+import argparse
+import hashlib
+import json
+import random
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Process, Queue
+from threading import Lock
+from time import monotonic, sleep
+from typing import NamedTuple
+from urllib.parse import parse_qs, urlsplit
+from urllib.request import Request, urlopen
+from uuid import uuid4
+
+
+class Resource(NamedTuple):
+    """Ресурс в памяти поддельного диска"""
+
+    type: str
+    size: int | None
+    md5: str | None
+    modified: str
+
+
+def now() -> str:
+    """
+    Текущее время в формате апи
+
+    :return: строка ISO 8601
+    """
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+
+class FakeDisk:
+    """
+    Локальная замена апи Яндекс диска для бенчмарков.
+    Реализует только те ресурсы, к которым обращаются YandexApi и AsyncYandexApi:
+    список, создание, удаление, перемещение и копирование ресурсов,
+    получение ссылок на загрузку и скачивание, саму загрузку и скачивание.
+    Непустые директории удаляются асинхронно: ответ 202 со ссылкой на операцию,
+    статус которой доступен по адресу /v1/disk/operations/<id>.
+    По умолчанию содержимое файлов не хранится, запоминаются только размер и md5,
+    а при скачивании отдаются нулевые байты того же размера.
+    С keep_content содержимое хранится в памяти и отдается при скачивании.
+    Ревизия диска (GET /v1/disk) увеличивается при каждом изменении ресурсов.
+    Счетчики запросов доступны по адресу /_stats, DELETE /_stats их обнуляет
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0,
+        error_rate: float = 0,
+        throttle_rate: float = 0,
+        retry_after: float = 1,
+        operation_delay: float = 0,
+        keep_content: bool = False,
+    ) -> None:
+        """
+        Инициализатор класса
+
+        :param host: адрес, на котором слушает сервер
+        :param port: порт, 0 - любой свободный
+        :param latency: задержка (в секундах) перед ответом на каждый запрос к апи
+        :param error_rate: доля запросов к апи, на которые отвечается 503
+        :param throttle_rate: доля запросов к апи, на которые отвечается 429
+        :param retry_after: значение заголовка Retry-After в ответах 429
+        :param operation_delay: через сколько секунд завершается асинхронное
+         удаление непустой директории (ответ 202 со ссылкой на операцию)
+        :param keep_content: хранить ли содержимое загруженных файлов
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.operation_delay = operation_delay
+        self.operations: dict[str, float] = {}
+        self.resources: dict[str, Resource] = {}
+        self.keep_content = keep_content
+        self.contents: dict[str, bytes] = {}
+        self.revision = 1
+        self.requests: Counter[tuple[str, str, int]] = Counter()
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self._lock = Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        """
+        Адрес сервера
+
+        :return: str
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_url(self) -> str:
+        """
+        Адрес, который передается в YandexApi вместо адреса настоящего апи
+
+        :return: str
+        """
+        return f"{self.url}/v1/disk"
+
+    def serve_forever(self) -> None:
+        """
+        Обрабатывает запросы, пока процесс не будет остановлен
+
+        :return: None
+        """
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def reset_counters(self) -> None:
+        """
+        Обнуляет счетчики запросов и принятых байт
+
+        :return: None
+        """
+        with self._lock:
+            self.requests.clear()
+            self.bytes_received = 0
+            self.bytes_sent = 0
+
+    def stats(self) -> dict:
+        """
+        Счетчики запросов, принятых и отданных байт и количество файлов на диске
+
+        :return: словарь для ответа /_stats
+        """
+        with self._lock:
+            return {
+                "requests": [
+                    [method, endpoint, status, count]
+                    for (method, endpoint, status), count in self.requests.items()
+                ],
+                "bytes_received": self.bytes_received,
+                "bytes_sent": self.bytes_sent,
+                "files": sum(
+                    resource.type == "file" for resource in self.resources.values()
+                ),
+            }
+
+    def files(self) -> dict[str, Resource]:
+        """
+        Файлы на диске
+
+        :return: словарь из путей и ресурсов
+        """
+        with self._lock:
+            return {
+                path: resource
+                for path, resource in self.resources.items()
+                if resource.type == "file"
+            }
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        """
+        Создает класс обработчика запросов, связанный с этим диском
+
+        :return: класс обработчика
+        """
+        disk = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                disk.handle(self, "GET")
+
+            def do_PUT(self) -> None:
+                disk.handle(self, "PUT")
+
+            def do_POST(self) -> None:
+                disk.handle(self, "POST")
+
+            def do_DELETE(self) -> None:
+                disk.handle(self, "DELETE")
+
+        return Handler
+
+    def _respond(
+        self,
+        handler: BaseHTTPRequestHandler,
+        endpoint: str,
+        status: int,
+        body: dict | None = None,
+        headers: dict[str, str] | None = None,
+    ) -> None:
+        """
+        Отправляет ответ и учитывает его в счетчиках
+
+        :param handler: обработчик текущего запроса
+        :param endpoint: название ресурса апи для статистики
+        :param status: статус ответа
+        :param body: тело ответа
+        :param headers: дополнительные заголовки
+        :return: None
+        """
+        with self._lock:
+            self.requests[(handler.command, endpoint, status)] += 1
+        data = json.dumps(body).encode() if body is not None else b""
+        handler.send_response(status)
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _read_body(
+        self, handler: BaseHTTPRequestHandler
+    ) -> tuple[int, str, bytes | None]:
+        """
+        Читает тело запроса блоками. Тело сохраняется, только если включен keep_content
+
+        :param handler: обработчик текущего запроса
+        :return: размер, md5 и содержимое тела или None
+        """
+        left = int(handler.headers.get("Content-Length") or 0)
+        md5 = hashlib.md5()
+        size = 0
+        chunks = [] if self.keep_content else None
+        while left:
+            chunk = handler.rfile.read(min(left, 1024 * 1024))
+            if not chunk:
+                break
+            md5.update(chunk)
+            size += len(chunk)
+            left -= len(chunk)
+            if chunks is not None:
+                chunks.append(chunk)
+        return size, md5.hexdigest(), None if chunks is None else b"".join(chunks)
+
+    def _send_file(self, handler: BaseHTTPRequestHandler, path: str) -> None:
+        """
+        Отдает содержимое файла блоками
+
+        :param handler: обработчик текущего запроса
+        :param path: путь к файлу
+        :return: None
+        """
+        with self._lock:
+            resource = self.resources.get(path)
+            content = self.contents.get(path)
+        if resource is None or resource.type != "file":
+            self._respond(handler, "download", 404, {"error": "DiskNotFoundError"})
+            return
+        if content is None:
+            content = bytes(resource.size or 0)
+        with self._lock:
+            self.requests[(handler.command, "download", 200)] += 1
+            self.bytes_sent += len(content)
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/octet-stream")
+        handler.send_header("Content-Length", str(len(content)))
+        handler.end_headers()
+        view = memoryview(content)
+        for offset in range(0, len(content), 1024 * 1024):
+            handler.wfile.write(view[offset : offset + 1024 * 1024])
+
+    def handle(self, handler: BaseHTTPRequestHandler, method: str) -> None:
+        """
+        Обрабатывает запрос
+
+        :param handler: обработчик текущего запроса
+        :param method: метод запроса
+        :return: None
+        """
+        url = urlsplit(handler.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == "/_stats":
+            if method == "DELETE":
+                self.reset_counters()
+            body = json.dumps(self.stats()).encode()
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/json")
+            handler.send_header("Content-Length", str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+            return
+        if url.path == "/upload":
+            size, md5, content = self._read_body(handler)
+            with self._lock:
+                self.bytes_received += size
+                self.resources[query["path"]] = Resource("file", size, md5, now())
+                self.revision += 1
+                if content is not None:
+                    self.contents[query["path"]] = content
+            self._respond(handler, "upload", 201)
+            return
+        if url.path == "/download":
+            self._send_file(handler, query["path"])
+            return
+        if url.path.rstrip("/") == "/v1/disk":
+            endpoint = "disk"
+        elif url.path.startswith(("/v1/disk/resources", "/v1/disk/operations/")):
+            endpoint = url.path.removeprefix("/v1/disk/")
+        else:
+            self._respond(handler, "unknown", 404)
+            return
+        if self.latency:
+            sleep(self.latency)
+        chance = random.random()
+        if chance < self.throttle_rate:
+            self._respond(
+                handler,
+                endpoint,
+                429,
+                {"error": "TooManyRequestsError"},
+                {"Retry-After": str(self.retry_after)},
+            )
+            return
+        if chance < self.throttle_rate + self.error_rate:
+            self._respond(handler, endpoint, 503, {"error": "ServiceUnavailable"})
+            return
+        if endpoint == "disk" and method == "GET":
+            with self._lock:
+                revision = self.revision
+            self._respond(handler, endpoint, 200, {"revision": revision})
+        elif endpoint.startswith("operations/") and method == "GET":
+            self._operation_status(handler, endpoint.removeprefix("operations/"))
+        elif endpoint == "resources/upload" and method == "GET":
+            self._upload_link(handler, endpoint, query)
+        elif endpoint == "resources/download" and method == "GET":
+            self._download_link(handler, endpoint, query)
+        elif endpoint == "resources" and method == "GET":
+            self._list(handler, endpoint, query)
+        elif endpoint == "resources" and method == "PUT":
+            self._create_folder(handler, endpoint, query["path"])
+        elif endpoint == "resources" and method == "DELETE":
+            self._delete(handler, endpoint, query["path"])
+        elif endpoint in ("resources/move", "resources/copy") and method == "POST":
+            self._transfer(handler, endpoint, query)
+        else:
+            self._respond(handler, endpoint, 405)
+
+    def _upload_link(
+        self, handler: BaseHTTPRequestHandler, endpoint: str, query: dict[str, str]
+    ) -> None:
+        """
+        Выдает ссылку на загрузку файла
+
+        :param handler: обработчик текущего запроса
+        :param endpoint: название ресурса апи
+        :param query: параметры запроса
+        :return: None
+        """
+        path = query["path"]
+        with self._lock:
+            exists = path in self.resources
+        if exists and query.get("overwrite") != "true":
+            self._respond(
+                handler, endpoint, 409, {"error": "DiskResourceAlreadyExists"}
+            )
+            return
+        href = f"{self.url}/upload?{handler.path.split('?', 1)[1]}"
+        self._respond(handler, endpoint, 200, {"href": href, "method": "PUT"})
+
+    def _download_link(
+        self, handler: BaseHTTPRequestHandler, endpoint: str, query: dict[str, str]
+    ) -> None:
+        """
+        Выдает ссылку на скачивание файла
+
+        :param handler: обработчик текущего запроса
+        :param endpoint: название ресурса апи
+        :param query: параметры запроса
+        :return: None
+        """
+        with self._lock:
+            exists = query["path"] in self.resources
+        if not exists:
+            self._respond(handler, endpoint, 404, {"error": "DiskNotFoundError"})
+            return
+        href = f"{self.url}/download?{handler.path.split('?', 1)[1]}"
+        self._respond(handler, endpoint, 200, {"href": href, "method": "GET"})
+
+    def _list(
+        self, handler: BaseHTTPRequestHandler, endpoint: str, query: dict[str, str]
+    ) -> None:
+        """
+        Возвращает информацию о ресурсе, для директории - с одной страницей содержимого
+
+        :param handler: обработчик текущего запроса
+        :param endpoint: название ресурса апи
+        :param query: параметры запроса
+        :return: None
+        """
+        path = query["path"]
+        offset = int(query.get("offset", 0))
+        limit = int(query.get("limit", 20))
+        with self._lock:
+            resource = self.resources.get(path)
+            children = sorted(
+                child
+                for child in self.resources
+                if child.rpartition("/")[0] == path and child != path
+            )
+            items = [
+                {
+                    "name": child.rpartition("/")[2],
+                    "type": self.resources[child].type,
+                    "size": self.resources[child].size,
+                    "modified": self.resources[child].modified,
+                    "md5": self.resources[child].md5,
+                }
+                for child in children[offset : offset + limit]
+            ]
+        if resource is None:
+            self._respond(handler, endpoint, 404, {"error": "DiskNotFoundError"})
+            return
+        body = {"type": resource.type, "size": resource.size, "md5": resource.md5}
+        if resource.type == "dir":
+            body["_embedded"] = {"items": items, "total": len(children)}
+        self._respond(handler, endpoint, 200, body)
+
+    def _create_folder(
+        self, handler: BaseHTTPRequestHandler, endpoint: str, path: str
+    ) -> None:
+        """
+        Создает директорию
+
+        :param handler: обработчик текущего запроса
+        :param endpoint: название ресурса апи
+        :param path: путь к директории
+        :return: None
+        """
+        with self._lock:
+            if path in self.resources:
+                status = 409
+            else:
+                self.resources[path] = Resource("dir", None, None, now())
+                self.revision += 1
+                status = 201
+        self._respond(handler, endpoint, status, {} if status == 201 else None)
+
+    def _transfer(
+        self, handler: BaseHTTPRequestHandler, endpoint: str, query: dict[str, str]
+    ) -> None:
+        """
+        Перемещает или копирует ресурс вместе с содержимым
+
+        :param handler: обработчик текущего запроса
+        :param endpoint: resources/move или resources/copy
+        :param query: параметры запроса
+        :return: None
+        """
+        source, destination = query["from"], query["path"]
+        with self._lock:
+            if source not in self.resources:
+                status = 404
+            elif destination in self.resources and query.get("overwrite") != "true":
+                status = 409
+            elif destination.rpartition("/")[0] not in self.resources:
+                status = 409
+            else:
+                prefix = f"{source}/"
+                moved = {
+                    path: resource
+                    for path, resource in self.resources.items()
+                    if path == source or path.startswith(prefix)
+                }
+                contents = {
+                    path: self.contents[path] for path in moved if path in self.contents
+                }
+                if endpoint == "resources/move":
+                    for path in moved:
+                        del self.resources[path]
+                        self.contents.pop(path, None)
+                for path, resource in moved.items():
+                    self.resources[destination + path[len(source) :]] = resource
+                for path, content in contents.items():
+                    self.contents[destination + path[len(source) :]] = content
+                self.revision += 1
+                status = 201
+        self._respond(handler, endpoint, status, {} if status == 201 else None)
+
+    def _delete(
+        self, handler: BaseHTTPRequestHandler, endpoint: str, path: str
+    ) -> None:
+        """
+        Удаляет файл или директорию вместе с содержимым
+
+        :param handler: обработчик текущего запроса
+        :param endpoint: название ресурса апи
+        :param path: путь к ресурсу
+        :return: None
+        """
+        body = None
+        with self._lock:
+            if path not in self.resources:
+                status = 404
+            else:
+                prefix = f"{path}/"
+                children = [
+                    child for child in self.resources if child.startswith(prefix)
+                ]
+                for child in children:
+                    del self.resources[child]
+                    self.contents.pop(child, None)
+                del self.resources[path]
+                self.contents.pop(path, None)
+                self.revision += 1
+                status = 204
+                if children:
+                    operation = uuid4().hex
+                    self.operations[operation] = monotonic() + self.operation_delay
+                    status = 202
+                    body = {
+                        "href": f"{self.api_url}/operations/{operation}",
+                        "method": "GET",
+                        "templated": False,
+                    }
+        self._respond(handler, endpoint, status, body)
+
+    def _operation_status(
+        self, handler: BaseHTTPRequestHandler, operation: str
+    ) -> None:
+        """
+        Возвращает статус асинхронной операции
+
+        :param handler: обработчик текущего запроса
+        :param operation: идентификатор операции
+        :return: None
+        """
+        with self._lock:
+            finishes = self.operations.get(operation)
+        if finishes is None:
+            self._respond(handler, "operations", 404, {"error": "DiskNotFoundError"})
+            return
+        status = "success" if monotonic() >= finishes else "in-progress"
+        self._respond(handler, "operations", 200, {"status": status})
+
+
+def _serve(queue: Queue, options: dict) -> None:
+    """
+    Точка входа процесса с сервером: сообщает адрес и обрабатывает запросы
+
+    :param queue: очередь, в которую передается адрес сервера
+    :param options: аргументы FakeDisk
+    :return: None
+    """
+    disk = FakeDisk(**options)
+    queue.put(disk.url)
+    disk.serve_forever()
+
+
+class FakeDiskProcess:
+    """
+    Запускает FakeDisk в отдельном процессе, чтобы сервер не делил GIL
+    и память с измеряемым приложением
+    """
+
+    def __init__(self, **options) -> None:
+        """
+        Инициализатор класса
+
+        :param options: аргументы FakeDisk
+        """
+        queue = Queue()
+        self._process = Process(target=_serve, args=(queue, options), daemon=True)
+        self._process.start()
+        self.url = queue.get(timeout=10)
+        self.api_url = f"{self.url}/v1/disk"
+
+    def _stats(self, method: str) -> dict:
+        """
+        Запрашивает счетчики сервера
+
+        :param method: GET - прочитать, DELETE - прочитать и обнулить
+        :return: словарь со счетчиками
+        """
+        with urlopen(Request(f"{self.url}/_stats", method=method)) as response:
+            return json.load(response)
+
+    def stats(self) -> dict:
+        """
+        Счетчики запросов, принятых байт и количество файлов на диске
+
+        :return: dict
+        """
+        return self._stats("GET")
+
+    def reset_counters(self) -> None:
+        """
+        Обнуляет счетчики запросов и принятых байт
+
+        :return: None
+        """
+        self._stats("DELETE")
+
+    def stop(self) -> None:
+        """
+        Останавливает процесс с сервером
+
+        :return: None
+        """
+        self._process.terminate()
+        self._process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальная замена апи Яндекс диска")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0)
+    parser.add_argument("--retry-after", type=float, default=1)
+    parser.add_argument("--operation-delay", type=float, default=0)
+    parser.add_argument("--keep-content", action="store_true")
+    args = parser.parse_args()
+    server = FakeDisk(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        operation_delay=args.operation_delay,
+        keep_content=args.keep_content,
+    )
+    print(f"Адрес апи: {server.url}/v1/disk")
+    server.serve_forever()
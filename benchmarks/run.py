@@ -0,0 +1,492 @@
+"""
+Бенчмарк цикла синхронизации на локальной замене апи Яндекс диска.
+
+Примеры запуска из корня проекта:
+
+    python benchmarks/run.py small --files 10000
+    python benchmarks/run.py huge --huge-files 3 --huge-size 268435456
+    python benchmarks/run.py churn --cycles 20 --latency 0.02 --error-rate 0.01
+    python benchmarks/run.py all --backend asyncio --json result.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+from collections import Counter
+from pathlib import Path
+from time import perf_counter
+from typing import Callable
+
+from loguru import logger
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from api import (  # noqa: E402
+    AsyncBandwidthScheduler,
+    AsyncOperationPoller,
+    AsyncYandexApi,
+    BandwidthScheduler,
+    CircuitBreaker,
+    OperationPoller,
+    RateLimiter,
+    RetryPolicy,
+    YandexApi,
+)
+from services import (  # noqa: E402
+    AsyncFileSynchronization,
+    AsyncTransferPool,
+    DigestCache,
+    FileSynchronization,
+    LocaleTracking,
+    SyncState,
+    TransferJournal,
+    TransferPool,
+)
+
+from fake_disk import FakeDiskProcess  # noqa: E402
+
+CLOUD_FOLDER = "benchmark"
+FILES_PER_DIRECTORY = 100
+OPERATION_POLL_INTERVAL = 0.05
+
+
+def write_file(path: Path, size: int) -> None:
+    """
+    Создает файл со случайным содержимым, записывая его блоками
+
+    :param path: путь к файлу
+    :param size: размер файла в байтах
+    :return: None
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as file:
+        while size > 0:
+            block = min(size, 4 * 1024 * 1024)
+            file.write(os.urandom(block))
+            size -= block
+
+
+def generate_small(root: Path, files: int, min_size: int, max_size: int) -> None:
+    """
+    Создает дерево из маленьких файлов, по FILES_PER_DIRECTORY в каждой директории
+
+    :param root: корень дерева
+    :param files: количество файлов
+    :param min_size: минимальный размер файла в байтах
+    :param max_size: максимальный размер файла в байтах
+    :return: None
+    """
+    for number in range(files):
+        directory = number // FILES_PER_DIRECTORY
+        write_file(
+            root / f"d{directory // 10}" / f"d{directory}" / f"f{number}.bin",
+            random.randint(min_size, max_size),
+        )
+
+
+def generate_huge(root: Path, files: int, size: int) -> None:
+    """
+    Создает несколько больших файлов
+
+    :param root: корень дерева
+    :param files: количество файлов
+    :param size: размер каждого файла в байтах
+    :return: None
+    """
+    for number in range(files):
+        write_file(root / f"huge{number}.bin", size)
+
+
+def churn(root: Path, rate: float, min_size: int, max_size: int) -> int:
+    """
+    Изменяет, удаляет, переименовывает и создает заданную долю файлов дерева
+
+    :param root: корень дерева
+    :param rate: доля файлов, которые будут изменены.
+     Удаляется, переименовывается и создается в пять раз меньше файлов
+    :param min_size: минимальный размер новых файлов в байтах
+    :param max_size: максимальный размер новых файлов в байтах
+    :return: количество затронутых файлов
+    """
+    files = [path for path in root.rglob("*") if path.is_file()]
+    modified = random.sample(files, max(1, int(len(files) * rate)))
+    amount = max(1, len(modified) // 5)
+    for path in modified[:amount]:
+        path.unlink()
+    touched = set(modified)
+    untouched = [path for path in files if path not in touched]
+    renamed = random.sample(untouched, min(amount, len(untouched)))
+    for path in renamed:
+        path.rename(path.with_name(f"moved{random.getrandbits(48):x}.bin"))
+    for path in modified[amount:]:
+        write_file(path, random.randint(min_size, max_size))
+    for number in range(amount):
+        write_file(
+            random.choice(modified).parent / f"new{random.getrandbits(48):x}.bin",
+            random.randint(min_size, max_size),
+        )
+    return len(modified) + len(renamed) + amount
+
+
+class Bench:
+    """Собирает компоненты приложения вокруг FakeDisk и измеряет циклы синхронизации"""
+
+    def __init__(
+        self, args: argparse.Namespace, root: Path, disk: FakeDiskProcess
+    ) -> None:
+        """
+        Инициализатор класса
+
+        :param args: аргументы командной строки
+        :param root: отслеживаемая директория
+        :param disk: запущенный FakeDiskProcess
+        """
+        self._args = args
+        self._disk = disk
+        self._state_file = str(root.parent / "state.db")
+        local_folder = str(root)
+        retry_policy = RetryPolicy(
+            attempts=args.retries,
+            base_delay=0.05,
+            max_delay=2,
+            limiter=RateLimiter(rate=args.rate_limit, burst=args.workers),
+            breaker=CircuitBreaker(threshold=0, reset_timeout=0),
+        )
+        state = SyncState(path=self._state_file)
+        digests = DigestCache(
+            path=self._state_file, local_folder=local_folder, chunk_size=args.chunk
+        )
+        journal = TransferJournal(path=f"{self._state_file}.journal")
+        api_options = dict(
+            token="OAuth benchmark",
+            cloud_folder=CLOUD_FOLDER,
+            local_folder=local_folder,
+            chunk_size=args.chunk,
+            retry_policy=retry_policy,
+            api_url=disk.api_url,
+            page_size=args.page_size,
+        )
+        bandwidth_options = dict(
+            rate=args.bandwidth_limit,
+            large_concurrency=args.large_workers,
+            large_file_size=args.large_file_size,
+            adaptive=args.adaptive,
+        )
+        if args.backend == "asyncio":
+            self._loop = asyncio.new_event_loop()
+            self._api = AsyncYandexApi(
+                pool_size=args.workers,
+                bandwidth=AsyncBandwidthScheduler(
+                    small_concurrency=args.workers, **bandwidth_options
+                ),
+                **api_options,
+            )
+            self._operations = AsyncOperationPoller(
+                interval=OPERATION_POLL_INTERVAL, timeout=60
+            )
+            self._app = AsyncFileSynchronization(
+                yandex_api=self._api,
+                local_tracking=LocaleTracking(local_folder=local_folder),
+                state=state,
+                digests=digests,
+                journal=journal,
+                operations=self._operations,
+                pool=AsyncTransferPool(
+                    concurrency=args.workers, queue_size=args.queue_size
+                ),
+                interval=0,
+                reconcile_interval=0,
+                two_way=args.two_way,
+            )
+        else:
+            self._pool = TransferPool(
+                workers=args.workers,
+                large_workers=args.large_workers,
+                large_file_size=args.large_file_size,
+                queue_size=args.queue_size,
+            )
+            self._api = YandexApi(
+                pool_size=self._pool.size,
+                bandwidth=BandwidthScheduler(
+                    small_concurrency=args.workers, **bandwidth_options
+                ),
+                **api_options,
+            )
+            self._operations = OperationPoller(
+                interval=OPERATION_POLL_INTERVAL, timeout=60
+            )
+            self._app = FileSynchronization(
+                yandex_api=self._api,
+                local_tracking=LocaleTracking(local_folder=local_folder),
+                state=state,
+                digests=digests,
+                journal=journal,
+                operations=self._operations,
+                pool=self._pool,
+                interval=0,
+                reconcile_interval=0,
+                two_way=args.two_way,
+            )
+        self._call(self._api.create_cloud_folder_if_not_exists)
+
+    def _call(self, func: Callable) -> object:
+        """
+        Вызывает метод приложения независимо от выбранного способа выполнения запросов
+
+        :param func: метод YandexApi или FileSynchronization
+        :return: результат метода
+        """
+        if self._args.backend == "asyncio":
+            return self._loop.run_until_complete(func())
+        return func()
+
+    def cycle(self) -> dict:
+        """
+        Выполняет один цикл синхронизации и ждет завершения всех загрузок и удалений,
+        включая асинхронные операции на сервере
+
+        :return: длительность цикла, количество запросов и принятых сервером байт
+        """
+        self._disk.reset_counters()
+        started = perf_counter()
+        completed = self._call(self._app.synchronize)
+        if self._args.backend == "asyncio":
+            self._loop.run_until_complete(self._app.wait())
+            while len(self._operations):
+                self._loop.run_until_complete(self._operations.wait())
+                self._loop.run_until_complete(self._app.wait())
+        else:
+            self._pool.wait()
+            while len(self._operations):
+                self._operations.wait()
+                self._pool.wait()
+        seconds = perf_counter() - started
+        stats = self._disk.stats()
+        return {
+            "seconds": seconds,
+            "completed": completed,
+            "by_endpoint": Counter(
+                {
+                    f"{method} {endpoint} {status}": count
+                    for method, endpoint, status, count in stats["requests"]
+                }
+            ),
+            "bytes": stats["bytes_received"],
+            "cloud_files": stats["files"],
+        }
+
+    def close(self) -> None:
+        """
+        Закрывает соединения и останавливает потоки
+
+        :return: None
+        """
+        if self._args.backend == "asyncio":
+            self._loop.run_until_complete(self._api.close())
+            self._loop.close()
+        else:
+            self._pool.shutdown()
+            self._api.close()
+
+
+def percentile(values: list[float], share: float) -> float:
+    """
+    Перцентиль по ближайшему рангу
+
+    :param values: значения
+    :param share: доля от 0 до 1
+    :return: значение перцентиля
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(share * len(ordered)) - 1))]
+
+
+def summarize(name: str, cycles: list[dict], files: int) -> dict:
+    """
+    Сводит результаты циклов сценария
+
+    :param name: название сценария
+    :param cycles: результаты циклов, первый - начальная загрузка
+    :param files: количество файлов в дереве после сценария
+    :return: словарь с итогами
+    """
+    initial, rest = cycles[0], cycles[1:]
+    seconds = [cycle["seconds"] for cycle in rest] or [initial["seconds"]]
+    requests = Counter()
+    for cycle in cycles:
+        requests.update(cycle["by_endpoint"])
+    uploaded = sum(cycle["bytes"] for cycle in cycles)
+    total = sum(cycle["seconds"] for cycle in cycles)
+    return {
+        "scenario": name,
+        "files": files,
+        "cloud_files": cycles[-1]["cloud_files"],
+        "initial_seconds": round(initial["seconds"], 3),
+        "initial_files_per_second": round(files / initial["seconds"], 1),
+        "uploaded_mb": round(uploaded / 1024 / 1024, 1),
+        "upload_mb_per_second": round(uploaded / 1024 / 1024 / total, 1),
+        "cycles": len(rest),
+        "cycle_p50": round(percentile(seconds, 0.5), 4),
+        "cycle_p90": round(percentile(seconds, 0.9), 4),
+        "cycle_p99": round(percentile(seconds, 0.99), 4),
+        "cycle_mean": round(statistics.fmean(seconds), 4),
+        "failed_cycles": sum(not cycle["completed"] for cycle in cycles),
+        "requests": sum(requests.values()),
+        "requests_by_endpoint": dict(sorted(requests.items())),
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+def run_scenario(name: str, args: argparse.Namespace) -> dict:
+    """
+    Создает дерево, выполняет начальную синхронизацию и последующие циклы
+
+    :param name: small, huge или churn
+    :param args: аргументы командной строки
+    :return: итоги сценария
+    """
+    workdir = Path(tempfile.mkdtemp(prefix=f"bench-{name}-", dir=args.workdir))
+    root = workdir / "local"
+    root.mkdir()
+    if name == "small":
+        generate_small(root, args.files, args.min_size, args.max_size)
+    elif name == "huge":
+        generate_huge(root, args.huge_files, args.huge_size)
+    else:
+        generate_small(root, args.churn_files, args.min_size, args.max_size)
+    disk = FakeDiskProcess(
+        latency=args.latency,
+        operation_delay=args.operation_delay,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+    )
+    bench = Bench(args, root, disk)
+    try:
+        cycles = [bench.cycle()]
+        for _ in range(args.cycles):
+            if name == "churn":
+                churn(root, args.churn_rate, args.min_size, args.max_size)
+            cycles.append(bench.cycle())
+    finally:
+        bench.close()
+        disk.stop()
+    files = sum(1 for path in root.rglob("*") if path.is_file())
+    result = summarize(name, cycles, files)
+    if not args.keep:
+        shutil.rmtree(workdir)
+    return result
+
+
+def print_result(result: dict) -> None:
+    """
+    Печатает итоги сценария
+
+    :param result: итоги сценария
+    :return: None
+    """
+    print(f"\n== {result['scenario']} ==")
+    for key, value in result.items():
+        if key in ("scenario", "requests_by_endpoint"):
+            continue
+        print(f"{key:>26}: {value}")
+    print(f"{'requests_by_endpoint':>26}:")
+    for endpoint, count in result["requests_by_endpoint"].items():
+        print(f"{'':>28}{endpoint}: {count}")
+
+
+def parse_args() -> argparse.Namespace:
+    """
+    Разбирает аргументы командной строки
+
+    :return: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("scenario", choices=("small", "huge", "churn", "all"))
+    parser.add_argument("--backend", choices=("threads", "asyncio"), default="threads")
+    parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument("--large-workers", type=int, default=2)
+    parser.add_argument("--large-file-size", type=int, default=64 * 1024 * 1024)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--chunk", type=int, default=1024 * 1024)
+    parser.add_argument("--cycles", type=int, default=10)
+    parser.add_argument("--files", type=int, default=10000)
+    parser.add_argument("--min-size", type=int, default=512)
+    parser.add_argument("--max-size", type=int, default=8192)
+    parser.add_argument("--huge-files", type=int, default=3)
+    parser.add_argument("--huge-size", type=int, default=128 * 1024 * 1024)
+    parser.add_argument("--churn-files", type=int, default=2000)
+    parser.add_argument("--churn-rate", type=float, default=0.05)
+    parser.add_argument(
+        "--latency", type=float, default=0, help="задержка ответа апи в секундах"
+    )
+    parser.add_argument("--error-rate", type=float, default=0, help="доля ответов 503")
+    parser.add_argument(
+        "--throttle-rate", type=float, default=0, help="доля ответов 429"
+    )
+    parser.add_argument("--retry-after", type=float, default=1)
+    parser.add_argument(
+        "--operation-delay",
+        type=float,
+        default=0.2,
+        help="сколько секунд сервер удаляет директорию асинхронно",
+    )
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--rate-limit", type=float, default=0)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument(
+        "--two-way", action="store_true", help="двусторонняя синхронизация"
+    )
+    parser.add_argument(
+        "--bandwidth-limit",
+        type=int,
+        default=0,
+        help="ограничение скорости загрузки в байтах в секунду",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="подбирать количество одновременных загрузок по скорости",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="где создавать деревья файлов")
+    parser.add_argument("--keep", action="store_true", help="не удалять деревья")
+    parser.add_argument("--json", default=None, help="файл для сохранения итогов")
+    parser.add_argument("--log-level", default="ERROR")
+    return parser.parse_args()
+
+
+def main() -> None:
+    """
+    Запускает выбранные сценарии и печатает итоги
+
+    :return: None
+    """
+    args = parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+    random.seed(args.seed)
+    scenarios = (
+        ("small", "huge", "churn") if args.scenario == "all" else (args.scenario,)
+    )
+    results = []
+    for name in scenarios:
+        result = run_scenario(name, args)
+        print_result(result)
+        results.append(result)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,5 @@
-from .yandex_disk import YandexApi
+from .async_yandex_disk import AsyncYandexApi
+from .bandwidth import AsyncBandwidthScheduler, BandwidthScheduler
+from .operations import AsyncOperationPoller, BaseOperationPoller, OperationPoller
+from .retry import CircuitBreaker, RateLimiter, RetryPolicy
+from .yandex_disk import DOWNLOAD_SUFFIX, CloudFile, YandexApi
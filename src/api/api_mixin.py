@@ -1,25 +1,102 @@
+from time import perf_counter, sleep
 from typing import BinaryIO
 
 import requests
 from loguru import logger
+from requests.adapters import HTTPAdapter
+
+from metrics import REQUEST_SECONDS, endpoint_name
+
+from .retry import RetryPolicy
+from .streaming import DownloadStream, FileChangedError, UploadStream
 
 
 class HandleRequestMixin:
     """Миксин для обработки запросов к api"""
 
-    @classmethod
+    _session: requests.Session
+    _timeout: tuple[float, float]
+    _retry_policy: RetryPolicy
+    _parent: "HandleRequestMixin | None" = None
+
+    def _setup_session(
+        self,
+        pool_size: int,
+        connect_timeout: float,
+        read_timeout: float,
+        retry_policy: RetryPolicy | None = None,
+    ) -> None:
+        """
+        Создает долгоживущую сессию с пулом соединений.
+        Сессия переиспользует TCP и TLS соединения между запросами из всех потоков
+
+        :param pool_size: максимальное количество соединений с одним хостом,
+         должно совпадать с количеством потоков, отправляющих запросы
+        :param connect_timeout: таймаут на установку соединения (в секундах)
+        :param read_timeout: таймаут на ожидание данных от сервера (в секундах)
+        :param retry_policy: политика повторов, общая для всех потоков.
+         По умолчанию запросы повторяются без ограничения частоты
+        :return: None
+        """
+        self._retry_policy = retry_policy or RetryPolicy()
+        adapter = HTTPAdapter(pool_maxsize=pool_size, pool_block=True)
+        self._session = requests.Session()
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._timeout = (connect_timeout, read_timeout)
+
+    @staticmethod
+    def _observe(method: str, url: str, status: int | str, started: float) -> None:
+        """
+        Учитывает попытку запроса в метриках
+
+        :param method: метод запроса
+        :param url: адрес запроса
+        :param status: статус ответа или error, если ответ не получен
+        :param started: время начала попытки по perf_counter
+        :return: None
+        """
+        REQUEST_SECONDS.observe(
+            perf_counter() - started,
+            method=method.upper(),
+            endpoint=endpoint_name(url, method),
+            status=status,
+        )
+
+    def recovery_delay(self, failures: int) -> float:
+        """
+        Сколько подождать перед повтором операции, которая не удалась целиком
+
+        :param failures: количество неудач подряд
+        :return: секунды
+        """
+        return self._retry_policy.recovery_delay(failures)
+
+    def close(self) -> None:
+        """
+        Закрывает все соединения сессии.
+        Экземпляр, использующий сессию другого экземпляра, ее не закрывает
+
+        :return: None
+        """
+        if self._parent is None:
+            self._session.close()
+
     def _make_request(
-        cls,
+        self,
         url: str,
         error_text: str,
         method: str = "get",
         statuses: dict[int, str] | None = None,
         params: dict[str, str] | None = None,
         headers: dict[str, str] | None = None,
-        files: dict[str, BinaryIO] | None = None,
+        data: BinaryIO | UploadStream | None = None,
+        sink: DownloadStream | None = None,
     ) -> requests.Response | None:
         """
-        Делает запрос на нужный ресурс, обрабатывает возможные ошибки и возвращает ответ
+        Делает запрос на нужный ресурс, обрабатывает возможные ошибки и возвращает ответ.
+        Ошибки соединения, таймауты, 429 и 5xx повторяются согласно политике повторов.
+        Запрос, во время которого изменился размер отправляемого файла, не повторяется
 
         :param url: url, на который нужно отправить запрос
         :param error_text: текст ошибки, который должен быть залогирован в случае исключения
@@ -28,27 +105,90 @@ class HandleRequestMixin:
          если статус ответа совпадет хотя бы с одним из переденных
         :param params: параметры запроса
         :param headers: заголовки запроса
-        :param files: файлы, отправляемые на сервер
-        :return: requests.Response или None, если произойдет ошибка
-        """
-        try:
-            response = requests.request(
-                method=method, url=url, params=params, headers=headers, files=files
-            )
-            if statuses:
-                for status, message in statuses.items():
-                    if response.status_code == status:
-                        logger.info("{}", message)
-                        return response
-            return response
-        except requests.ConnectionError:
-            logger.exception(
-                "Не удалось соединиться с сервером,"
-                " проверьте соединение с Интернетом. {}",
-                error_text,
-            )
-            return
-        except requests.Timeout:
-            logger.exception("Сервер не ответил на запрос. {}", error_text)
-        except requests.RequestException:
-            logger.exception("Произошла ошибка. {}", error_text)
+        :param data: тело запроса, которое отправляется потоком
+        :param sink: приемник, в который блоками записывается тело успешного ответа.
+         Если передан, ответ не загружается в память целиком
+        :return: requests.Response или None, если произойдет ошибка.
+         Если повторы исчерпаны на ответе с ошибкой, возвращается последний ответ
+        """
+        attempt = 0
+        while True:
+            wait = self._retry_policy.before_request()
+            if wait is None:
+                logger.error("Запросы к api приостановлены. {}", error_text)
+                return None
+            if wait:
+                sleep(wait)
+            if data is not None and attempt:
+                data.seek(0)
+            if sink is not None and attempt:
+                sink.reset()
+            started = perf_counter()
+            try:
+                response = self._session.request(
+                    method=method,
+                    url=url,
+                    params=params,
+                    headers=headers,
+                    data=data,
+                    timeout=self._timeout,
+                    stream=sink is not None,
+                )
+                if sink is not None and response.status_code == requests.codes.ok:
+                    for chunk in response.iter_content(sink.chunk_size):
+                        sink.write(chunk)
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError):
+                self._observe(method, url, "error", started)
+                delay = self._retry_policy.on_error(attempt)
+                if delay is None:
+                    logger.exception(
+                        "Не удалось соединиться с сервером,"
+                        " проверьте соединение с Интернетом. {}",
+                        error_text,
+                    )
+                    return None
+                logger.warning(
+                    "Не удалось соединиться с сервером, повтор через {:.1f} с. {}",
+                    delay,
+                    error_text,
+                )
+            except requests.Timeout:
+                self._observe(method, url, "error", started)
+                delay = self._retry_policy.on_error(attempt)
+                if delay is None:
+                    logger.exception("Сервер не ответил на запрос. {}", error_text)
+                    return None
+                logger.warning(
+                    "Сервер не ответил на запрос, повтор через {:.1f} с. {}",
+                    delay,
+                    error_text,
+                )
+            except FileChangedError:
+                self._observe(method, url, "error", started)
+                logger.warning("Файл изменился во время загрузки. {}", error_text)
+                return None
+            except requests.RequestException:
+                self._observe(method, url, "error", started)
+                self._retry_policy.on_error(attempt, retryable=False)
+                logger.exception("Произошла ошибка. {}", error_text)
+                return None
+            else:
+                self._observe(method, url, response.status_code, started)
+                delay = self._retry_policy.on_response(
+                    attempt, response.status_code, response.headers.get("Retry-After")
+                )
+                if delay is None:
+                    if sink is not None:
+                        response.close()
+                    if statuses and response.status_code in statuses:
+                        logger.info("{}", statuses[response.status_code])
+                    return response
+                logger.warning(
+                    "Сервер ответил {}, повтор через {:.1f} с. {}",
+                    response.status_code,
+                    delay,
+                    error_text,
+                )
+                response.close()
+            sleep(delay)
+            attempt += 1
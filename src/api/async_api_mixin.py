@@ -0,0 +1,249 @@
+import asyncio
+import json
+from collections.abc import AsyncIterator
+from http import HTTPStatus
+from time import perf_counter
+from typing import Any, NamedTuple
+
+import aiohttp
+from loguru import logger
+
+from metrics import REQUEST_SECONDS, endpoint_name
+
+from .retry import RetryPolicy
+from .streaming import DownloadStream, UploadStream
+
+
+class ApiResponse(NamedTuple):
+    """Статус и тело ответа, прочитанные до возврата соединения в пул"""
+
+    status_code: int
+    data: Any
+
+    def json(self) -> Any:
+        """
+        Возвращает тело ответа, как requests.Response.json
+
+        :return: разобранный json или None, если тело пустое
+        """
+        return self.data
+
+
+async def read_chunks(stream: UploadStream) -> AsyncIterator[bytes]:
+    """
+    Читает файл блоками в пуле потоков, чтобы не блокировать цикл событий.
+    Паузы, которые назначил планировщик загрузок, выдерживаются в цикле событий
+
+    :param stream: экземпляр UploadStream
+    :return: асинхронный генератор блоков
+    """
+    while chunk := await asyncio.to_thread(stream.read_chunk):
+        if stream.throttle is not None:
+            delay = stream.throttle(len(chunk))
+            if delay > 0:
+                await asyncio.sleep(delay)
+        yield chunk
+
+
+class AsyncHandleRequestMixin:
+    """Миксин для обработки асинхронных запросов к api"""
+
+    _session: aiohttp.ClientSession | None = None
+    _parent: "AsyncHandleRequestMixin | None" = None
+    _pool_size: int
+    _timeout: aiohttp.ClientTimeout
+    _retry_policy: RetryPolicy
+
+    def _setup_session(
+        self,
+        pool_size: int,
+        connect_timeout: float,
+        read_timeout: float,
+        retry_policy: RetryPolicy | None = None,
+    ) -> None:
+        """
+        Запоминает настройки сессии. Сама сессия создается при первом запросе,
+        потому что должна принадлежать запущенному циклу событий
+
+        :param pool_size: максимальное количество одновременных соединений
+        :param connect_timeout: таймаут на установку соединения (в секундах)
+        :param read_timeout: таймаут на ожидание данных от сервера (в секундах)
+        :param retry_policy: политика повторов, общая для всех задач.
+         По умолчанию запросы повторяются без ограничения частоты
+        :return: None
+        """
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._pool_size = pool_size
+        self._timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=connect_timeout, sock_read=read_timeout
+        )
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Возвращает сессию с пулом соединений, создавая ее при необходимости.
+        Экземпляр, созданный для другой пары директорий, использует сессию родителя
+
+        :return: aiohttp.ClientSession
+        """
+        if self._parent is not None:
+            return self._parent._get_session()
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._pool_size),
+                timeout=self._timeout,
+            )
+        return self._session
+
+    @staticmethod
+    def _observe(method: str, url: str, status: int | str, started: float) -> None:
+        """
+        Учитывает попытку запроса в метриках
+
+        :param method: метод запроса
+        :param url: адрес запроса
+        :param status: статус ответа или error, если ответ не получен
+        :param started: время начала попытки по perf_counter
+        :return: None
+        """
+        REQUEST_SECONDS.observe(
+            perf_counter() - started,
+            method=method.upper(),
+            endpoint=endpoint_name(url, method),
+            status=status,
+        )
+
+    def recovery_delay(self, failures: int) -> float:
+        """
+        Сколько подождать перед повтором операции, которая не удалась целиком
+
+        :param failures: количество неудач подряд
+        :return: секунды
+        """
+        return self._retry_policy.recovery_delay(failures)
+
+    async def close(self) -> None:
+        """
+        Закрывает все соединения сессии.
+        Экземпляр, использующий сессию другого экземпляра, ее не закрывает
+
+        :return: None
+        """
+        if self._parent is None and self._session is not None:
+            await self._session.close()
+
+    async def _make_request(
+        self,
+        url: str,
+        error_text: str,
+        method: str = "get",
+        statuses: dict[int, str] | None = None,
+        params: dict[str, str] | None = None,
+        headers: dict[str, str] | None = None,
+        data: UploadStream | None = None,
+        sink: DownloadStream | None = None,
+    ) -> ApiResponse | None:
+        """
+        Делает запрос на нужный ресурс, обрабатывает возможные ошибки и возвращает ответ.
+        Ошибки соединения, таймауты, 429 и 5xx повторяются согласно политике повторов.
+        Запрос, во время которого изменился размер отправляемого файла, не повторяется
+
+        :param url: url, на который нужно отправить запрос
+        :param error_text: текст ошибки, который должен быть залогирован в случае исключения
+        :param method: метод отправки запроса
+        :param statuses: словарь со статусами и сообщениями, которые будут залогированы,
+         если статус ответа совпадет хотя бы с одним из переденных
+        :param params: параметры запроса
+        :param headers: заголовки запроса
+        :param data: тело запроса, которое отправляется потоком и перематывается при повторе
+        :param sink: приемник, в который блоками записывается тело успешного ответа.
+         Запись выполняется в пуле потоков, ответ не загружается в память целиком
+        :return: ApiResponse или None, если произойдет ошибка.
+         Если повторы исчерпаны на ответе с ошибкой, возвращается последний ответ
+        """
+        attempt = 0
+        while True:
+            wait = self._retry_policy.before_request()
+            if wait is None:
+                logger.error("Запросы к api приостановлены. {}", error_text)
+                return None
+            if wait:
+                await asyncio.sleep(wait)
+            if data is not None and attempt:
+                await asyncio.to_thread(data.seek, 0)
+            if sink is not None and attempt:
+                await asyncio.to_thread(sink.reset)
+            started = perf_counter()
+            try:
+                async with self._get_session().request(
+                    method=method,
+                    url=url,
+                    params=params,
+                    headers=headers,
+                    data=None if data is None else read_chunks(data),
+                ) as response:
+                    status_code = response.status
+                    retry_after = response.headers.get("Retry-After")
+                    if sink is not None and status_code == HTTPStatus.OK:
+                        body = b""
+                        async for chunk in response.content.iter_chunked(
+                            sink.chunk_size
+                        ):
+                            await asyncio.to_thread(sink.write, chunk)
+                    else:
+                        body = await response.read()
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError):
+                self._observe(method, url, "error", started)
+                if data is not None and data.changed:
+                    logger.warning("Файл изменился во время загрузки. {}", error_text)
+                    return None
+                delay = self._retry_policy.on_error(attempt)
+                if delay is None:
+                    logger.exception(
+                        "Не удалось соединиться с сервером,"
+                        " проверьте соединение с Интернетом. {}",
+                        error_text,
+                    )
+                    return None
+                logger.warning(
+                    "Не удалось соединиться с сервером, повтор через {:.1f} с. {}",
+                    delay,
+                    error_text,
+                )
+            except asyncio.TimeoutError:
+                self._observe(method, url, "error", started)
+                delay = self._retry_policy.on_error(attempt)
+                if delay is None:
+                    logger.exception("Сервер не ответил на запрос. {}", error_text)
+                    return None
+                logger.warning(
+                    "Сервер не ответил на запрос, повтор через {:.1f} с. {}",
+                    delay,
+                    error_text,
+                )
+            except aiohttp.ClientError:
+                self._observe(method, url, "error", started)
+                self._retry_policy.on_error(attempt, retryable=False)
+                logger.exception("Произошла ошибка. {}", error_text)
+                return None
+            else:
+                self._observe(method, url, status_code, started)
+                delay = self._retry_policy.on_response(
+                    attempt, status_code, retry_after
+                )
+                if delay is None:
+                    break
+                logger.warning(
+                    "Сервер ответил {}, повтор через {:.1f} с. {}",
+                    status_code,
+                    delay,
+                    error_text,
+                )
+            await asyncio.sleep(delay)
+            attempt += 1
+        try:
+            parsed = json.loads(body) if body else None
+        except ValueError:
+            parsed = None
+        if statuses and status_code in statuses:
+            logger.info("{}", statuses[status_code])
+        return ApiResponse(status_code=status_code, data=parsed)
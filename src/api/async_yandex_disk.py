@@ -0,0 +1,540 @@
+import asyncio
+import os.path
+from collections import deque
+from contextlib import suppress
+from copy import copy
+from http import HTTPStatus
+from typing import Self
+
+from loguru import logger
+
+from metrics import DOWNLOADED_BYTES, UPLOADED_BYTES
+
+from .async_api_mixin import AsyncHandleRequestMixin
+from .bandwidth import AsyncBandwidthScheduler
+from .retry import RetryPolicy
+from .streaming import DownloadStream, UploadStream
+from .yandex_disk import (
+    API_URL,
+    LIST_FIELDS,
+    LIST_PAGE_SIZE,
+    NOT_OVERWRITING,
+    OVERWRITING,
+    CloudFile,
+    operation_result,
+    parse_datetime,
+    temporary_path,
+)
+
+
+class AsyncYandexApi(AsyncHandleRequestMixin):
+    """
+    Предоставляет асинхронные методы для работы с апи Яндекс диска.
+    Все запросы выполняются в одном цикле событий, поэтому сотни операций
+    могут выполняться одновременно без отдельного потока на каждую
+    """
+
+    def __init__(
+        self,
+        token: str,
+        cloud_folder: str,
+        local_folder: str,
+        pool_size: int = 100,
+        connect_timeout: float = 5,
+        read_timeout: float = 60,
+        chunk_size: int = 1024 * 1024,
+        upload_stats: bool = False,
+        retry_policy: RetryPolicy | None = None,
+        api_url: str = API_URL,
+        page_size: int = LIST_PAGE_SIZE,
+        bandwidth: AsyncBandwidthScheduler | None = None,
+    ) -> None:
+        """
+        Инициализатор класса
+
+        :param token: токен доступа к api
+        :param cloud_folder: название директории в яндекс диске, которая должна быть связана с local_folder
+        :param local_folder: локальная директория для отслеживания
+        :param pool_size: максимальное количество одновременных соединений
+        :param connect_timeout: таймаут на установку соединения (в секундах)
+        :param read_timeout: таймаут на ожидание данных от сервера (в секундах)
+        :param chunk_size: размер блока (в байтах), которыми файл читается при загрузке
+        :param upload_stats: логировать ли размер, время и скорость загрузки каждого файла
+        :param retry_policy: политика повторов запросов, общая для всех задач
+        :param api_url: адрес апи Яндекс диска
+        :param page_size: количество ресурсов в одной странице списка файлов
+        :param bandwidth: планировщик загрузок, общий для всех задач.
+         По умолчанию загрузки не ограничиваются, а только измеряется их скорость
+        """
+        self._set_folder(token, cloud_folder, local_folder)
+        self._chunk_size = chunk_size
+        self._upload_stats = upload_stats
+        self._api_url = api_url
+        self._page_size = page_size
+        self._bandwidth = bandwidth or AsyncBandwidthScheduler()
+        self._setup_session(
+            pool_size=pool_size,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            retry_policy=retry_policy,
+        )
+
+    def with_folder(self, token: str, cloud_folder: str, local_folder: str) -> Self:
+        """
+        Создает экземпляр для другой пары директорий, возможно, другого аккаунта.
+        Новый экземпляр использует ту же сессию с пулом соединений и ту же политику повторов,
+        токен передается в заголовке каждого запроса
+
+        :param token: токен доступа к api
+        :param cloud_folder: название директории в яндекс диске
+        :param local_folder: локальная директория для отслеживания
+        :return: новый экземпляр
+        """
+        api = copy(self)
+        api._parent = self._parent or self
+        api._set_folder(token, cloud_folder, local_folder)
+        return api
+
+    def _set_folder(self, token: str, cloud_folder: str, local_folder: str) -> None:
+        """
+        Запоминает токен и пару директорий, сбрасывает сохраненный список файлов
+
+        :param token: токен доступа к api
+        :param cloud_folder: название директории в яндекс диске
+        :param local_folder: локальная директория для отслеживания
+        :return: None
+        """
+        self._token = token
+        self._cloud_folder = cloud_folder
+        self._local_folder = local_folder
+        self._authorization = {"Authorization": self._token}
+        self._path_to_folder = {"path": self._cloud_folder}
+        self._listing: dict[str, CloudFile] | None = None
+        self._listing_revision: int | None = None
+
+    def _cloud_path(self, path: str) -> str:
+        """
+        Формирует путь в облаке
+
+        :param path: путь относительно отслеживаемой директории
+        :return: путь относительно корня диска
+        """
+        return f"{self._cloud_folder}/{path}" if path else self._cloud_folder
+
+    async def create_cloud_folder_if_not_exists(self) -> None:
+        """
+        Создает директорию cloud_folder, если она не создана.
+        Вызывается перед запуском всех методов, поэтому проверяет токен на корректность.
+        В случае, если токен невалиден, прерывает работу программы
+
+        :return: None
+        """
+        failures = 0
+        while True:
+            response = await self._make_request(
+                url=f"{self._api_url}/resources",
+                method="put",
+                error_text="Облачная директория не создана",
+                statuses={HTTPStatus.CREATED: "Облачная директория создана успешно"},
+                params=self._path_to_folder,
+                headers=self._authorization,
+            )
+            if response is not None:
+                break
+            delay = self.recovery_delay(failures)
+            logger.error(
+                "Произошла ошибка при получении ответ от сервера."
+                " Пробуем снова через {:.1f} с",
+                delay,
+            )
+            failures += 1
+            await asyncio.sleep(delay)
+        if response.status_code == HTTPStatus.UNAUTHORIZED:
+            logger.error("Не получилось авторизоваться, проверьте токен")
+            exit(-1)
+
+    async def create_folder(self, path: str) -> bool:
+        """
+        Создает директорию в облаке
+
+        :param path: путь к директории относительно отслеживаемой директории
+        :return: True, если директория создана или уже существовала
+        """
+        response = await self._make_request(
+            url=f"{self._api_url}/resources",
+            method="put",
+            params={"path": self._cloud_path(path)},
+            headers=self._authorization,
+            error_text=f"Не удалось создать директорию {path}",
+            statuses={HTTPStatus.CREATED: f"Директория {path} создана"},
+        )
+        return response is not None and response.status_code in (
+            HTTPStatus.CREATED,
+            HTTPStatus.CONFLICT,
+        )
+
+    async def _get_link_to_upload(
+        self, filename: str, overwrite: tuple[str, str]
+    ) -> str | None:
+        """
+        Делает запрос на получение ссылки для загрузки файла
+
+        :param filename: название файла
+        :param overwrite: кортеж из значения, передающегося в апи и сообщения для логирования
+        :return: ссылка или None
+        """
+        response = await self._make_request(
+            url=f"{self._api_url}/resources/upload",
+            params={
+                "path": self._cloud_path(filename),
+                "overwrite": overwrite[0],
+                "fields": "href",
+            },
+            statuses={HTTPStatus.OK: f"Получена ссылка на скачивание {filename}"},
+            headers=self._authorization,
+            error_text=f"Не удалось получить ссылку для загрузки {filename}",
+        )
+        if response is not None and response.status_code == HTTPStatus.OK:
+            return response.data["href"]
+        logger.error(f"Не удалось получить ссылку для загрузки {filename}")
+        return None
+
+    async def load(
+        self, filename: str, overwrite: tuple[str, str] = NOT_OVERWRITING
+    ) -> str | None:
+        """
+        Делает запрос на загрузку файла. Файл читается и отправляется блоками.
+        Ссылка на загрузку запрашивается после того, как планировщик загрузок
+        выделил место, поэтому она не устаревает в очереди
+
+        :param filename: название файла
+        :param overwrite: кортеж из значения, передающегося в апи и сообщения для логирования
+        :return: md5 загруженного содержимого или None, если файл не принят сервером
+        """
+        file_path = os.path.join(self._local_folder, filename)
+        try:
+            file = await asyncio.to_thread(open, file_path, "rb")
+        except FileNotFoundError:
+            logger.exception("Не найден файл по пути {}", file_path)
+            return None
+        with file:
+            size = os.fstat(file.fileno()).st_size
+            async with self._bandwidth.slot(size) as throttle:
+                link_to_upload = await self._get_link_to_upload(
+                    filename=filename, overwrite=overwrite
+                )
+                if link_to_upload is None:
+                    logger.error("Нет ссылки для загрузки {}", filename)
+                    return None
+                stream = UploadStream(
+                    file=file,
+                    size=size,
+                    chunk_size=self._chunk_size,
+                    throttle=throttle,
+                )
+                response = await self._make_request(
+                    url=link_to_upload,
+                    method="put",
+                    error_text=f"Не удалось загрузить {filename} в облако",
+                    headers={"Content-Length": str(len(stream))},
+                    data=stream,
+                    statuses={
+                        HTTPStatus.CREATED: f"Файл {filename} успешно {overwrite[1]}",
+                        HTTPStatus.ACCEPTED: "Файл принят сервером,"
+                        " но еще не был перенесен непосредственно в Яндекс Диск",
+                        HTTPStatus.REQUEST_ENTITY_TOO_LARGE: "Размер файла больше допустимого",
+                        HTTPStatus.INTERNAL_SERVER_ERROR: "Ошибка сервера",
+                        HTTPStatus.INSUFFICIENT_STORAGE: "Недостаточно места на сервере",
+                    },
+                )
+        if self._upload_stats:
+            logger.info(
+                "Отправлено {} байт файла {} за {:.2f} с ({:.1f} КБ/с)",
+                stream.sent,
+                filename,
+                stream.elapsed,
+                stream.throughput / 1024,
+            )
+        if response is not None and response.status_code in (
+            HTTPStatus.CREATED,
+            HTTPStatus.ACCEPTED,
+        ):
+            UPLOADED_BYTES.inc(stream.sent)
+            return stream.md5
+        return None
+
+    async def reload(self, filename: str) -> str | None:
+        """
+        Делает запрос на перезапись файла
+
+        :param filename: название файла
+        :return: md5 загруженного содержимого или None, если файл не принят сервером
+        """
+        return await self.load(filename, overwrite=OVERWRITING)
+
+    async def _get_link_to_download(self, filename: str) -> str | None:
+        """
+        Делает запрос на получение ссылки для скачивания файла
+
+        :param filename: название файла
+        :return: ссылка или None
+        """
+        response = await self._make_request(
+            url=f"{self._api_url}/resources/download",
+            params={"path": self._cloud_path(filename), "fields": "href"},
+            headers=self._authorization,
+            error_text=f"Не удалось получить ссылку для скачивания {filename}",
+        )
+        if response is not None and response.status_code == HTTPStatus.OK:
+            return response.data["href"]
+        return None
+
+    async def download(self, filename: str) -> str | None:
+        """
+        Скачивает файл из облака. Содержимое записывается блоками во временный файл
+        рядом с целевым, который после успешного скачивания атомарно заменяет целевой.
+        Операции с файлами выполняются в пуле потоков
+
+        :param filename: название файла
+        :return: md5 скачанного содержимого или None, если файл не скачан
+        """
+        link_to_download = await self._get_link_to_download(filename)
+        if link_to_download is None:
+            logger.error("Нет ссылки для скачивания {}", filename)
+            return None
+        file_path = os.path.join(self._local_folder, filename)
+        temp_path = temporary_path(file_path)
+        try:
+            await asyncio.to_thread(
+                os.makedirs, os.path.dirname(file_path), exist_ok=True
+            )
+            file = await asyncio.to_thread(open, temp_path, "xb")
+            with file:
+                stream = DownloadStream(file=file, chunk_size=self._chunk_size)
+                response = await self._make_request(
+                    url=link_to_download,
+                    error_text=f"Не удалось скачать {filename} из облака",
+                    sink=stream,
+                    statuses={HTTPStatus.OK: f"Файл {filename} успешно скачан"},
+                )
+            if response is None or response.status_code != HTTPStatus.OK:
+                return None
+            await asyncio.to_thread(os.replace, temp_path, file_path)
+        except OSError:
+            logger.exception("Не удалось записать файл по пути {}", file_path)
+            return None
+        finally:
+            with suppress(FileNotFoundError):
+                os.unlink(temp_path)
+        if self._upload_stats:
+            logger.info(
+                "Получено {} байт файла {} за {:.2f} с ({:.1f} КБ/с)",
+                stream.received,
+                filename,
+                stream.elapsed,
+                stream.throughput / 1024,
+            )
+        DOWNLOADED_BYTES.inc(stream.received)
+        return stream.md5
+
+    async def delete(self, filename: str) -> bool | str:
+        """
+        Делает запрос на удаление файла или директории вместе с содержимым.
+        Удаление больших директорий сервер выполняет асинхронно
+
+        :param filename: путь к файлу или директории относительно отслеживаемой директории
+        :return: True, если ресурса больше нет в облаке, False, если удалить не удалось,
+         или ссылка на операцию удаления
+        """
+        response = await self._make_request(
+            url=f"{self._api_url}/resources",
+            method="delete",
+            params={"path": self._cloud_path(filename)},
+            headers=self._authorization,
+            error_text=f"Не удалось удалить {filename}",
+            statuses={HTTPStatus.NO_CONTENT: f"{filename} успешно удален"},
+        )
+        return operation_result(response, (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_FOUND))
+
+    async def _transfer(
+        self, operation: str, source: str, destination: str
+    ) -> bool | str:
+        """
+        Перемещает или копирует ресурс на сервере без повторной загрузки
+
+        :param operation: move или copy
+        :param source: путь к исходному ресурсу относительно отслеживаемой директории
+        :param destination: путь к новому ресурсу относительно отслеживаемой директории
+        :return: True, если сервер выполнил операцию, False, если нет,
+         или ссылка на операцию, если сервер принял ее к выполнению
+        """
+        action = "перемещен" if operation == "move" else "скопирован"
+        response = await self._make_request(
+            url=f"{self._api_url}/resources/{operation}",
+            method="post",
+            params={
+                "from": self._cloud_path(source),
+                "path": self._cloud_path(destination),
+                "overwrite": "true",
+            },
+            headers=self._authorization,
+            error_text=f"{source} не {action} в {destination}",
+            statuses={
+                HTTPStatus.CREATED: f"{source} {action} в {destination}",
+                HTTPStatus.ACCEPTED: f"{source} будет {action} в {destination}",
+            },
+        )
+        return operation_result(response, (HTTPStatus.CREATED,))
+
+    async def move(self, source: str, destination: str) -> bool | str:
+        """
+        Делает запрос на перемещение файла или директории со всем содержимым на сервере
+
+        :param source: старый путь
+        :param destination: новый путь
+        :return: True, если ресурс перемещен, False, если нет, или ссылка на операцию
+        """
+        return await self._transfer("move", source, destination)
+
+    async def copy(self, source: str, destination: str) -> bool | str:
+        """
+        Делает запрос на копирование файла на сервере
+
+        :param source: путь к исходному файлу
+        :param destination: путь к копии
+        :return: True, если файл скопирован, False, если нет, или ссылка на операцию
+        """
+        return await self._transfer("copy", source, destination)
+
+    async def operation_status(self, href: str) -> str | None:
+        """
+        Делает запрос на получение статуса асинхронной операции
+
+        :param href: ссылка на операцию из ответа 202
+        :return: success, failed, in-progress или None, если статус не получен
+        """
+        response = await self._make_request(
+            url=href,
+            headers=self._authorization,
+            error_text="Не удалось получить статус операции",
+        )
+        if response is None or response.status_code != HTTPStatus.OK:
+            return None
+        return response.data.get("status")
+
+    async def _list_directory(self, path: str) -> list[dict] | None:
+        """
+        Постранично запрашивает содержимое одной облачной директории
+
+        :param path: путь к директории относительно отслеживаемой директории
+        :return: список описаний ресурсов или None, если не удалось получить одну из страниц
+        """
+        items = []
+        offset = 0
+        while True:
+            response = await self._make_request(
+                url=f"{self._api_url}/resources",
+                params={
+                    "path": self._cloud_path(path),
+                    "fields": LIST_FIELDS,
+                    "limit": str(self._page_size),
+                    "offset": str(offset),
+                },
+                headers=self._authorization,
+                error_text=f"Не удалось получить список файлов в облаке {path}",
+            )
+            if response is None or response.status_code != HTTPStatus.OK:
+                return None
+            page = response.data["_embedded"]["items"]
+            items.extend(page)
+            if len(page) < self._page_size:
+                return items
+            offset += len(page)
+
+    async def disk_revision(self) -> int | None:
+        """
+        Делает запрос на получение ревизии диска.
+        Ревизия увеличивается при любом изменении на диске
+
+        :return: номер ревизии или None, если его не удалось получить
+        """
+        response = await self._make_request(
+            url=self._api_url,
+            params={"fields": "revision"},
+            headers=self._authorization,
+            error_text="Не удалось получить ревизию диска",
+        )
+        if response is None or response.status_code != HTTPStatus.OK:
+            return None
+        return response.data.get("revision")
+
+    async def file_md5(self, filename: str) -> str | None:
+        """
+        Делает запрос на получение md5 файла в облаке
+
+        :param filename: путь к файлу относительно отслеживаемой директории
+        :return: md5 или None, если файла нет в облаке или его не удалось проверить
+        """
+        response = await self._make_request(
+            url=f"{self._api_url}/resources",
+            params={"path": self._cloud_path(filename), "fields": "type,md5"},
+            headers=self._authorization,
+            error_text=f"Не удалось проверить файл {filename} в облаке",
+        )
+        if response is None or response.status_code != HTTPStatus.OK:
+            return None
+        info = response.data
+        return info.get("md5") if info.get("type") == "file" else None
+
+    async def list_files(self) -> dict[str, CloudFile] | None:
+        """
+        Возвращает полный список ресурсов облачной директории.
+        Если ревизия диска не изменилась с прошлого полного списка,
+        возвращается сохраненный список без обхода директорий
+
+        :return: словарь из путей ресурсов относительно облачной директории и информации о них
+         или None, если произошла ошибка
+        """
+        revision = await self.disk_revision()
+        if revision is not None and revision == self._listing_revision:
+            logger.info("Файлы в облаке не изменились, ревизия диска {}", revision)
+            return self._listing
+        files = await self._full_listing()
+        if files is not None:
+            self._listing, self._listing_revision = files, revision
+        return files
+
+    async def _full_listing(self) -> dict[str, CloudFile] | None:
+        """
+        Рекурсивно получает полный список ресурсов облачной директории.
+        Директории одного уровня запрашиваются одновременно
+
+        :return: словарь из путей ресурсов относительно облачной директории и информации о них
+         или None, если произошла ошибка
+        """
+        files = {}
+        directories = deque([""])
+        while directories:
+            level = list(directories)
+            directories.clear()
+            pages = await asyncio.gather(
+                *(self._list_directory(directory) for directory in level)
+            )
+            for directory, items in zip(level, pages):
+                if items is None:
+                    logger.error("Не удалось получить полный список файлов в облаке")
+                    return None
+                prefix = f"{directory}/" if directory else ""
+                for item in items:
+                    path = prefix + item["name"]
+                    files[path] = CloudFile(
+                        path=path,
+                        type=item["type"],
+                        size=item.get("size"),
+                        modified=parse_datetime(item["modified"]),
+                        md5=item.get("md5"),
+                    )
+                    if item["type"] == "dir":
+                        directories.append(path)
+        logger.info("Получен список файлов в облаке, ресурсов: {}", len(files))
+        return files
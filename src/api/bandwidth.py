@@ -0,0 +1,302 @@
+import asyncio
+from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from threading import Condition, Lock
+from time import monotonic
+
+from loguru import logger
+
+from metrics import UPLOAD_CONCURRENCY, UPLOAD_RATE
+
+from .retry import RateLimiter
+
+ADJUST_INTERVAL = 2.0
+TOLERANCE = 0.05
+CAPPED_SHARE = 0.9
+
+
+class _Lane:
+    """Одновременные загрузки файлов одного размера и их скорость за интервал"""
+
+    def __init__(self, name: str, maximum: int) -> None:
+        """
+        Инициализатор класса
+
+        :param name: small или large
+        :param maximum: наибольшее количество одновременных загрузок,
+         0 - без ограничения
+        """
+        self.name = name
+        self.maximum = maximum
+        self.limit = maximum
+        self.active = 0
+        self.saturated = False
+        self.sent = 0
+        self.rate = 0.0
+        self.step = -1
+
+    def is_full(self) -> bool:
+        """
+        Проверяет, что новая загрузка должна ждать освобождения места
+
+        :return: bool
+        """
+        return bool(self.maximum) and self.active >= self.limit
+
+
+class BaseBandwidthScheduler(ABC):
+    """
+    Общая логика планировщика загрузок: ограничение суммарной скорости,
+    измерение скорости и подбор количества одновременных загрузок.
+    Маленькие и большие файлы загружаются в отдельных полосах со своими ограничениями,
+    поэтому несколько больших файлов не занимают все соединения.
+    Суммарная скорость всех загрузок ограничивается общим token bucket в байтах.
+    Раз в ADJUST_INTERVAL секунд по измеренной скорости каждой полосы,
+    в которой загрузкам не хватало мест, ее ограничение сдвигается на единицу:
+    в ту же сторону, если скорость выросла, в обратную - если упала,
+    и вниз, если скорость не изменилась: лишние соединения не ускоряют загрузку.
+    Пока суммарная скорость упирается в общее ограничение, ограничения полос не растут.
+    Наследники определяют, как загрузка ждет свободного места
+    """
+
+    def __init__(
+        self,
+        rate: float = 0,
+        small_concurrency: int = 0,
+        large_concurrency: int = 0,
+        large_file_size: int = 64 * 1024 * 1024,
+        adaptive: bool = False,
+    ) -> None:
+        """
+        Инициализатор класса
+
+        :param rate: ограничение суммарной скорости загрузки (в байтах в секунду),
+         0 - без ограничения
+        :param small_concurrency: наибольшее количество одновременных загрузок
+         маленьких файлов, 0 - без ограничения
+        :param large_concurrency: наибольшее количество одновременных загрузок
+         больших файлов, 0 - большие файлы загружаются в полосе маленьких
+        :param large_file_size: размер файла (в байтах),
+         начиная с которого он считается большим
+        :param adaptive: подбирать ли количество одновременных загрузок по скорости
+        """
+        self._rate_limit = rate
+        self._limiter = RateLimiter(rate=rate, burst=int(rate)) if rate else None
+        self._large_file_size = large_file_size
+        self._adaptive = adaptive
+        self._small = _Lane("small", small_concurrency)
+        self._large = _Lane("large", large_concurrency)
+        self._lock = Lock()
+        self._window_start = monotonic()
+        self._sent = 0
+        self._rate = 0.0
+        UPLOAD_RATE.set_function(self.rate)
+        for lane in (self._small, self._large):
+            UPLOAD_CONCURRENCY.set_function(
+                lambda lane=lane: lane.limit if lane.maximum else 0, lane=lane.name
+            )
+
+    def _lane(self, size: int) -> _Lane:
+        """
+        Полоса, в которой загружается файл
+
+        :param size: размер файла в байтах
+        :return: _Lane
+        """
+        if self._large.maximum and size >= self._large_file_size:
+            return self._large
+        return self._small
+
+    @abstractmethod
+    def _wake(self) -> None:
+        """
+        Будит загрузки, которые ждут свободного места. Вызывается под self._lock
+
+        :return: None
+        """
+
+    def _enter(self, lane: _Lane) -> None:
+        """
+        Занимает место в полосе. Вызывается под self._lock
+
+        :param lane: полоса
+        :return: None
+        """
+        lane.active += 1
+        if lane.maximum and lane.active >= lane.limit:
+            lane.saturated = True
+
+    def _leave(self, lane: _Lane) -> None:
+        """
+        Освобождает место в полосе
+
+        :param lane: полоса
+        :return: None
+        """
+        with self._lock:
+            lane.active -= 1
+            self._wake()
+
+    def _transferred(self, lane: _Lane, size: int) -> float:
+        """
+        Учитывает отправленный блок и при необходимости пересматривает ограничения
+
+        :param lane: полоса, в которой загружается файл
+        :param size: размер блока в байтах
+        :return: сколько секунд нужно подождать перед отправкой блока
+        """
+        with self._lock:
+            lane.sent += size
+            self._sent += size
+            now = monotonic()
+            if now - self._window_start >= ADJUST_INTERVAL:
+                self._adjust(now)
+        if self._limiter is None:
+            return 0.0
+        return self._limiter.reserve(size)
+
+    def _adjust(self, now: float) -> None:
+        """
+        Подводит итоги интервала измерения и сдвигает ограничения полос.
+        Вызывается под self._lock
+
+        :param now: текущее время по monotonic
+        :return: None
+        """
+        elapsed = now - self._window_start
+        self._rate = self._sent / elapsed
+        capped = self._limiter is not None and (
+            self._rate >= self._rate_limit * CAPPED_SHARE
+        )
+        changed = False
+        for lane in (self._small, self._large):
+            rate = lane.sent / elapsed
+            if self._adaptive and lane.maximum:
+                changed |= self._adjust_lane(lane, rate, capped)
+            lane.rate = rate
+            lane.sent = 0
+            lane.saturated = lane.is_full()
+        self._sent = 0
+        self._window_start = now
+        if changed:
+            self._wake()
+
+    @staticmethod
+    def _adjust_lane(lane: _Lane, rate: float, capped: bool) -> bool:
+        """
+        Сдвигает ограничение полосы на единицу по изменению ее скорости.
+        Полоса, в которой хватало мест, не меняется, а при нехватке мест
+        сначала пробует увеличить ограничение.
+        Пока суммарная скорость упирается в общее ограничение, полоса не меняется
+
+        :param lane: полоса
+        :param rate: скорость полосы за интервал (в байтах в секунду)
+        :param capped: упирается ли суммарная скорость в общее ограничение
+        :return: True, если ограничение увеличилось
+        """
+        if not lane.saturated:
+            lane.step = 1
+            return False
+        if capped:
+            lane.step = -1
+            return False
+        if rate < lane.rate * (1 - TOLERANCE):
+            lane.step = -lane.step
+        elif rate <= lane.rate * (1 + TOLERANCE):
+            lane.step = -1
+        limit = min(max(lane.limit + lane.step, 1), lane.maximum)
+        if limit == lane.limit:
+            return False
+        logger.debug(
+            "Одновременных загрузок в полосе {}: {} (скорость {:.1f} КБ/с)",
+            lane.name,
+            limit,
+            rate / 1024,
+        )
+        grown = limit > lane.limit
+        lane.limit = limit
+        return grown
+
+    def rate(self) -> float:
+        """
+        Суммарная скорость загрузки за последний завершенный интервал измерения.
+        Если интервал затянулся без загрузок, скорость считается по нему
+
+        :return: байты в секунду
+        """
+        with self._lock:
+            elapsed = monotonic() - self._window_start
+            if elapsed >= ADJUST_INTERVAL:
+                return self._sent / elapsed
+            return self._rate
+
+
+class BandwidthScheduler(BaseBandwidthScheduler):
+    """Планировщик загрузок для пула потоков"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._condition = Condition(self._lock)
+
+    def _wake(self) -> None:
+        self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, size: int) -> Iterator[Callable[[int], float]]:
+        """
+        Ждет свободного места в полосе файла и занимает его на время загрузки
+
+        :param size: размер файла в байтах
+        :return: контекстный менеджер, который отдает функцию учета отправленных блоков.
+         Функция возвращает, сколько секунд подождать перед отправкой блока
+        """
+        lane = self._lane(size)
+        with self._condition:
+            while lane.is_full():
+                lane.saturated = True
+                self._condition.wait()
+            self._enter(lane)
+        try:
+            yield lambda chunk: self._transferred(lane, chunk)
+        finally:
+            self._leave(lane)
+
+
+class AsyncBandwidthScheduler(BaseBandwidthScheduler):
+    """Планировщик загрузок для цикла событий"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._waiters: list[asyncio.Future] = []
+
+    def _wake(self) -> None:
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+    @asynccontextmanager
+    async def slot(self, size: int) -> AsyncIterator[Callable[[int], float]]:
+        """
+        Ждет свободного места в полосе файла и занимает его на время загрузки
+
+        :param size: размер файла в байтах
+        :return: асинхронный контекстный менеджер, который отдает функцию учета
+         отправленных блоков. Функция возвращает, сколько секунд подождать
+         перед отправкой блока
+        """
+        lane = self._lane(size)
+        while True:
+            with self._lock:
+                if not lane.is_full():
+                    self._enter(lane)
+                    break
+                lane.saturated = True
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
+            await waiter
+        try:
+            yield lambda chunk: self._transferred(lane, chunk)
+        finally:
+            self._leave(lane)
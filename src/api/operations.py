@@ -0,0 +1,369 @@
+import asyncio
+from abc import ABC, abstractmethod
+from collections.abc import Awaitable, Callable
+from threading import Condition, Thread
+from time import monotonic, sleep
+from typing import NamedTuple
+from weakref import WeakSet
+
+from loguru import logger
+
+from metrics import PENDING_OPERATIONS
+
+from .async_yandex_disk import AsyncYandexApi
+from .yandex_disk import YandexApi
+
+SUCCESS = "success"
+FAILED = "failed"
+
+POLLERS: WeakSet["BaseOperationPoller"] = WeakSet()
+
+
+class Operation(NamedTuple):
+    """Асинхронная операция, которую сервер принял к выполнению"""
+
+    href: str
+    name: str
+    paths: tuple[str, ...]
+    on_finish: Callable[[bool], None | Awaitable[None]]
+    started: float
+    owner: str
+
+
+class BaseOperationPoller(ABC):
+    """
+    Общий реестр асинхронных операций апи (ответ 202 со ссылкой на операцию).
+    Запросы, принятые сервером, не занимают поток или задачу до завершения операции:
+    ссылка передается опросчику, а результат сообщается через on_finish.
+    Один опросчик обслуживает все пары директорий: операции каждой директории (owner)
+    опрашиваются через апи, зарегистрированный для нее в register.
+    Наследники определяют, где выполняется опрос
+    """
+
+    def __init__(self, interval: float, timeout: float) -> None:
+        """
+        Инициализатор класса
+
+        :param interval: интервал между опросами статусов операций (в секундах)
+        :param timeout: время (в секундах), после которого операция считается неудачной
+        """
+        self._interval = interval
+        self._timeout = timeout
+        self._operations: dict[str, Operation] = {}
+        self._apis: dict[str, YandexApi | AsyncYandexApi] = {}
+        self._changed = Condition()
+        POLLERS.add(self)
+        PENDING_OPERATIONS.set_function(lambda: sum(map(len, list(POLLERS))))
+
+    def __len__(self) -> int:
+        """
+        Количество незавершенных операций
+
+        :return: int
+        """
+        with self._changed:
+            return len(self._operations)
+
+    def register(self, owner: str, yandex_api: YandexApi | AsyncYandexApi) -> None:
+        """
+        Запоминает апи, через который опрашиваются операции директории
+
+        :param owner: синхронизируемая директория
+        :param yandex_api: экземпляр YandexApi или AsyncYandexApi этой директории
+        :return: None
+        """
+        with self._changed:
+            self._apis[owner] = yandex_api
+
+    def paths(self, owner: str | None = None) -> set[str]:
+        """
+        Пути, к которым относятся незавершенные операции
+
+        :param owner: учитывать только операции этой директории, None - всех директорий
+        :return: множество путей
+        """
+        with self._changed:
+            return {
+                path
+                for operation in self._operations.values()
+                if owner is None or operation.owner == owner
+                for path in operation.paths
+            }
+
+    @abstractmethod
+    def track(
+        self,
+        href: str,
+        name: str,
+        paths: tuple[str, ...],
+        on_finish: Callable[[bool], None | Awaitable[None]],
+        owner: str = "",
+    ) -> None:
+        """
+        Передает операцию на отслеживание
+
+        :param href: ссылка на операцию
+        :param name: название операции для логов
+        :param paths: пути, к которым относится операция
+        :param on_finish: функция, которая получит True, если операция выполнена успешно
+        :param owner: синхронизируемая директория, апи которой опрашивается операция
+        :return: None
+        """
+
+    def _add(
+        self,
+        href: str,
+        name: str,
+        paths: tuple[str, ...],
+        on_finish: Callable[[bool], None | Awaitable[None]],
+        owner: str,
+    ) -> None:
+        """
+        Запоминает операцию
+
+        :param href: ссылка на операцию
+        :param name: название операции для логов
+        :param paths: пути, к которым относится операция
+        :param on_finish: функция, которая получит True, если операция выполнена успешно
+        :param owner: синхронизируемая директория
+        :return: None
+        """
+        with self._changed:
+            self._operations[href] = Operation(
+                href=href,
+                name=name,
+                paths=paths,
+                on_finish=on_finish,
+                started=monotonic(),
+                owner=owner,
+            )
+            self._changed.notify_all()
+        logger.debug("Операция {} для {} выполняется на сервере", name, paths)
+
+    def _waiting(self, paths: set[str] | None, owner: str | None) -> bool:
+        """
+        Проверяет, есть ли незавершенные операции с путями
+
+        :param paths: пути или None - любые пути
+        :param owner: директория или None - любые директории
+        :return: bool
+        """
+        with self._changed:
+            return any(
+                paths is None or not paths.isdisjoint(operation.paths)
+                for operation in self._operations.values()
+                if owner is None or operation.owner == owner
+            )
+
+    def _pending(self) -> list[Operation]:
+        """
+        Снимок незавершенных операций
+
+        :return: список операций
+        """
+        with self._changed:
+            return list(self._operations.values())
+
+    def _check(self, operation: Operation, status: str | None) -> None:
+        """
+        Завершает операцию, если сервер сообщил результат или истекло время ожидания.
+        Операция остается незавершенной, пока выполняется on_finish, поэтому
+        задачи, которые ставит on_finish, появляются раньше, чем закончится ожидание
+
+        :param operation: операция
+        :param status: статус операции или None, если его не удалось получить
+        :return: None
+        """
+        success = self._outcome(operation, status)
+        if success is None:
+            return
+        try:
+            operation.on_finish(success)
+        except Exception:
+            logger.exception("Ошибка при обработке результата операции {}", operation)
+        self._remove(operation)
+
+    def _outcome(self, operation: Operation, status: str | None) -> bool | None:
+        """
+        Определяет и логирует результат операции
+
+        :param operation: операция
+        :param status: статус операции или None, если его не удалось получить
+        :return: True или False, если операция завершена,
+         None, если ее результат еще неизвестен
+        """
+        if status not in (SUCCESS, FAILED):
+            if monotonic() - operation.started < self._timeout:
+                return None
+            logger.error(
+                "Операция {} для {} не завершилась за {} с",
+                operation.name,
+                operation.paths,
+                self._timeout,
+            )
+        elif status == FAILED:
+            logger.error(
+                "Сервер не смог выполнить операцию {} для {}",
+                operation.name,
+                operation.paths,
+            )
+        else:
+            logger.info("Операция {} для {} выполнена", operation.name, operation.paths)
+        return status == SUCCESS
+
+    def _remove(self, operation: Operation) -> None:
+        """
+        Забывает завершенную операцию
+
+        :param operation: операция
+        :return: None
+        """
+        with self._changed:
+            self._operations.pop(operation.href, None)
+            self._changed.notify_all()
+
+
+class OperationPoller(BaseOperationPoller):
+    """Опрашивает статусы асинхронных операций в одном фоновом потоке"""
+
+    def __init__(self, interval: float, timeout: float) -> None:
+        """
+        Инициализатор класса
+
+        :param interval: интервал между опросами статусов операций (в секундах)
+        :param timeout: время (в секундах), после которого операция считается неудачной
+        """
+        super().__init__(interval=interval, timeout=timeout)
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def track(
+        self,
+        href: str,
+        name: str,
+        paths: tuple[str, ...],
+        on_finish: Callable[[bool], None],
+        owner: str = "",
+    ) -> None:
+        """
+        Передает операцию на отслеживание
+
+        :param href: ссылка на операцию
+        :param name: название операции для логов
+        :param paths: пути, к которым относится операция
+        :param on_finish: функция, которая будет вызвана в потоке опроса
+         с True, если операция выполнена успешно
+        :param owner: синхронизируемая директория, апи которой опрашивается операция
+        :return: None
+        """
+        self._add(href, name, paths, on_finish, owner)
+
+    def _run(self) -> None:
+        """
+        Ждет появления операций и опрашивает их статусы, пока они не завершатся
+
+        :return: None
+        """
+        while True:
+            with self._changed:
+                while not self._operations:
+                    self._changed.wait()
+            sleep(self._interval)
+            for operation in self._pending():
+                yandex_api = self._apis[operation.owner]
+                self._check(operation, yandex_api.operation_status(operation.href))
+
+    def wait(self, paths: set[str] | None = None, owner: str | None = None) -> None:
+        """
+        Ждет завершения операций
+
+        :param paths: пути, операции с которыми нужно дождаться, None - все операции
+        :param owner: ждать только операций этой директории, None - всех директорий
+        :return: None
+        """
+        with self._changed:
+            while self._waiting(paths, owner):
+                self._changed.wait()
+
+
+class AsyncOperationPoller(BaseOperationPoller):
+    """Опрашивает статусы асинхронных операций в задаче цикла событий"""
+
+    def __init__(self, interval: float, timeout: float) -> None:
+        """
+        Инициализатор класса
+
+        :param interval: интервал между опросами статусов операций (в секундах)
+        :param timeout: время (в секундах), после которого операция считается неудачной
+        """
+        super().__init__(interval=interval, timeout=timeout)
+        self._task: asyncio.Task | None = None
+
+    def track(
+        self,
+        href: str,
+        name: str,
+        paths: tuple[str, ...],
+        on_finish: Callable[[bool], Awaitable[None]],
+        owner: str = "",
+    ) -> None:
+        """
+        Передает операцию на отслеживание. Вызывается из цикла событий
+
+        :param href: ссылка на операцию
+        :param name: название операции для логов
+        :param paths: пути, к которым относится операция
+        :param on_finish: корутинная функция, которая будет вызвана в цикле событий
+         с True, если операция выполнена успешно. Операция остается незавершенной,
+         пока корутина не выполнится
+        :param owner: синхронизируемая директория, апи которой опрашивается операция
+        :return: None
+        """
+        self._add(href, name, paths, on_finish, owner)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        """
+        Опрашивает статусы операций, пока они не завершатся.
+        Статусы всех операций запрашиваются одновременно
+
+        :return: None
+        """
+        while operations := self._pending():
+            await asyncio.sleep(self._interval)
+            statuses = await asyncio.gather(
+                *(
+                    self._apis[operation.owner].operation_status(operation.href)
+                    for operation in operations
+                )
+            )
+            for operation, status in zip(operations, statuses):
+                success = self._outcome(operation, status)
+                if success is None:
+                    continue
+                try:
+                    await operation.on_finish(success)
+                except Exception:
+                    logger.exception(
+                        "Ошибка при обработке результата операции {}", operation
+                    )
+                self._remove(operation)
+
+    async def wait(
+        self, paths: set[str] | None = None, owner: str | None = None
+    ) -> None:
+        """
+        Ждет завершения операций
+
+        :param paths: пути, операции с которыми нужно дождаться, None - все операции
+        :param owner: ждать только операций этой директории, None - всех директорий
+        :return: None
+        """
+        while self._task is not None and not self._task.done():
+            if paths is None and owner is None:
+                await self._task
+            elif self._waiting(paths, owner):
+                await asyncio.sleep(self._interval)
+            else:
+                return
@@ -0,0 +1,277 @@
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from time import monotonic
+
+from loguru import logger
+
+TOO_MANY_REQUESTS = 429
+RETRY_STATUSES = frozenset((TOO_MANY_REQUESTS, 500, 502, 503, 504))
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Разбирает заголовок Retry-After
+
+    :param value: количество секунд или дата в формате HTTP
+    :return: время ожидания в секундах или None, если заголовка нет или он некорректен
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max((moment - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class RateLimiter:
+    """
+    Общий для всех потоков и задач ограничитель частоты запросов (token bucket).
+    Кроме того, позволяет приостановить все запросы, когда сервер просит подождать
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        """
+        Инициализатор класса
+
+        :param rate: допустимое количество запросов в секунду, 0 - без ограничения
+        :param burst: количество запросов, которые можно отправить подряд без ожидания
+        """
+        self._rate = rate
+        self._burst = max(burst, 1)
+        self._tokens = float(self._burst)
+        self._updated = monotonic()
+        self._paused_until = 0.0
+        self._lock = Lock()
+
+    def reserve(self, tokens: float = 1) -> float:
+        """
+        Резервирует право на запрос или на передачу нескольких единиц, например байт
+
+        :param tokens: сколько единиц резервируется
+        :return: сколько секунд нужно подождать перед отправкой запроса
+        """
+        with self._lock:
+            now = monotonic()
+            pause = max(self._paused_until - now, 0.0)
+            if not self._rate:
+                return pause
+            self._tokens = min(
+                self._burst, self._tokens + (now - self._updated) * self._rate
+            )
+            self._updated = now
+            self._tokens -= tokens
+            return max(pause, -self._tokens / self._rate)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Приостанавливает все запросы
+
+        :param seconds: на сколько секунд
+        :return: None
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, monotonic() + seconds)
+
+    def paused(self) -> float:
+        """
+        Оставшееся время приостановки
+
+        :return: секунды
+        """
+        with self._lock:
+            return max(self._paused_until - monotonic(), 0.0)
+
+
+class CircuitBreaker:
+    """
+    Размыкает цепь после серии ошибок подряд: пока цепь разомкнута,
+    запросы не отправляются. По истечении таймаута пропускается один пробный запрос,
+    и цепь замыкается, если он завершился успешно
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float) -> None:
+        """
+        Инициализатор класса
+
+        :param threshold: количество ошибок подряд, после которого цепь размыкается,
+         0 - не размыкается никогда
+        :param reset_timeout: время (в секундах), через которое отправляется пробный запрос
+        """
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+        self._lock = Lock()
+
+    def allow(self) -> bool:
+        """
+        Проверяет, можно ли отправить запрос
+
+        :return: bool
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or monotonic() - self._opened_at < self._reset_timeout:
+                return False
+            self._probing = True
+            return True
+
+    def remaining(self) -> float:
+        """
+        Время до следующего пробного запроса
+
+        :return: секунды, 0 - если цепь замкнута
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(self._opened_at + self._reset_timeout - monotonic(), 0.0)
+
+    def record_success(self) -> None:
+        """
+        Отмечает успешный ответ сервера
+
+        :return: None
+        """
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Соединение с api восстановлено")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        """
+        Отмечает ошибку соединения или ответ сервера с ошибкой
+
+        :return: None
+        """
+        with self._lock:
+            self._failures += 1
+            if not self._threshold:
+                return
+            if self._probing or (
+                self._opened_at is None and self._failures >= self._threshold
+            ):
+                logger.warning(
+                    "Запросы к api приостановлены на {} с после {} ошибок подряд",
+                    self._reset_timeout,
+                    self._failures,
+                )
+                self._opened_at = monotonic()
+                self._probing = False
+
+
+class RetryPolicy:
+    """
+    Политика повторов запросов: экспоненциальная задержка со случайным разбросом,
+    учет Retry-After, общий ограничитель частоты и размыкатель цепи.
+    Один экземпляр разделяется всеми потоками и задачами, отправляющими запросы
+    """
+
+    def __init__(
+        self,
+        attempts: int = 5,
+        base_delay: float = 1,
+        max_delay: float = 60,
+        limiter: RateLimiter | None = None,
+        breaker: CircuitBreaker | None = None,
+    ) -> None:
+        """
+        Инициализатор класса
+
+        :param attempts: количество повторов после первой неудачной попытки
+        :param base_delay: задержка (в секундах) перед первым повтором
+        :param max_delay: максимальная задержка (в секундах) между повторами
+        :param limiter: ограничитель частоты запросов, по умолчанию без ограничения
+        :param breaker: размыкатель цепи, по умолчанию не размыкается
+        """
+        self.attempts = attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._limiter = limiter or RateLimiter(rate=0, burst=1)
+        self._breaker = breaker or CircuitBreaker(threshold=0, reset_timeout=0)
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Экспоненциальная задержка с полным случайным разбросом,
+        чтобы потоки не повторяли запросы одновременно
+
+        :param attempt: номер попытки, начиная с 0
+        :return: секунды
+        """
+        return random.uniform(
+            0, min(self._max_delay, self._base_delay * 2 ** min(attempt, 32))
+        )
+
+    def before_request(self) -> float | None:
+        """
+        Вызывается перед каждой попыткой
+
+        :return: сколько секунд подождать перед отправкой
+         или None, если запросы приостановлены размыкателем цепи
+        """
+        if not self._breaker.allow():
+            return None
+        return self._limiter.reserve()
+
+    def on_error(self, attempt: int, retryable: bool = True) -> float | None:
+        """
+        Вызывается при ошибке соединения, таймауте или другой ошибке запроса
+
+        :param attempt: номер попытки, начиная с 0
+        :param retryable: имеет ли смысл повторять запрос
+        :return: задержка перед повтором или None, если повторять не нужно
+        """
+        self._breaker.record_failure()
+        if not retryable or attempt >= self.attempts:
+            return None
+        return self.backoff(attempt)
+
+    def on_response(
+        self, attempt: int, status_code: int, retry_after: str | None
+    ) -> float | None:
+        """
+        Вызывается при получении ответа
+
+        :param attempt: номер попытки, начиная с 0
+        :param status_code: статус ответа
+        :param retry_after: значение заголовка Retry-After
+        :return: задержка перед повтором или None, если ответ нужно вернуть
+        """
+        if status_code not in RETRY_STATUSES:
+            self._breaker.record_success()
+            return None
+        delay = parse_retry_after(retry_after)
+        if status_code == TOO_MANY_REQUESTS:
+            delay = max(delay or 0.0, self.backoff(attempt))
+            self._limiter.pause(delay)
+        else:
+            self._breaker.record_failure()
+        if attempt >= self.attempts:
+            return None
+        return delay if delay is not None else self.backoff(attempt)
+
+    def recovery_delay(self, failures: int) -> float:
+        """
+        Сколько подождать перед повтором операции, которая не удалась целиком
+
+        :param failures: количество неудач подряд
+        :return: секунды
+        """
+        return max(
+            self._breaker.remaining(),
+            self._limiter.paused(),
+            self._base_delay + self.backoff(failures),
+        )
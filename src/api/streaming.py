@@ -0,0 +1,218 @@
+import hashlib
+from collections.abc import Callable
+from time import monotonic, sleep
+from typing import BinaryIO
+
+
+class FileChangedError(Exception):
+    """Размер файла изменился во время загрузки"""
+
+
+class UploadStream:
+    """
+    Файлоподобная обертка для потоковой загрузки файла.
+    Читает файл блоками фиксированного размера, поэтому потребление памяти
+    не зависит от размера файла, считает количество отправленных байт
+    и md5 отправленного содержимого.
+    Отправляется ровно size байт, объявленных в Content-Length. Если файл
+    укоротился или вырос во время загрузки, чтение прерывается FileChangedError,
+    а загрузка повторяется в следующем цикле синхронизации.
+    Перед отправкой каждого блока выдерживает паузу, назначенную планировщиком загрузок
+    """
+
+    def __init__(
+        self,
+        file: BinaryIO,
+        size: int,
+        chunk_size: int,
+        throttle: Callable[[int], float] | None = None,
+    ) -> None:
+        """
+        Инициализатор класса
+
+        :param file: файл, открытый в бинарном режиме
+        :param size: размер файла в байтах, передается в заголовке Content-Length
+        :param chunk_size: размер блока, который читается и отправляется за один раз
+        :param throttle: функция, которая учитывает размер блока и возвращает,
+         сколько секунд подождать перед его отправкой
+        """
+        self.throttle = throttle
+        self._file = file
+        self._size = size
+        self._chunk_size = chunk_size
+        self._started: float | None = None
+        self._finished: float | None = None
+        self._md5 = hashlib.md5()
+        self.sent = 0
+        self.changed = False
+
+    def __len__(self) -> int:
+        return self._size
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Читает следующий блок файла и ждет, если этого требует планировщик загрузок.
+        Размер, запрошенный http клиентом, игнорируется в пользу chunk_size
+
+        :param size: запрошенный размер
+        :return: блок не больше chunk_size байт или пустая строка в конце файла
+        """
+        chunk = self.read_chunk()
+        if chunk and self.throttle is not None:
+            delay = self.throttle(len(chunk))
+            if delay > 0:
+                sleep(delay)
+        return chunk
+
+    def read_chunk(self) -> bytes:
+        """
+        Читает следующий блок файла без ожидания, но не дальше объявленного размера
+
+        :return: блок не больше chunk_size байт или пустая строка,
+         когда отправлено size байт
+        :raises FileChangedError: если файл закончился раньше или продолжается
+         после size байт
+        """
+        if self._started is None:
+            self._started = monotonic()
+        chunk = self._file.read(min(self._chunk_size, self._size - self.sent))
+        if chunk:
+            self.sent += len(chunk)
+            self._md5.update(chunk)
+            return chunk
+        if self.sent < self._size or self._file.read(1):
+            self.changed = True
+            raise FileChangedError(
+                f"Размер файла изменился во время загрузки: объявлено {self._size} байт"
+            )
+        self._finished = monotonic()
+        return chunk
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        """
+        Перемещает позицию чтения в начало файла для повторной отправки
+
+        :param offset: смещение, поддерживается только 0
+        :param whence: точка отсчета, поддерживается только 0
+        :return: новая позиция
+        """
+        if offset or whence:
+            raise OSError("UploadStream поддерживает перемотку только в начало")
+        self._md5 = hashlib.md5()
+        self.sent = self._file.seek(0)
+        return self.sent
+
+    def tell(self) -> int:
+        """
+        Возвращает текущую позицию чтения
+
+        :return: int
+        """
+        return self._file.tell()
+
+    @property
+    def md5(self) -> str:
+        """
+        md5 содержимого, отправленного с начала файла
+
+        :return: шестнадцатеричная строка
+        """
+        return self._md5.hexdigest()
+
+    @property
+    def elapsed(self) -> float:
+        """
+        Время отправки файла (в секундах)
+
+        :return: float
+        """
+        if self._started is None:
+            return 0.0
+        return (self._finished or monotonic()) - self._started
+
+    @property
+    def throughput(self) -> float:
+        """
+        Средняя скорость отправки (в байтах в секунду)
+
+        :return: float
+        """
+        elapsed = self.elapsed
+        return self.sent / elapsed if elapsed else 0.0
+
+
+class DownloadStream:
+    """
+    Приемник для потоковой загрузки файла из облака.
+    Записывает полученные блоки во временный файл сразу, не накапливая их в памяти,
+    считает количество полученных байт и md5 полученного содержимого
+    """
+
+    def __init__(self, file: BinaryIO, chunk_size: int) -> None:
+        """
+        Инициализатор класса
+
+        :param file: временный файл, открытый на запись в бинарном режиме
+        :param chunk_size: размер блока, который читается из ответа за один раз
+        """
+        self._file = file
+        self.chunk_size = chunk_size
+        self._started: float | None = None
+        self._finished: float | None = None
+        self._md5 = hashlib.md5()
+        self.received = 0
+
+    def write(self, chunk: bytes) -> None:
+        """
+        Записывает очередной блок ответа
+
+        :param chunk: блок
+        :return: None
+        """
+        if self._started is None:
+            self._started = monotonic()
+        self._file.write(chunk)
+        self._md5.update(chunk)
+        self.received += len(chunk)
+        self._finished = monotonic()
+
+    def reset(self) -> None:
+        """
+        Очищает файл перед повторной загрузкой
+
+        :return: None
+        """
+        self._file.seek(0)
+        self._file.truncate()
+        self._md5 = hashlib.md5()
+        self.received = 0
+
+    @property
+    def md5(self) -> str:
+        """
+        md5 полученного содержимого
+
+        :return: шестнадцатеричная строка
+        """
+        return self._md5.hexdigest()
+
+    @property
+    def elapsed(self) -> float:
+        """
+        Время получения файла (в секундах)
+
+        :return: float
+        """
+        if self._started is None:
+            return 0.0
+        return (self._finished or monotonic()) - self._started
+
+    @property
+    def throughput(self) -> float:
+        """
+        Средняя скорость получения (в байтах в секунду)
+
+        :return: float
+        """
+        elapsed = self.elapsed
+        return self.received / elapsed if elapsed else 0.0
@@ -1,14 +1,88 @@
 import os.path
+from collections import deque
+from collections.abc import Iterator
+from contextlib import suppress
+from copy import copy
 from datetime import datetime
+from http import HTTPStatus
 from time import sleep
+from typing import NamedTuple, Self
+from uuid import uuid4
 
 import requests
 from loguru import logger
 
+from metrics import DOWNLOADED_BYTES, UPLOADED_BYTES
+
 from .api_mixin import HandleRequestMixin
+from .bandwidth import BandwidthScheduler
+from .retry import RetryPolicy
+from .streaming import DownloadStream, UploadStream
 
 NOT_OVERWRITING = ("false", "загружен")
 OVERWRITING = ("true", "перезаписан")
+API_URL = "https://cloud-api.yandex.net/v1/disk"
+LIST_PAGE_SIZE = 1000
+DOWNLOAD_SUFFIX = ".yadisk-download"
+LIST_FIELDS = ",".join(
+    f"_embedded.items.{field}" for field in ("name", "type", "size", "modified", "md5")
+)
+
+
+class ListingError(Exception):
+    """Ошибка при получении одной из страниц списка файлов"""
+
+
+class CloudFile(NamedTuple):
+    """Информация о ресурсе в облаке"""
+
+    path: str
+    type: str
+    size: int | None
+    modified: datetime
+    md5: str | None
+
+
+def parse_datetime(value: str) -> datetime:
+    """
+    Преобразует дату из ответа api в datetime в UTC без часового пояса
+
+    :param value: дата в формате ISO 8601
+    :return: datetime
+    """
+    return datetime.strptime(value.split("+")[0], "%Y-%m-%dT%H:%M:%S")
+
+
+def operation_result(response, statuses: tuple[int, ...]) -> bool | str:
+    """
+    Разбирает ответ на запрос, который сервер может выполнить асинхронно
+
+    :param response: ответ сервера или None, если запрос не удался
+    :param statuses: статусы, означающие, что запрос выполнен
+    :return: ссылка на операцию, если сервер принял запрос к выполнению (202),
+     иначе True, если запрос выполнен, и False, если нет
+    """
+    if response is None:
+        return False
+    if response.status_code == HTTPStatus.ACCEPTED:
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return (body or {}).get("href") or True
+    return response.status_code in statuses
+
+
+def temporary_path(file_path: str) -> str:
+    """
+    Формирует путь к временному файлу для скачивания рядом с целевым файлом,
+    чтобы его можно было атомарно переименовать в целевой
+
+    :param file_path: путь к целевому файлу
+    :return: путь к временному файлу
+    """
+    directory, name = os.path.split(file_path)
+    return os.path.join(directory, f".{name}.{uuid4().hex}{DOWNLOAD_SUFFIX}")
 
 
 class YandexApi(HandleRequestMixin):
@@ -16,19 +90,92 @@ class YandexApi(HandleRequestMixin):
     Предоставляет методы для работы с апи Яндекс диска
     """
 
-    def __init__(self, token: str, cloud_folder: str, local_folder: str) -> None:
+    def __init__(
+        self,
+        token: str,
+        cloud_folder: str,
+        local_folder: str,
+        pool_size: int = 10,
+        connect_timeout: float = 5,
+        read_timeout: float = 60,
+        chunk_size: int = 1024 * 1024,
+        upload_stats: bool = False,
+        retry_policy: RetryPolicy | None = None,
+        api_url: str = API_URL,
+        page_size: int = LIST_PAGE_SIZE,
+        bandwidth: BandwidthScheduler | None = None,
+    ) -> None:
         """
         Инициализатор класса
 
         :param token: токен доступа к api
         :param cloud_folder: название директории в яндекс диске, которая должна быть связана с local_folder
         :param local_folder: локальная директория для отслеживания
+        :param pool_size: размер пула соединений, равен количеству потоков загрузки
+        :param connect_timeout: таймаут на установку соединения (в секундах)
+        :param read_timeout: таймаут на ожидание данных от сервера (в секундах)
+        :param chunk_size: размер блока (в байтах), которыми файл читается при загрузке
+        :param upload_stats: логировать ли размер, время и скорость загрузки каждого файла
+        :param retry_policy: политика повторов запросов, общая для всех потоков
+        :param api_url: адрес апи Яндекс диска
+        :param page_size: количество ресурсов в одной странице списка файлов
+        :param bandwidth: планировщик загрузок, общий для всех потоков.
+         По умолчанию загрузки не ограничиваются, а только измеряется их скорость
+        """
+        self._set_folder(token, cloud_folder, local_folder)
+        self._chunk_size = chunk_size
+        self._upload_stats = upload_stats
+        self._api_url = api_url
+        self._page_size = page_size
+        self._bandwidth = bandwidth or BandwidthScheduler()
+        self._setup_session(
+            pool_size=pool_size,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            retry_policy=retry_policy,
+        )
+
+    def with_folder(self, token: str, cloud_folder: str, local_folder: str) -> Self:
+        """
+        Создает экземпляр для другой пары директорий, возможно, другого аккаунта.
+        Новый экземпляр использует ту же сессию с пулом соединений и ту же политику повторов,
+        токен передается в заголовке каждого запроса
+
+        :param token: токен доступа к api
+        :param cloud_folder: название директории в яндекс диске
+        :param local_folder: локальная директория для отслеживания
+        :return: новый экземпляр
+        """
+        api = copy(self)
+        api._parent = self._parent or self
+        api._set_folder(token, cloud_folder, local_folder)
+        return api
+
+    def _set_folder(self, token: str, cloud_folder: str, local_folder: str) -> None:
+        """
+        Запоминает токен и пару директорий, сбрасывает сохраненный список файлов
+
+        :param token: токен доступа к api
+        :param cloud_folder: название директории в яндекс диске
+        :param local_folder: локальная директория для отслеживания
+        :return: None
         """
         self._token = token
         self._cloud_folder = cloud_folder
         self._local_folder = local_folder
         self._authorization = {"Authorization": self._token}
         self._path_to_folder = {"path": self._cloud_folder}
+        self._listing: dict[str, CloudFile] | None = None
+        self._listing_revision: int | None = None
+
+    def _cloud_path(self, path: str) -> str:
+        """
+        Формирует путь в облаке
+
+        :param path: путь относительно отслеживаемой директории
+        :return: путь относительно корня диска
+        """
+        return f"{self._cloud_folder}/{path}" if path else self._cloud_folder
 
     def create_cloud_folder_if_not_exists(self) -> None:
         """
@@ -39,48 +186,56 @@ class YandexApi(HandleRequestMixin):
         :return: None
         """
         response = self._make_request(
-            url="https://cloud-api.yandex.net/v1/disk/resources",
+            url=f"{self._api_url}/resources",
             method="put",
             error_text="Облачная директория не создана",
             statuses={requests.codes.created: "Облачная директория создана успешно"},
             params=self._path_to_folder,
             headers=self._authorization,
         )
-        if response is None:
-            while response is None:
-                logger.error(
-                    "Произошла ошибка при получении ответ от сервера. Пробуем снова"
-                )
-                sleep(5)
-                response = self._make_request(
-                    url="https://cloud-api.yandex.net/v1/disk/resources",
-                    method="put",
-                    error_text="Облачная директория не создана",
-                    statuses={
-                        requests.codes.created: "Облачная директория создана успешно"
-                    },
-                    params=self._path_to_folder,
-                    headers=self._authorization,
-                )
+        failures = 0
+        while response is None:
+            delay = self.recovery_delay(failures)
+            logger.error(
+                "Произошла ошибка при получении ответ от сервера."
+                " Пробуем снова через {:.1f} с",
+                delay,
+            )
+            failures += 1
+            sleep(delay)
+            response = self._make_request(
+                url=f"{self._api_url}/resources",
+                method="put",
+                error_text="Облачная директория не создана",
+                statuses={
+                    requests.codes.created: "Облачная директория создана успешно"
+                },
+                params=self._path_to_folder,
+                headers=self._authorization,
+            )
         if response.status_code == requests.codes.unauthorized:
             logger.error("Не получилось авторизоваться, проверьте токен")
             exit(-1)
 
-    def get_files_on_disk(self) -> set[str]:
+    def create_folder(self, path: str) -> bool:
         """
-        Делает запрос на получение всех файлов на диске
+        Создает директорию в облаке
 
-        :return: названия файлов на диске
+        :param path: путь к директории относительно отслеживаемой директории
+        :return: True, если директория создана или уже существовала
         """
         response = self._make_request(
-            url="https://cloud-api.yandex.net/v1/disk/resources",
-            params={**self._path_to_folder, "fields": "_embedded.items.name"},
-            statuses={requests.codes.ok: "Получен список файлов в облаке"},
+            url=f"{self._api_url}/resources",
+            method="put",
+            params={"path": self._cloud_path(path)},
             headers=self._authorization,
-            error_text="Не удалось получить список файлов в облаке",
+            error_text=f"Не удалось создать директорию {path}",
+            statuses={requests.codes.created: f"Директория {path} создана"},
+        )
+        return response is not None and response.status_code in (
+            requests.codes.created,
+            requests.codes.conflict,
         )
-        if response:
-            return {file["name"] for file in response.json()["_embedded"]["items"]}
 
     def _get_link_to_upload(
         self, filename: str, overwrite: tuple[str, str]
@@ -93,9 +248,9 @@ class YandexApi(HandleRequestMixin):
         :return: ссылка или None
         """
         response = self._make_request(
-            url="https://cloud-api.yandex.net/v1/disk/resources/upload",
+            url=f"{self._api_url}/resources/upload",
             params={
-                "path": f"{self._cloud_folder}/{filename}",
+                "path": self._cloud_path(filename),
                 "overwrite": overwrite[0],
                 "fields": "href",
             },
@@ -103,90 +258,342 @@ class YandexApi(HandleRequestMixin):
             headers=self._authorization,
             error_text=f"Не удалось получить ссылку для загрузки {filename}",
         )
-        if response.status_code == requests.codes.ok:
+        if response is not None and response.status_code == requests.codes.ok:
             return response.json()["href"]
         logger.error(f"Не удалось получить ссылку для загрузки {filename}")
         return None
 
-    def load(self, filename: str, overwrite: tuple[str, str] = NOT_OVERWRITING) -> None:
+    def load(
+        self, filename: str, overwrite: tuple[str, str] = NOT_OVERWRITING
+    ) -> str | None:
         """
-        Делает запрос на загрузку файла
+        Делает запрос на загрузку файла.
+        Ссылка на загрузку запрашивается после того, как планировщик загрузок
+        выделил место, поэтому она не устаревает в очереди
 
         :param filename: название файла
         :param overwrite: кортеж из значения, передающегося в апи и сообщения для логирования
-        :return: None
+        :return: md5 загруженного содержимого или None, если файл не принят сервером
         """
-        link_to_upload = self._get_link_to_upload(
-            filename=filename, overwrite=overwrite
-        )
-        if link_to_upload is None:
-            logger.error("Нет ссылки для загрузки {}", filename)
-            return
+        file_path = os.path.join(self._local_folder, filename)
         try:
-            file_path = os.path.join(self._local_folder, filename)
             with open(file=file_path, mode="rb") as file:
-                self._make_request(
-                    url=link_to_upload,
-                    method="put",
-                    error_text=f"Не удалось загрузить {filename} в облако",
-                    files={"file": file},
-                    statuses={
-                        requests.codes.created: f"Файл {filename} успешно {overwrite[1]}",
-                        requests.codes.accepted: "Файл принят сервером,"
-                        " но еще не был перенесен непосредственно в Яндекс Диск",
-                        requests.codes.content_too_large: "Размер файла больше допустимого",
-                        requests.codes.server_error: "Ошибка сервера",
-                        requests.codes.insufficient_storage: "Недостаточно места на сервере",
-                    },
-                )
+                size = os.fstat(file.fileno()).st_size
+                with self._bandwidth.slot(size) as throttle:
+                    link_to_upload = self._get_link_to_upload(
+                        filename=filename, overwrite=overwrite
+                    )
+                    if link_to_upload is None:
+                        logger.error("Нет ссылки для загрузки {}", filename)
+                        return None
+                    stream = UploadStream(
+                        file=file,
+                        size=size,
+                        chunk_size=self._chunk_size,
+                        throttle=throttle,
+                    )
+                    response = self._make_request(
+                        url=link_to_upload,
+                        method="put",
+                        error_text=f"Не удалось загрузить {filename} в облако",
+                        data=stream,
+                        statuses={
+                            requests.codes.created: f"Файл {filename} успешно {overwrite[1]}",
+                            requests.codes.accepted: "Файл принят сервером,"
+                            " но еще не был перенесен непосредственно в Яндекс Диск",
+                            requests.codes.content_too_large: "Размер файла больше допустимого",
+                            requests.codes.server_error: "Ошибка сервера",
+                            requests.codes.insufficient_storage: "Недостаточно места на сервере",
+                        },
+                    )
         except FileNotFoundError:
             logger.exception("Не найден файл по пути {}", file_path)
+            return None
+        if self._upload_stats:
+            logger.info(
+                "Отправлено {} байт файла {} за {:.2f} с ({:.1f} КБ/с)",
+                stream.sent,
+                filename,
+                stream.elapsed,
+                stream.throughput / 1024,
+            )
+        if response is not None and response.status_code in (
+            requests.codes.created,
+            requests.codes.accepted,
+        ):
+            UPLOADED_BYTES.inc(stream.sent)
+            return stream.md5
+        return None
 
-    def reload(self, filename: str) -> None:
+    def reload(self, filename: str) -> str | None:
         """
         Делает запрос на перезапись файла
 
         :param filename: название файла
-        :return: None
+        :return: md5 загруженного содержимого или None, если файл не принят сервером
         """
-        self.load(filename, overwrite=OVERWRITING)
+        return self.load(filename, overwrite=OVERWRITING)
 
-    def delete(self, filename: str) -> None:
+    def _get_link_to_download(self, filename: str) -> str | None:
         """
-        Делает запрос на удаление файла
+        Делает запрос на получение ссылки для скачивания файла
 
         :param filename: название файла
-        :return: None
+        :return: ссылка или None
         """
-        self._make_request(
-            url="https://cloud-api.yandex.net/v1/disk/resources",
+        response = self._make_request(
+            url=f"{self._api_url}/resources/download",
+            params={"path": self._cloud_path(filename), "fields": "href"},
+            headers=self._authorization,
+            error_text=f"Не удалось получить ссылку для скачивания {filename}",
+        )
+        if response is not None and response.status_code == requests.codes.ok:
+            return response.json()["href"]
+        return None
+
+    def download(self, filename: str) -> str | None:
+        """
+        Скачивает файл из облака. Содержимое записывается блоками во временный файл
+        рядом с целевым, который после успешного скачивания атомарно заменяет целевой,
+        поэтому файл в отслеживаемой директории никогда не бывает записан наполовину
+
+        :param filename: название файла
+        :return: md5 скачанного содержимого или None, если файл не скачан
+        """
+        link_to_download = self._get_link_to_download(filename)
+        if link_to_download is None:
+            logger.error("Нет ссылки для скачивания {}", filename)
+            return None
+        file_path = os.path.join(self._local_folder, filename)
+        temp_path = temporary_path(file_path)
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(temp_path, "xb") as file:
+                stream = DownloadStream(file=file, chunk_size=self._chunk_size)
+                response = self._make_request(
+                    url=link_to_download,
+                    error_text=f"Не удалось скачать {filename} из облака",
+                    sink=stream,
+                    statuses={requests.codes.ok: f"Файл {filename} успешно скачан"},
+                )
+            if response is None or response.status_code != requests.codes.ok:
+                return None
+            os.replace(temp_path, file_path)
+        except OSError:
+            logger.exception("Не удалось записать файл по пути {}", file_path)
+            return None
+        finally:
+            with suppress(FileNotFoundError):
+                os.unlink(temp_path)
+        if self._upload_stats:
+            logger.info(
+                "Получено {} байт файла {} за {:.2f} с ({:.1f} КБ/с)",
+                stream.received,
+                filename,
+                stream.elapsed,
+                stream.throughput / 1024,
+            )
+        DOWNLOADED_BYTES.inc(stream.received)
+        return stream.md5
+
+    def delete(self, filename: str) -> bool | str:
+        """
+        Делает запрос на удаление файла или директории вместе с содержимым.
+        Удаление больших директорий сервер выполняет асинхронно
+
+        :param filename: путь к файлу или директории относительно отслеживаемой директории
+        :return: True, если ресурса больше нет в облаке, False, если удалить не удалось,
+         или ссылка на операцию удаления
+        """
+        response = self._make_request(
+            url=f"{self._api_url}/resources",
             method="delete",
-            params={"path": f"{self._cloud_folder}/{filename}"},
+            params={"path": self._cloud_path(filename)},
             headers=self._authorization,
             error_text=f"Не удалось удалить {filename}",
             statuses={requests.codes.no_content: f"{filename} успешно удален"},
         )
+        return operation_result(
+            response, (requests.codes.no_content, requests.codes.not_found)
+        )
 
-    def get_info(self) -> dict[str, datetime] | None:
+    def _transfer(self, operation: str, source: str, destination: str) -> bool | str:
         """
-        Делает запрос на получение информации о файлах.
-        Собирает информацию о последней модификации файлов в облаке
-        :return: словарь с названиями файлов и датами их последних изменений или None
+        Перемещает или копирует ресурс на сервере без повторной загрузки
+
+        :param operation: move или copy
+        :param source: путь к исходному ресурсу относительно отслеживаемой директории
+        :param destination: путь к новому ресурсу относительно отслеживаемой директории
+        :return: True, если сервер выполнил операцию, False, если нет,
+         или ссылка на операцию, если сервер принял ее к выполнению
         """
+        action = "перемещен" if operation == "move" else "скопирован"
         response = self._make_request(
-            url="https://cloud-api.yandex.net/v1/disk/resources",
+            url=f"{self._api_url}/resources/{operation}",
+            method="post",
             params={
-                **self._path_to_folder,
-                "fields": "_embedded.items.modified,_embedded.items.name",
+                "from": self._cloud_path(source),
+                "path": self._cloud_path(destination),
+                "overwrite": "true",
             },
             headers=self._authorization,
-            error_text="Не удалось получить информацию о файлах",
-            statuses={requests.codes.ok: "Информация о модификации файлов получена"},
+            error_text=f"{source} не {action} в {destination}",
+            statuses={
+                requests.codes.created: f"{source} {action} в {destination}",
+                requests.codes.accepted: f"{source} будет {action} в {destination}",
+            },
         )
-        if response:
-            return {
-                file["name"]: datetime.strptime(
-                    file["modified"].split("+")[0], "%Y-%m-%dT%H:%M:%S"
-                )
-                for file in response.json()["_embedded"]["items"]
-            }
+        return operation_result(response, (requests.codes.created,))
+
+    def move(self, source: str, destination: str) -> bool | str:
+        """
+        Делает запрос на перемещение файла или директории со всем содержимым на сервере
+
+        :param source: старый путь
+        :param destination: новый путь
+        :return: True, если ресурс перемещен, False, если нет, или ссылка на операцию
+        """
+        return self._transfer("move", source, destination)
+
+    def copy(self, source: str, destination: str) -> bool | str:
+        """
+        Делает запрос на копирование файла на сервере
+
+        :param source: путь к исходному файлу
+        :param destination: путь к копии
+        :return: True, если файл скопирован, False, если нет, или ссылка на операцию
+        """
+        return self._transfer("copy", source, destination)
+
+    def operation_status(self, href: str) -> str | None:
+        """
+        Делает запрос на получение статуса асинхронной операции
+
+        :param href: ссылка на операцию из ответа 202
+        :return: success, failed, in-progress или None, если статус не получен
+        """
+        response = self._make_request(
+            url=href,
+            headers=self._authorization,
+            error_text="Не удалось получить статус операции",
+        )
+        if response is None or response.status_code != requests.codes.ok:
+            return None
+        return response.json().get("status")
+
+    def _iter_pages(self, path: str) -> Iterator[list[dict]]:
+        """
+        Постранично запрашивает содержимое облачной директории.
+        Бросает ListingError, если не удалось получить одну из страниц
+
+        :param path: путь к директории относительно отслеживаемой директории
+        :return: генератор списков с описаниями ресурсов
+        """
+        offset = 0
+        while True:
+            response = self._make_request(
+                url=f"{self._api_url}/resources",
+                params={
+                    "path": self._cloud_path(path),
+                    "fields": LIST_FIELDS,
+                    "limit": str(self._page_size),
+                    "offset": str(offset),
+                },
+                headers=self._authorization,
+                error_text=f"Не удалось получить список файлов в облаке {path}",
+            )
+            if response is None or response.status_code != requests.codes.ok:
+                raise ListingError
+            items = response.json()["_embedded"]["items"]
+            yield items
+            if len(items) < self._page_size:
+                return
+            offset += len(items)
+
+    def disk_revision(self) -> int | None:
+        """
+        Делает запрос на получение ревизии диска.
+        Ревизия увеличивается при любом изменении на диске
+
+        :return: номер ревизии или None, если его не удалось получить
+        """
+        response = self._make_request(
+            url=self._api_url,
+            params={"fields": "revision"},
+            headers=self._authorization,
+            error_text="Не удалось получить ревизию диска",
+        )
+        if response is None or response.status_code != requests.codes.ok:
+            return None
+        return response.json().get("revision")
+
+    def file_md5(self, filename: str) -> str | None:
+        """
+        Делает запрос на получение md5 файла в облаке
+
+        :param filename: путь к файлу относительно отслеживаемой директории
+        :return: md5 или None, если файла нет в облаке или его не удалось проверить
+        """
+        response = self._make_request(
+            url=f"{self._api_url}/resources",
+            params={"path": self._cloud_path(filename), "fields": "type,md5"},
+            headers=self._authorization,
+            error_text=f"Не удалось проверить файл {filename} в облаке",
+        )
+        if response is None or response.status_code != requests.codes.ok:
+            return None
+        info = response.json()
+        return info.get("md5") if info.get("type") == "file" else None
+
+    def list_files(self) -> dict[str, CloudFile] | None:
+        """
+        Возвращает полный список ресурсов облачной директории.
+        Сначала запрашивается ревизия диска: если она не изменилась
+        с прошлого полного списка, возвращается сохраненный список без обхода директорий.
+        Ревизия запрашивается до обхода, поэтому изменения во время обхода
+        приведут к новому обходу в следующий раз
+
+        :return: словарь из путей ресурсов относительно облачной директории и информации о них
+         или None, если произошла ошибка
+        """
+        revision = self.disk_revision()
+        if revision is not None and revision == self._listing_revision:
+            logger.info("Файлы в облаке не изменились, ревизия диска {}", revision)
+            return self._listing
+        files = self._full_listing()
+        if files is not None:
+            self._listing, self._listing_revision = files, revision
+        return files
+
+    def _full_listing(self) -> dict[str, CloudFile] | None:
+        """
+        Рекурсивно получает полный список ресурсов облачной директории,
+        обходя поддиректории в ширину и запрашивая каждую постранично.
+        Результат используется для поиска новых, удаленных и измененных файлов
+
+        :return: словарь из путей ресурсов относительно облачной директории и информации о них
+         или None, если произошла ошибка
+        """
+        files = {}
+        directories = deque([""])
+        try:
+            while directories:
+                directory = directories.popleft()
+                prefix = f"{directory}/" if directory else ""
+                for items in self._iter_pages(directory):
+                    for item in items:
+                        path = prefix + item["name"]
+                        files[path] = CloudFile(
+                            path=path,
+                            type=item["type"],
+                            size=item.get("size"),
+                            modified=parse_datetime(item["modified"]),
+                            md5=item.get("md5"),
+                        )
+                        if item["type"] == "dir":
+                            directories.append(path)
+        except ListingError:
+            logger.error("Не удалось получить полный список файлов в облаке")
+            return None
+        logger.info("Получен список файлов в облаке, ресурсов: {}", len(files))
+        return files
@@ -1 +1 @@
-from .config import settings
+from .config import SyncPair, settings
@@ -1,4 +1,9 @@
+import hashlib
+import os.path
+from typing import Literal
+
 from dotenv import load_dotenv
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
 load_dotenv()
@@ -14,19 +19,82 @@ class App(BaseSettings):
     """Настройки приложения"""
 
     INTERVAL: int
+    RECONCILE_INTERVAL: int = 3600
+    STATE_FILE: str = "state.db"
+    WATCH: bool = False
+    DEBOUNCE: float = 0.5
+    WORKERS: int = 10
+    LARGE_WORKERS: int = 2
+    LARGE_FILE_SIZE: int = 64 * 1024 * 1024
+    QUEUE_SIZE: int = 10000
+    BACKEND: Literal["threads", "asyncio"] = "threads"
+    ASYNC_CONCURRENCY: int = 100
+    TWO_WAY: bool = False
+    ADAPTIVE_CONCURRENCY: bool = True
+    JOURNAL_COMPACT_RECORDS: int = 10000
+    SETTLE_TIME: float = 2
+    IGNORE_PATTERNS: list[str] = [
+        "*.swp",
+        "*.swo",
+        "*.swx",
+        "4913",
+        "*~",
+        ".#*",
+        "\\#*#",
+        ".~lock.*#",
+        "~$*",
+        "*.tmp",
+        "*.part",
+        "*.crdownload",
+    ]
+
+
+class SyncPair(BaseModel):
+    """
+    Пара из локальной и облачной директорий.
+    Если токен или файл индекса не указаны, они берутся из общих настроек
+    """
+
+    LOCAL_FOLDER: str
+    CLOUD_FOLDER: str
+    TOKEN: str | None = None
+    STATE_FILE: str | None = None
 
 
 class Folders(BaseSettings):
     """Настройки локальной и облачной файловых систем"""
 
-    LOCAL_FOLDER: str
-    CLOUD_FOLDER: str
+    LOCAL_FOLDER: str | None = None
+    CLOUD_FOLDER: str | None = None
+    SYNC_PAIRS: list[SyncPair] = []
 
 
 class Api(BaseSettings):
     """Настройки для работы с API"""
 
-    TOKEN: str
+    TOKEN: str | None = None
+    CONNECT_TIMEOUT: float = 5
+    READ_TIMEOUT: float = 60
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+    UPLOAD_STATS: bool = False
+    MAX_RETRIES: int = 5
+    RETRY_BASE_DELAY: float = 1
+    RETRY_MAX_DELAY: float = 60
+    RATE_LIMIT: float = 20
+    RATE_BURST: int = 20
+    BANDWIDTH_LIMIT: int = 0
+    BREAKER_THRESHOLD: int = 10
+    BREAKER_TIMEOUT: float = 30
+    OPERATION_POLL_INTERVAL: float = 1
+    OPERATION_TIMEOUT: float = 600
+
+
+class Metrics(BaseSettings):
+    """Настройки метрик"""
+
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int = 0
+    METRICS_LOG_INTERVAL: int = 60
 
 
 class Settings(BaseSettings):
@@ -36,6 +104,48 @@ class Settings(BaseSettings):
     FOLDERS: Folders = Folders()
     APP: App = App()
     LOGGING: Logging = Logging()
+    METRICS: Metrics = Metrics()
+
+    def sync_pairs(self) -> list[SyncPair]:
+        """
+        Собирает все пары директорий: LOCAL_FOLDER и CLOUD_FOLDER, если они заданы,
+        и пары из SYNC_PAIRS. Пары без токена получают TOKEN.
+        Пара из LOCAL_FOLDER хранит индекс в STATE_FILE, остальные пары без своего файла -
+        в файле рядом с ним, имя которого зависит от директорий пары
+
+        :return: список пар с заполненными токенами и файлами индекса
+        """
+        pairs = []
+        if self.FOLDERS.LOCAL_FOLDER and self.FOLDERS.CLOUD_FOLDER:
+            pairs.append(
+                SyncPair(
+                    LOCAL_FOLDER=self.FOLDERS.LOCAL_FOLDER,
+                    CLOUD_FOLDER=self.FOLDERS.CLOUD_FOLDER,
+                    STATE_FILE=self.APP.STATE_FILE,
+                )
+            )
+        pairs.extend(self.FOLDERS.SYNC_PAIRS)
+        if not pairs:
+            raise ValueError("Не заданы LOCAL_FOLDER и CLOUD_FOLDER или SYNC_PAIRS")
+        root, extension = os.path.splitext(self.APP.STATE_FILE)
+        resolved = []
+        for pair in pairs:
+            token = pair.TOKEN or self.API.TOKEN
+            if not token:
+                raise ValueError(f"Не задан токен для директории {pair.LOCAL_FOLDER}")
+            key = f"{pair.LOCAL_FOLDER}\0{pair.CLOUD_FOLDER}".encode()
+            state_file = (
+                pair.STATE_FILE
+                or f"{root}-{hashlib.sha1(key).hexdigest()[:8]}{extension}"
+            )
+            resolved.append(
+                pair.model_copy(update={"TOKEN": token, "STATE_FILE": state_file})
+            )
+        for field in ("LOCAL_FOLDER", "STATE_FILE"):
+            values = [getattr(pair, field) for pair in resolved]
+            if len(set(values)) != len(values):
+                raise ValueError(f"{field} повторяется в нескольких парах директорий")
+        return resolved
 
 
 settings = Settings()
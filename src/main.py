@@ -1,41 +1,266 @@
+import asyncio
+
 from loguru import logger
 
-from api import YandexApi
-from core import settings
-from services import FileSynchronization, LocaleTracking
+from api import (
+    AsyncBandwidthScheduler,
+    AsyncOperationPoller,
+    AsyncYandexApi,
+    BandwidthScheduler,
+    CircuitBreaker,
+    OperationPoller,
+    RateLimiter,
+    RetryPolicy,
+    YandexApi,
+)
+from core import SyncPair, settings
+from metrics import MetricsServer, SummaryLogger
+from services import (
+    AsyncFileSynchronization,
+    AsyncTransferPool,
+    DigestCache,
+    FileSynchronization,
+    IgnorePatterns,
+    InotifyWatcher,
+    LocaleTracking,
+    SyncScheduler,
+    SyncState,
+    TransferJournal,
+    TransferPool,
+)
 
 
-def main() -> None:
+def create_watcher(local_folder: str, ignore: IgnorePatterns) -> InotifyWatcher | None:
     """
-    Запускает приложение для синхронизации файлов
+    Создает наблюдателя inotify, если он включен в настройках
+
+    :param local_folder: локальная директория для отслеживания
+    :param ignore: шаблоны путей, на которые не ставятся наблюдения
+    :return: InotifyWatcher или None для режима опроса
+    """
+    if not settings.APP.WATCH:
+        return None
+    try:
+        watcher = InotifyWatcher(
+            local_folder=local_folder, debounce=settings.APP.DEBOUNCE, ignore=ignore
+        )
+    except OSError:
+        logger.exception(
+            "Не удалось включить inotify для {}, используется периодическая проверка",
+            local_folder,
+        )
+        return None
+    logger.debug("Включено отслеживание изменений {} через inotify", local_folder)
+    return watcher
+
 
+def create_storage(pair: SyncPair) -> tuple[SyncState, DigestCache, TransferJournal]:
+    """
+    Загружает индекс синхронизированных файлов, кэш md5 и журнал передач пары директорий.
+    Журнал хранится рядом с индексом
+
+    :param pair: пара директорий
+    :return: индекс, кэш md5 и журнал передач
+    """
+    state = SyncState(path=pair.STATE_FILE)
+    logger.debug(
+        "Загружен индекс синхронизированных файлов {}, записей: {}",
+        pair.LOCAL_FOLDER,
+        len(state),
+    )
+    digests = DigestCache(
+        path=pair.STATE_FILE,
+        local_folder=pair.LOCAL_FOLDER,
+        chunk_size=settings.API.UPLOAD_CHUNK_SIZE,
+    )
+    journal = TransferJournal(
+        path=f"{pair.STATE_FILE}.journal",
+        compact_records=settings.APP.JOURNAL_COMPACT_RECORDS,
+    )
+    return state, digests, journal
+
+
+def run_threads(pairs: list[SyncPair], retry_policy: RetryPolicy) -> None:
+    """
+    Запускает синхронизацию всех пар директорий в общем пуле потоков.
+    Все пары используют одну сессию с пулом соединений, один планировщик
+    и один поток опроса асинхронных операций
+
+    :param pairs: пары директорий
+    :param retry_policy: политика повторов запросов
     :return: None
     """
-    logger.add(settings.LOGGING.LOG_FILE, rotation="5 MB")
-    logger.debug("Добавлено логирование файлов")
+    pool = TransferPool(
+        workers=settings.APP.WORKERS,
+        large_workers=settings.APP.LARGE_WORKERS,
+        large_file_size=settings.APP.LARGE_FILE_SIZE,
+        queue_size=settings.APP.QUEUE_SIZE,
+    )
+    logger.debug("Запущен пул из {} потоков для запросов к api", pool.size)
     api = YandexApi(
-        token=settings.API.TOKEN,
-        cloud_folder=settings.FOLDERS.CLOUD_FOLDER,
-        local_folder=settings.FOLDERS.LOCAL_FOLDER,
+        token=pairs[0].TOKEN,
+        cloud_folder=pairs[0].CLOUD_FOLDER,
+        local_folder=pairs[0].LOCAL_FOLDER,
+        pool_size=pool.size,
+        connect_timeout=settings.API.CONNECT_TIMEOUT,
+        read_timeout=settings.API.READ_TIMEOUT,
+        chunk_size=settings.API.UPLOAD_CHUNK_SIZE,
+        upload_stats=settings.API.UPLOAD_STATS,
+        retry_policy=retry_policy,
+        bandwidth=BandwidthScheduler(
+            rate=settings.API.BANDWIDTH_LIMIT,
+            small_concurrency=settings.APP.WORKERS,
+            large_concurrency=settings.APP.LARGE_WORKERS,
+            large_file_size=settings.APP.LARGE_FILE_SIZE,
+            adaptive=settings.APP.ADAPTIVE_CONCURRENCY,
+        ),
     )
     logger.debug("Создан экземпляр класса YandexApi для работы с Яндекс диском")
-    local_tracking = LocaleTracking(local_folder=settings.FOLDERS.LOCAL_FOLDER)
-    logger.debug(
-        "Создан экземпляр класса LocaleTracking для работы с файловой системой"
+    operations = OperationPoller(
+        interval=settings.API.OPERATION_POLL_INTERVAL,
+        timeout=settings.API.OPERATION_TIMEOUT,
     )
+    ignore = IgnorePatterns(settings.APP.IGNORE_PATTERNS)
+    synchronizations = []
+    for pair in pairs:
+        pair_api = api.with_folder(pair.TOKEN, pair.CLOUD_FOLDER, pair.LOCAL_FOLDER)
+        state, digests, journal = create_storage(pair)
+        synchronizations.append(
+            FileSynchronization(
+                yandex_api=pair_api,
+                local_tracking=LocaleTracking(
+                    local_folder=pair.LOCAL_FOLDER, ignore=ignore
+                ),
+                state=state,
+                digests=digests,
+                journal=journal,
+                operations=operations,
+                pool=pool,
+                interval=settings.APP.INTERVAL,
+                reconcile_interval=settings.APP.RECONCILE_INTERVAL,
+                watcher=create_watcher(pair.LOCAL_FOLDER, ignore),
+                two_way=settings.APP.TWO_WAY,
+                name=pair.LOCAL_FOLDER,
+                settle_time=settings.APP.SETTLE_TIME,
+            )
+        )
+    SyncScheduler(synchronizations).run()
 
-    app = FileSynchronization(
-        yandex_api=api,
-        local_tracking=local_tracking,
-        interval=settings.APP.INTERVAL,
+
+async def run_asyncio(pairs: list[SyncPair], retry_policy: RetryPolicy) -> None:
+    """
+    Запускает синхронизацию всех пар директорий в одном цикле событий.
+    Все пары используют одну сессию с пулом соединений,
+    общие ограничения одновременных запросов и один опросчик асинхронных операций
+
+    :param pairs: пары директорий
+    :param retry_policy: политика повторов запросов
+    :return: None
+    """
+    pool = AsyncTransferPool(
+        concurrency=settings.APP.ASYNC_CONCURRENCY,
+        queue_size=settings.APP.QUEUE_SIZE,
     )
-    logger.info(
-        "Запускается приложение. Отслеживаемая директория на файловой системе - {}. "
-        "Директория на Яндекс диске - {}",
-        settings.FOLDERS.LOCAL_FOLDER,
-        settings.FOLDERS.CLOUD_FOLDER,
+    api = AsyncYandexApi(
+        token=pairs[0].TOKEN,
+        cloud_folder=pairs[0].CLOUD_FOLDER,
+        local_folder=pairs[0].LOCAL_FOLDER,
+        pool_size=settings.APP.ASYNC_CONCURRENCY,
+        connect_timeout=settings.API.CONNECT_TIMEOUT,
+        read_timeout=settings.API.READ_TIMEOUT,
+        chunk_size=settings.API.UPLOAD_CHUNK_SIZE,
+        upload_stats=settings.API.UPLOAD_STATS,
+        retry_policy=retry_policy,
+        bandwidth=AsyncBandwidthScheduler(
+            rate=settings.API.BANDWIDTH_LIMIT,
+            small_concurrency=settings.APP.ASYNC_CONCURRENCY,
+            large_concurrency=settings.APP.LARGE_WORKERS,
+            large_file_size=settings.APP.LARGE_FILE_SIZE,
+            adaptive=settings.APP.ADAPTIVE_CONCURRENCY,
+        ),
+    )
+    logger.debug("Создан экземпляр класса AsyncYandexApi для работы с Яндекс диском")
+    operations = AsyncOperationPoller(
+        interval=settings.API.OPERATION_POLL_INTERVAL,
+        timeout=settings.API.OPERATION_TIMEOUT,
+    )
+    ignore = IgnorePatterns(settings.APP.IGNORE_PATTERNS)
+    synchronizations = []
+    for pair in pairs:
+        pair_api = api.with_folder(pair.TOKEN, pair.CLOUD_FOLDER, pair.LOCAL_FOLDER)
+        state, digests, journal = create_storage(pair)
+        synchronizations.append(
+            AsyncFileSynchronization(
+                yandex_api=pair_api,
+                local_tracking=LocaleTracking(
+                    local_folder=pair.LOCAL_FOLDER, ignore=ignore
+                ),
+                state=state,
+                digests=digests,
+                journal=journal,
+                operations=operations,
+                pool=pool,
+                interval=settings.APP.INTERVAL,
+                reconcile_interval=settings.APP.RECONCILE_INTERVAL,
+                watcher=create_watcher(pair.LOCAL_FOLDER, ignore),
+                two_way=settings.APP.TWO_WAY,
+                name=pair.LOCAL_FOLDER,
+                settle_time=settings.APP.SETTLE_TIME,
+            )
+        )
+    try:
+        await asyncio.gather(
+            *(
+                synchronization.endless_synchronization()
+                for synchronization in synchronizations
+            )
+        )
+    finally:
+        await api.close()
+
+
+def main() -> None:
+    """
+    Запускает приложение для синхронизации файлов
+
+    :return: None
+    """
+    logger.add(settings.LOGGING.LOG_FILE, rotation="5 MB")
+    logger.debug("Добавлено логирование файлов")
+    pairs = settings.sync_pairs()
+
+    retry_policy = RetryPolicy(
+        attempts=settings.API.MAX_RETRIES,
+        base_delay=settings.API.RETRY_BASE_DELAY,
+        max_delay=settings.API.RETRY_MAX_DELAY,
+        limiter=RateLimiter(
+            rate=settings.API.RATE_LIMIT, burst=settings.API.RATE_BURST
+        ),
+        breaker=CircuitBreaker(
+            threshold=settings.API.BREAKER_THRESHOLD,
+            reset_timeout=settings.API.BREAKER_TIMEOUT,
+        ),
     )
-    app.endless_synchronization()
+
+    if settings.METRICS.METRICS_PORT:
+        MetricsServer(
+            host=settings.METRICS.METRICS_HOST, port=settings.METRICS.METRICS_PORT
+        ).start()
+    if settings.METRICS.METRICS_LOG_INTERVAL:
+        SummaryLogger(interval=settings.METRICS.METRICS_LOG_INTERVAL).start()
+
+    for pair in pairs:
+        logger.info(
+            "Запускается приложение. "
+            "Отслеживаемая директория на файловой системе - {}. "
+            "Директория на Яндекс диске - {}",
+            pair.LOCAL_FOLDER,
+            pair.CLOUD_FOLDER,
+        )
+    if settings.APP.BACKEND == "asyncio":
+        asyncio.run(run_asyncio(pairs, retry_policy))
+    else:
+        run_threads(pairs, retry_policy)
 
 
 if __name__ == "__main__":
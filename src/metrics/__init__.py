@@ -0,0 +1,17 @@
+from .exporter import MetricsServer, SummaryLogger
+from .instruments import (
+    CYCLES,
+    DOWNLOADED_BYTES,
+    LAST_STAGE_SECONDS,
+    PENDING_OPERATIONS,
+    QUEUE_DEPTH,
+    REQUEST_SECONDS,
+    STAGE_SECONDS,
+    TRANSFER_SECONDS,
+    UPLOAD_CONCURRENCY,
+    UPLOAD_RATE,
+    UPLOADED_BYTES,
+    endpoint_name,
+    stage,
+)
+from .registry import REGISTRY, Counter, Gauge, Histogram, Registry
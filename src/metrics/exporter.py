@@ -0,0 +1,162 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Thread
+
+from loguru import logger
+
+from .instruments import (
+    CYCLES,
+    DOWNLOADED_BYTES,
+    LAST_STAGE_SECONDS,
+    QUEUE_DEPTH,
+    REQUEST_SECONDS,
+    UPLOAD_RATE,
+    UPLOADED_BYTES,
+)
+from .registry import REGISTRY, Registry
+
+
+class MetricsServer:
+    """Локальный http сервер, который отдает метрики по адресу /metrics"""
+
+    def __init__(self, host: str, port: int, registry: Registry = REGISTRY) -> None:
+        """
+        Инициализатор класса
+
+        :param host: адрес, на котором слушает сервер
+        :param port: порт
+        :param registry: набор метрик
+        """
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self) -> None:
+        """
+        Запускает сервер в фоновом потоке
+
+        :return: None
+        """
+        self._thread.start()
+        host, port = self._server.server_address[:2]
+        logger.info("Метрики доступны по адресу http://{}:{}/metrics", host, port)
+
+    def stop(self) -> None:
+        """
+        Останавливает сервер
+
+        :return: None
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class SummaryLogger:
+    """Периодически пишет в лог сводку метрик за прошедший интервал"""
+
+    def __init__(self, interval: float) -> None:
+        """
+        Инициализатор класса
+
+        :param interval: интервал между сводками (в секундах)
+        """
+        self._interval = interval
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._previous = self._totals()
+
+    @staticmethod
+    def _totals() -> tuple[int, float, int, float, float, float]:
+        """
+        Накопленные значения метрик
+
+        :return: количество и суммарная длительность запросов, количество ошибок,
+         загруженные и скачанные байты и количество циклов
+        """
+        requests, seconds = REQUEST_SECONDS.totals()
+        errors = sum(
+            REQUEST_SECONDS.totals(status=status)[0]
+            for status in ("error", "429", "500", "502", "503", "504")
+        )
+        return (
+            requests,
+            seconds,
+            errors,
+            UPLOADED_BYTES.total(),
+            DOWNLOADED_BYTES.total(),
+            CYCLES.total(),
+        )
+
+    def log(self) -> None:
+        """
+        Пишет сводку за время с предыдущего вызова
+
+        :return: None
+        """
+        current = self._totals()
+        requests, seconds, errors, uploaded, downloaded, cycles = (
+            now - before for now, before in zip(current, self._previous)
+        )
+        self._previous = current
+        logger.info(
+            "Метрики за {} с: запросов {} (ошибок {}), средняя задержка {:.0f} мс, "
+            "загружено {:.1f} МБ, скачано {:.1f} МБ, "
+            "текущая скорость загрузки {:.1f} КБ/с, циклов {}, в очереди {}. "
+            "Последний цикл {:.2f} с: "
+            "сканирование {:.2f} с, сравнение {:.2f} с, постановка задач {:.2f} с. "
+            "Последний список файлов в облаке получен за {:.2f} с. "
+            "Длительности - наибольшие среди пар директорий",
+            self._interval,
+            requests,
+            errors,
+            seconds / requests * 1000 if requests else 0,
+            uploaded / 1024 / 1024,
+            downloaded / 1024 / 1024,
+            UPLOAD_RATE.get() / 1024,
+            int(cycles),
+            int(sum(QUEUE_DEPTH.values())),
+            *(
+                max(LAST_STAGE_SECONDS.values(stage=name), default=0)
+                for name in ("cycle", "scan", "diff", "apply", "listing")
+            ),
+        )
+
+    def _run(self) -> None:
+        """
+        Пишет сводки, пока не будет вызван stop
+
+        :return: None
+        """
+        while not self._stopped.wait(self._interval):
+            self.log()
+
+    def start(self) -> None:
+        """
+        Запускает фоновый поток
+
+        :return: None
+        """
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Останавливает фоновый поток
+
+        :return: None
+        """
+        self._stopped.set()
@@ -0,0 +1,107 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from .registry import REGISTRY, Counter, Gauge, Histogram
+
+REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "file_tracking_request_seconds",
+        "Длительность запросов к api, включая каждую повторную попытку",
+        labels=("method", "endpoint", "status"),
+    )
+)
+UPLOADED_BYTES = REGISTRY.register(
+    Counter("file_tracking_uploaded_bytes_total", "Байт загружено в облако")
+)
+DOWNLOADED_BYTES = REGISTRY.register(
+    Counter("file_tracking_downloaded_bytes_total", "Байт скачано из облака")
+)
+TRANSFER_SECONDS = REGISTRY.register(
+    Histogram(
+        "file_tracking_transfer_seconds",
+        "Длительность операций с файлами и директориями",
+        labels=("operation", "result"),
+    )
+)
+UPLOAD_RATE = REGISTRY.register(
+    Gauge(
+        "file_tracking_upload_rate_bytes",
+        "Скорость загрузки в облако за последний интервал измерения (байт/с)",
+    )
+)
+UPLOAD_CONCURRENCY = REGISTRY.register(
+    Gauge(
+        "file_tracking_upload_concurrency",
+        "Допустимое количество одновременных загрузок маленьких и больших файлов",
+        labels=("lane",),
+    )
+)
+QUEUE_DEPTH = REGISTRY.register(
+    Gauge(
+        "file_tracking_queue_depth",
+        "Незавершенные загрузки и удаления",
+        labels=("pair",),
+    )
+)
+PENDING_OPERATIONS = REGISTRY.register(
+    Gauge(
+        "file_tracking_pending_operations",
+        "Операции, которые сервер принял к выполнению, но еще не завершил",
+    )
+)
+STAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "file_tracking_stage_seconds",
+        "Длительность этапов цикла синхронизации",
+        labels=("pair", "stage"),
+    )
+)
+LAST_STAGE_SECONDS = REGISTRY.register(
+    Gauge(
+        "file_tracking_last_stage_seconds",
+        "Длительность этапов последнего цикла синхронизации",
+        labels=("pair", "stage"),
+    )
+)
+CYCLES = REGISTRY.register(
+    Counter("file_tracking_cycles_total", "Циклы синхронизации", labels=("result",))
+)
+
+
+def endpoint_name(url: str, method: str = "put") -> str:
+    """
+    Название ресурса апи для меток без идентификаторов и параметров
+
+    :param url: адрес запроса
+    :param method: метод запроса, отличает загрузку файла от скачивания
+    :return: например disk, resources, resources/upload, operations, upload или download
+    """
+    path = urlsplit(url).path
+    if path.rstrip("/").endswith("/v1/disk"):
+        return "disk"
+    if "/v1/disk/" not in path:
+        return "download" if method.lower() == "get" else "upload"
+    segments = path.split("/v1/disk/", 1)[1].split("/")
+    if segments[0] == "resources" and len(segments) > 1:
+        return f"resources/{segments[1]}"
+    return segments[0]
+
+
+@contextmanager
+def stage(name: str, pair: str = "") -> Iterator[None]:
+    """
+    Измеряет этап цикла синхронизации
+
+    :param name: scan, listing, diff, apply, events или cycle
+    :param pair: пара директорий, к которой относится цикл
+    :return: контекстный менеджер
+    """
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, pair=pair, stage=name)
+        LAST_STAGE_SECONDS.set(elapsed, pair=pair, stage=name)
@@ -0,0 +1,333 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+)
+
+
+def escape(value: str) -> str:
+    """
+    Экранирует значение метки
+
+    :param value: значение
+    :return: строка, которую можно поместить в кавычки
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...], **extra) -> str:
+    """
+    Формирует метки в формате Prometheus
+
+    :param names: названия меток
+    :param values: значения меток
+    :param extra: дополнительные метки
+    :return: строка вида {name="value"} или пустая строка
+    """
+    pairs = [*zip(names, values), *extra.items()]
+    if not pairs:
+        return ""
+    return (
+        "{" + ",".join(f'{name}="{escape(str(value))}"' for name, value in pairs) + "}"
+    )
+
+
+def format_value(value: float) -> str:
+    """
+    Форматирует число для вывода
+
+    :param value: число
+    :return: строка
+    """
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    """Базовый класс метрики с набором меток"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        """
+        Инициализатор класса
+
+        :param name: название метрики
+        :param help: описание метрики
+        :param labels: названия меток
+        """
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = Lock()
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        """
+        Значения меток в порядке их объявления
+
+        :param labels: метки
+        :return: кортеж значений
+        """
+        return tuple(str(labels[name]) for name in self.labels)
+
+    @abstractmethod
+    def samples(self) -> Iterator[str]:
+        """
+        Строки со значениями метрики в формате Prometheus
+
+        :return: генератор строк
+        """
+
+    def render(self) -> str:
+        """
+        Метрика в текстовом формате Prometheus
+
+        :return: строка
+        """
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Монотонно растущий счетчик"""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """
+        Увеличивает счетчик
+
+        :param amount: на сколько увеличить
+        :param labels: значения меток
+        :return: None
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self) -> float:
+        """
+        Сумма по всем меткам
+
+        :return: число
+        """
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            labels = format_labels(self.labels, key)
+            yield f"{self.name}{labels} {format_value(value)}"
+
+
+class Gauge(Metric):
+    """Значение, которое может увеличиваться и уменьшаться"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._functions: dict[tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        """
+        Устанавливает значение
+
+        :param value: значение
+        :param labels: значения меток
+        :return: None
+        """
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], float], **labels: str) -> None:
+        """
+        Значение будет вычисляться функцией в момент чтения
+
+        :param function: функция без аргументов
+        :param labels: значения меток
+        :return: None
+        """
+        with self._lock:
+            self._functions[self._key(labels)] = function
+
+    def get(self, **labels: str) -> float:
+        """
+        Текущее значение
+
+        :param labels: значения меток
+        :return: число, 0 - если значение не задано
+        """
+        key = self._key(labels)
+        with self._lock:
+            function = self._functions.get(key)
+            value = self._values.get(key, 0)
+        return function() if function is not None else value
+
+    def values(self, **labels: str) -> list[float]:
+        """
+        Текущие значения всех меток, совпадающих с переданными
+
+        :param labels: значения части меток
+        :return: список чисел
+        """
+        with self._lock:
+            keys = self._values.keys() | self._functions.keys()
+        return [
+            self.get(**current)
+            for current in (dict(zip(self.labels, key)) for key in keys)
+            if all(current[name] == str(value) for name, value in labels.items())
+        ]
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            keys = sorted(self._values.keys() | self._functions.keys())
+        for key in keys:
+            labels = format_labels(self.labels, key)
+            value = self.get(**dict(zip(self.labels, key)))
+            yield f"{self.name}{labels} {format_value(value)}"
+
+
+class Histogram(Metric):
+    """Распределение значений по корзинам, сумма и количество наблюдений"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        """
+        Инициализатор класса
+
+        :param name: название метрики
+        :param help: описание метрики
+        :param labels: названия меток
+        :param buckets: верхние границы корзин по возрастанию
+        """
+        super().__init__(name, help, labels)
+        self._buckets = tuple(buckets)
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Добавляет наблюдение
+
+        :param value: значение
+        :param labels: значения меток
+        :return: None
+        """
+        key = self._key(labels)
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self._buckets) + 3)
+            values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        Измеряет длительность блока кода
+
+        :param labels: значения меток
+        :return: контекстный менеджер
+        """
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started, **labels)
+
+    def totals(self, **labels: str) -> tuple[int, float]:
+        """
+        Количество и сумма наблюдений по всем меткам, совпадающим с переданными
+
+        :param labels: значения части меток
+        :return: количество и сумма
+        """
+        count, total = 0, 0.0
+        with self._lock:
+            for key, values in self._values.items():
+                current = dict(zip(self.labels, key))
+                if all(current[name] == str(value) for name, value in labels.items()):
+                    count += values[-1]
+                    total += values[-2]
+        return count, total
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = {key: list(value) for key, value in self._values.items()}
+        for key, value in sorted(values.items()):
+            cumulative = 0
+            for bound, amount in zip((*self._buckets, float("inf")), value):
+                cumulative += amount
+                labels = format_labels(self.labels, key, le=format_value(bound))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(self.labels, key)
+            yield f"{self.name}_sum{labels} {format_value(value[-2])}"
+            yield f"{self.name}_count{labels} {value[-1]}"
+
+
+class Registry:
+    """Набор метрик, которые отдаются вместе"""
+
+    def __init__(self) -> None:
+        self._metrics: list[Metric] = []
+        self._lock = Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Добавляет метрику
+
+        :param metric: метрика
+        :return: та же метрика
+        """
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Все метрики в текстовом формате Prometheus
+
+        :return: строка
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
@@ -1,2 +1,10 @@
 from .app import FileSynchronization
 from .system import LocaleTracking
+from .ignore import IgnorePatterns
+from .state import SyncState
+from .watcher import InotifyWatcher
+from .digests import DigestCache
+from .journal import TransferJournal
+from .workers import AsyncTransferPool, TransferPool
+from .async_app import AsyncFileSynchronization
+from .scheduler import SyncScheduler
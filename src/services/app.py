@@ -1,134 +1,663 @@
-from collections.abc import Callable, Iterable
-from concurrent.futures import ThreadPoolExecutor
-from time import sleep
+from collections import defaultdict
+from collections.abc import Callable, Iterable, Mapping
+from concurrent.futures import Future
+from functools import partial
+from time import perf_counter
 
-from loguru import logger
+from api import CloudFile, OperationPoller, YandexApi
+from metrics import CYCLES, QUEUE_DEPTH, stage
+from services.base import BaseSynchronization, Changes, Countdown
+from services.digests import DigestCache
+from services.journal import TransferJournal
+from services.moves import MoveMatcher
+from services.state import SyncState
+from services.system import LocalFile, LocaleTracking
+from services.watcher import InotifyWatcher
+from services.workers import PRIORITY_HIGH, PRIORITY_NORMAL, TransferPool
 
-from api import YandexApi
-from services.system import LocaleTracking
 
-
-class FileSynchronization:
+class FileSynchronization(BaseSynchronization):
     """Предоставляет методы для синхронизации локальной и облачной файловых систем"""
 
     def __init__(
-        self, yandex_api: YandexApi, local_tracking: LocaleTracking, interval: int
+        self,
+        yandex_api: YandexApi,
+        local_tracking: LocaleTracking,
+        state: SyncState,
+        digests: DigestCache,
+        journal: TransferJournal,
+        operations: OperationPoller,
+        pool: TransferPool,
+        interval: int,
+        reconcile_interval: int,
+        watcher: InotifyWatcher | None = None,
+        two_way: bool = False,
+        name: str = "",
+        settle_time: float = 0,
     ) -> None:
         """
         Инициализатор класс
 
         :param yandex_api: экземпляр YandexApi
         :param local_tracking: экземпляр LocaleTracking
-        :param interval: интервал между проверками файлов (в секундах)
+        :param state: индекс последних синхронизированных состояний файлов
+        :param digests: кэш md5 локальных файлов
+        :param journal: журнал передач файлов, прерванных аварийным завершением
+        :param operations: опросчик асинхронных операций апи,
+         может быть общим для нескольких пар директорий
+        :param pool: пул потоков для запросов к api,
+         может быть общим для нескольких пар директорий
+        :param interval: интервал между проверками файлов (в секундах).
+         Если передан watcher, это интервал между страховочными полными сканированиями
+        :param reconcile_interval: интервал между полными сверками с облаком (в секундах),
+         0 - сверка только при пустом индексе
+        :param watcher: экземпляр InotifyWatcher или None для режима опроса
+        :param two_way: скачивать ли новые и измененные в облаке файлы
+         вместо удаления их из облака
+        :param name: название пары директорий для логов и общего пула задач
+        :param settle_time: сколько секунд новый или измененный файл не должен меняться,
+         чтобы его можно было загрузить. 0 - файлы загружаются сразу
         """
+        super().__init__(
+            local_tracking=local_tracking,
+            state=state,
+            digests=digests,
+            journal=journal,
+            operations=operations,
+            interval=interval,
+            reconcile_interval=reconcile_interval,
+            watcher=watcher,
+            two_way=two_way,
+            name=name,
+            settle_time=settle_time,
+        )
         self._yandex_api = yandex_api
-        self._locale_tracking = local_tracking
-        self._interval = interval
+        self._pool = pool
+        operations.register(name, yandex_api)
+        QUEUE_DEPTH.set_function(partial(pool.pending, name), pair=name)
+
+    def _interaction_with_api(
+        self,
+        files: Iterable,
+        func: Callable,
+        priority: int = PRIORITY_NORMAL,
+        local_files: dict[str, LocalFile] | Mapping[str, CloudFile] | None = None,
+        group: Countdown | None = None,
+        block: bool = True,
+    ) -> list[Future]:
+        """
+        Ставит запросы к api в очередь пула потоков, не дожидаясь их выполнения.
+        Файлы, которые еще обрабатываются с прошлых циклов, пропускаются
+
+        :param files: файлы, которые требуются для работы api
+        :param func: функция для взаимодействия с api
+        :param priority: приоритет задач
+        :param local_files: информация о локальных файлах или о файлах в облаке,
+         их размер определяет очередность
+        :param group: группа, в которую добавляются поставленные задачи
+        :param block: ждать ли места в заполненной очереди пула.
+         False - для вызовов из потоков пула и обратных вызовов
+        :return: список Future поставленных задач
+        """
+        if group is not None:
+            func = partial(self._in_group, func=func, group=group)
+        futures = []
+        for file in files:
+            if group is not None:
+                group.add()
+            future = self._pool.submit(
+                file,
+                func,
+                priority=priority,
+                size=local_files[file].size if local_files else 0,
+                owner=self._name,
+                block=block,
+            )
+            if future is not None:
+                futures.append(future)
+            elif group is not None:
+                group.done()
+        return futures
+
+    @staticmethod
+    def _in_group(path: str, func: Callable, group: Countdown) -> None:
+        """
+        Выполняет задачу группы и отмечает ее завершенной, даже если задача упала
+
+        :param path: путь, к которому относится задача
+        :param func: функция для взаимодействия с api
+        :param group: группа задачи
+        :return: None
+        """
+        try:
+            func(path)
+        finally:
+            group.done()
 
-    @classmethod
-    def __compare_files(cls, files1: set[str], files2: set[str]) -> set[str]:
+    def _upload(
+        self, filename: str, local_files: dict[str, LocalFile], func: Callable
+    ) -> None:
         """
-        Ищет файлы, которые есть в одном множестве, но нет в другом.
+        Загружает файл в облако и запоминает его состояние в индексе.
+        На время загрузки файл отмечается в журнале передач
 
-        :param files1: файлы из первого множества
-        :param files2: файлы из второго множества
-        :return: файлы, которые есть в первом множестве, но нет во втором
+        :param filename: название файла
+        :param local_files: информация о локальных файлах, полученная при сканировании
+        :param func: функция загрузки или перезаписи из YandexApi
+        :return: None
         """
-        return files1 - files2
+        self._journal.start(filename, func.__name__, local_files[filename])
+        try:
+            started = perf_counter()
+            md5 = func(filename)
+            self._observe(func.__name__, started, md5 is not None)
+            self._uploaded(filename, local_files[filename], md5)
+        finally:
+            self._journal.finish(filename)
 
-    def _manipulate_files(
+    def _sync_modified(
         self,
-        files1: set[str],
-        files2: set[str],
-        no_files: str,
-        func: Callable,
+        filename: str,
+        local_files: dict[str, LocalFile],
+        cloud_md5: dict[str, str | None],
     ) -> None:
         """
-        Получает разницу между множествами с файлами и вызывает _interaction_with_api
-        :param files1: файлы из первого множества
-        :param files2: файлы из второго множества
-        :param no_files: сообщение, выводящееся в лог, если нет измененных файлов
-        :param func: функция для взаимодействия с api
+        Сравнивает md5 измененного локального файла с md5 в облаке.
+        Если содержимое совпадает (например, после touch), только обновляет индекс,
+        иначе перезаписывает файл в облаке
+
+        :param filename: название файла
+        :param local_files: информация о локальных файлах
+        :param cloud_md5: md5 файлов в облаке, если они известны
         :return: None
         """
-        files = self.__compare_files(files1, files2)
-        if not files:
-            logger.info("{}", no_files)
-        self._interaction_with_api(files=files, func=func)
+        expected = cloud_md5.get(filename)
+        if expected is not None:
+            local_file = local_files[filename]
+            if self._digests.get(filename, local_file) == expected:
+                self._unchanged(filename, local_file, expected)
+                return
+        self._upload(filename, local_files=local_files, func=self._yandex_api.reload)
 
-    @classmethod
-    def _interaction_with_api(cls, files: Iterable, func: Callable) -> None:
+    def _download(
+        self,
+        filename: str,
+        local_files: dict[str, LocalFile],
+        cloud_md5: dict[str, str | None],
+    ) -> None:
         """
-        Делает несколько запросов к api с помощью пула потоков
+        Скачивает новый или измененный в облаке файл и запоминает его в индексе.
+        Если локальный файл уже совпадает с облаком по md5, только обновляет индекс
 
-        :param files: файлы, которые требуются для работы api
-        :param func: функция для взаимодействия с api
+        :param filename: название файла
+        :param local_files: информация о локальных файлах
+        :param cloud_md5: md5 файлов в облаке, если они известны
         :return: None
         """
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            tasks = [executor.submit(func, file) for file in files]
-            for task in tasks:
-                task.result()
+        expected = cloud_md5.get(filename)
+        local_file = local_files.get(filename)
+        if expected is not None and local_file is not None:
+            if self._digests.get(filename, local_file) == expected:
+                self._unchanged(filename, local_file, expected)
+                return
+        self._journal.start(filename, "download", local_file)
+        try:
+            started = perf_counter()
+            md5 = self._yandex_api.download(filename)
+            self._observe("download", started, md5 is not None)
+            self._downloaded(filename, md5)
+        finally:
+            self._journal.finish(filename)
 
-    def _get_files_not_replaced_on_disk(
-        self, local_files: set[str]
-    ) -> tuple[str, ...] | None:
+    def _move(
+        self,
+        filename: str,
+        moves: Mapping[str, str],
+        local_files: dict[str, LocalFile],
+        group: Countdown | None = None,
+    ) -> None:
         """
-        Получает информацию о локальных файлах и тех, которые хранятся в облаке.
-        Формирует кортеж из файлов, которые были изменены локально и не изменены на Яндекс диске
+        Перемещает файл на сервере. Если это не удалось,
+        загружает файл под новым именем и удаляет старый
 
-        :param local_files: названия локальных файлов
+        :param filename: новый путь к файлу
+        :param moves: новые пути и старые пути переименованных файлов
+        :param local_files: информация о локальных файлах
+        :param group: группа, которая ждет завершения перемещения на сервере
         :return: None
         """
-        local_files = self._locale_tracking.get_files_and_latest_modification(
-            local_files
+        source = moves[filename]
+        started = perf_counter()
+        result = self._yandex_api.move(source, filename)
+        on_success = partial(
+            self._moved, filename, source, local_files[filename], remove_source=True
         )
-        cloud_files = self._yandex_api.get_info()
-        if cloud_files is None:
-            return None
-        result = tuple(
-            filename
-            for filename, modified in local_files.items()
-            if cloud_files[filename] < modified
+        if self._settle(
+            "move", started, result, on_success, filename, source, group=group
+        ):
+            return
+        self._upload(filename, local_files=local_files, func=self._yandex_api.load)
+        self._delete(source)
+
+    def _move_directory(
+        self,
+        path: str,
+        directory_moves: Mapping[str, str],
+        local_files: dict[str, LocalFile],
+        group: Countdown | None = None,
+    ) -> None:
+        """
+        Перемещает директорию со всем содержимым на сервере одним запросом.
+        Если это не удалось, создает директорию заново, ставит в очередь
+        загрузку ее файлов и удаляет старую директорию
+
+        :param path: новый путь к директории
+        :param directory_moves: новые и старые пути переименованных директорий
+        :param local_files: информация о локальных файлах
+        :param group: группа, которая ждет завершения перемещения на сервере
+        :return: None
+        """
+        source = directory_moves[path]
+        started = perf_counter()
+        result = self._yandex_api.move(source, path)
+        on_success = partial(self._moved_directory, path, source, local_files)
+        if self._settle(
+            "move_directory", started, result, on_success, path, source, group=group
+        ):
+            return
+        directories, files = self._directory_contents(path, local_files)
+        for directory in directories:
+            self._create_directory(directory)
+        self._interaction_with_api(
+            files=files,
+            func=partial(
+                self._upload, local_files=local_files, func=self._yandex_api.load
+            ),
+            local_files=local_files,
+            block=False,
         )
-        if result:
-            logger.info("Измененные файлы {}", result)
-            return result
-        logger.info("Нет измененных файлов")
-        return result
+        self._delete_directory(source)
 
-    def endless_synchronization(self) -> None:
+    def _upload_new(
+        self,
+        filename: str,
+        local_files: dict[str, LocalFile],
+        matcher: MoveMatcher,
+        group: Countdown | None = None,
+    ) -> None:
         """
-        Запускает бесконечный цикл.
-        Загружает на диск новые файлы.
-        Удаляет из диска файлы, которых нет в локальной директории.
-        Перезаписывает локально измененные файлы.
+        Сверяет новый файл с индексом по md5 и перемещает или копирует
+        найденный файл на сервере. Если такого файла нет, загружает новый файл
+
+        :param filename: путь к новому файлу
+        :param local_files: информация о локальных файлах
+        :param matcher: сопоставление новых файлов с индексом в текущем цикле
+        :param group: группа, которая ждет завершения перемещения на сервере
         :return: None
         """
-        self._yandex_api.create_cloud_folder_if_not_exists()
-        while True:
-            local_files = self._locale_tracking.get_files_in_local_folder()
-            cloud_files = self._yandex_api.get_files_on_disk()
-            if cloud_files is None:
-                sleep(5)
-                continue
-            self._manipulate_files(
-                files1=local_files,
-                files2=cloud_files,
-                no_files="Нет новых файлов",
+        match = self._content_match(filename, local_files[filename], matcher)
+        if match is None:
+            self._upload(filename, local_files=local_files, func=self._yandex_api.load)
+        elif match.move:
+            self._move(filename, {filename: match.source}, local_files, group)
+        else:
+            self._copy(filename, {filename: match.source}, local_files)
+
+    def _delete_held(self, changes: Changes) -> None:
+        """
+        Удаляет из облака удаленные файлы и директории,
+        которые не стали источниками перемещений
+
+        :param changes: изменения текущего цикла
+        :return: None
+        """
+        self._interaction_with_api(
+            files=changes.held_directories,
+            func=self._delete_directory,
+            priority=PRIORITY_HIGH,
+            block=False,
+        )
+        if changes.matcher is not None:
+            self._interaction_with_api(
+                files=changes.matcher.unclaimed(changes.held_files),
+                func=self._delete,
+                priority=PRIORITY_HIGH,
+                block=False,
+            )
+
+    def _copy(
+        self, filename: str, copies: dict[str, str], local_files: dict[str, LocalFile]
+    ) -> None:
+        """
+        Копирует файл на сервере. Если это не удалось, загружает файл
+
+        :param filename: путь к копии
+        :param copies: пути копий и исходных файлов
+        :param local_files: информация о локальных файлах
+        :return: None
+        """
+        source = copies[filename]
+        started = perf_counter()
+        result = self._yandex_api.copy(source, filename)
+        on_success = partial(
+            self._moved, filename, source, local_files[filename], remove_source=False
+        )
+        if self._settle("copy", started, result, on_success, filename, source):
+            return
+        self._upload(filename, local_files=local_files, func=self._yandex_api.load)
+
+    def _delete(self, filename: str) -> None:
+        """
+        Удаляет файл из облака и из индекса.
+        Если сервер удаляет файл асинхронно, задача не ждет завершения операции
+
+        :param filename: путь к файлу
+        :return: None
+        """
+        started = perf_counter()
+        result = self._yandex_api.delete(filename)
+        self._settle(
+            "delete", started, result, partial(self._state.remove, filename), filename
+        )
+
+    def _create_directory(self, path: str) -> None:
+        """
+        Создает директорию в облаке и запоминает ее в индексе
+
+        :param path: путь к директории
+        :return: None
+        """
+        started = perf_counter()
+        success = self._yandex_api.create_folder(path)
+        self._observe("create_folder", started, success)
+        if success:
+            self._state.add_directory(path)
+
+    def _delete_directory(self, path: str) -> None:
+        """
+        Удаляет директорию со всем содержимым из облака и из индекса
+
+        :param path: путь к директории
+        :return: None
+        """
+        started = perf_counter()
+        result = self._yandex_api.delete(path)
+        self._settle(
+            "delete_directory",
+            started,
+            result,
+            partial(self._state.remove_directory, path),
+            path,
+        )
+
+    def _create_directories(
+        self, directories: set[str], on_created: Callable[[], None]
+    ) -> None:
+        """
+        Создает директории в облаке по уровням вложенности:
+        сначала родительские, затем вложенные. Директории одного уровня создаются параллельно.
+        Цикл не ждет создания: следующий уровень ставится в очередь, когда завершится
+        предыдущий, а после последнего уровня вызывается on_created.
+        До этого директории считаются занятыми и пропускаются следующими циклами
+
+        :param directories: пути директорий
+        :param on_created: функция, которая ставит в очередь загрузки в эти директории
+        :return: None
+        """
+        levels = defaultdict(set)
+        for directory in directories:
+            levels[directory.count("/")].add(directory)
+        with self._creating_lock:
+            self._creating |= directories
+        self._create_level(
+            [levels[depth] for depth in sorted(levels)],
+            partial(self._directories_created, directories, on_created),
+        )
+
+    def _create_level(
+        self,
+        levels: list[set[str]],
+        on_created: Callable[[], None],
+        block: bool = True,
+    ) -> None:
+        """
+        Ставит в очередь создание первого уровня директорий,
+        а создание остальных - в обратный вызов после его завершения
+
+        :param levels: директории по уровням вложенности
+        :param on_created: функция, которая будет вызвана после создания всех уровней
+        :param block: ждать ли места в заполненной очереди пула
+        :return: None
+        """
+        if not levels:
+            on_created()
+            return
+        group = Countdown(
+            partial(self._create_level, levels[1:], on_created, block=False)
+        )
+        self._interaction_with_api(
+            files=levels[0],
+            func=self._create_directory,
+            priority=PRIORITY_HIGH,
+            group=group,
+            block=block,
+        )
+        group.done()
+
+    def _directories_created(
+        self, directories: set[str], on_created: Callable[[], None]
+    ) -> None:
+        """
+        Ставит в очередь загрузки в созданные директории и освобождает их
+
+        :param directories: пути директорий
+        :param on_created: функция, которая ставит в очередь загрузки
+        :return: None
+        """
+        try:
+            on_created()
+        finally:
+            with self._creating_lock:
+                self._creating -= directories
+
+    def _place_files(self, changes: Changes, block: bool = True) -> None:
+        """
+        Ставит в очередь перемещения на сервере, сверку новых файлов по md5
+        и загрузки новых файлов. Вызывается, когда новые директории уже созданы
+
+        :param changes: изменения, которые нужно применить
+        :param block: ждать ли места в заполненной очереди пула.
+         False, если метод вызван после создания директорий
+        :return: None
+        """
+        group = None
+        if changes.held_files or changes.held_directories:
+            group = Countdown(partial(self._delete_held, changes))
+        self._interaction_with_api(
+            files=changes.directory_moves,
+            func=partial(
+                self._move_directory,
+                directory_moves=changes.directory_moves,
+                local_files=changes.local_files,
+                group=group,
+            ),
+            priority=PRIORITY_HIGH,
+            group=group,
+            block=block,
+        )
+        self._interaction_with_api(
+            files=changes.moves,
+            func=partial(
+                self._move,
+                moves=changes.moves,
+                local_files=changes.local_files,
+                group=group,
+            ),
+            priority=PRIORITY_HIGH,
+            group=group,
+            block=block,
+        )
+        if changes.matcher is not None:
+            self._interaction_with_api(
+                files=changes.hashed,
+                func=partial(
+                    self._upload_new,
+                    local_files=changes.local_files,
+                    matcher=changes.matcher,
+                    group=group,
+                ),
+                local_files=changes.local_files,
+                group=group,
+                block=block,
+            )
+        if group is not None:
+            group.done()
+        self._interaction_with_api(
+            files=changes.new_files,
+            func=partial(
+                self._upload,
+                local_files=changes.local_files,
                 func=self._yandex_api.load,
+            ),
+            local_files=changes.local_files,
+            block=block,
+        )
+
+    def _apply_changes(self, changes: Changes) -> None:
+        """
+        Отправляет в облако новые и измененные файлы и удаляет из облака удаленные.
+        Загрузки и перемещения ставятся в очередь в обратном вызове
+        после создания новых директорий, поэтому цикл не ждет их создания.
+        Переименованные файлы и директории перемещаются на сервере.
+        Новые файлы, у которых в индексе есть файлы такого же размера,
+        сверяются по md5 в задачах пула и перемещаются, копируются или загружаются.
+        Удаленные файлы и директории, которые могут оказаться источниками
+        перемещений, удаляются в обратном вызове после завершения этих задач,
+        включая операции, которые сервер выполняет асинхронно,
+        поэтому цикл их не ждет.
+        Удаленная директория удаляется одним запросом вместе с содержимым.
+        Удаления не занимают потоки до завершения асинхронных операций на сервере.
+        Удаления выполняются в первую очередь, загрузки - от маленьких файлов к большим.
+        В двустороннем режиме изменения из облака сначала применяются локально,
+        а файлы скачиваются в том же пуле потоков, что и загружаются.
+        Метод не ждет завершения загрузок, скачиваний и удалений
+
+        :param changes: изменения, которые нужно применить
+        :return: None
+        """
+        self._apply_local_changes(changes)
+        changes = self._detect_moves(changes)
+        self._interaction_with_api(
+            files=changes.deleted_directories,
+            func=self._delete_directory,
+            priority=PRIORITY_HIGH,
+        )
+        self._interaction_with_api(
+            files=changes.deleted_files, func=self._delete, priority=PRIORITY_HIGH
+        )
+        if changes.new_directories:
+            self._create_directories(
+                changes.new_directories,
+                partial(self._place_files, changes, block=False),
             )
-            self._manipulate_files(
-                files1=cloud_files,
-                files2=local_files,
-                no_files="Нет удаленных файлов",
-                func=self._yandex_api.delete,
+        else:
+            self._place_files(changes)
+        self._interaction_with_api(
+            files=changes.modified_files,
+            func=partial(
+                self._sync_modified,
+                local_files=changes.local_files,
+                cloud_md5=changes.cloud_md5,
+            ),
+            local_files=changes.local_files,
+        )
+        self._interaction_with_api(
+            files=changes.downloads,
+            func=partial(
+                self._download,
+                local_files=changes.local_files,
+                cloud_md5=changes.cloud_md5,
+            ),
+            local_files=changes.cloud_files,
+        )
+
+    def synchronize(self) -> bool:
+        """
+        Выполняет один цикл синхронизации.
+        В обычном цикле сравнивает локальные файлы с индексом и обращается к api
+        только для изменившихся файлов. Периодически полностью сверяется с облаком
+
+        :return: True, если цикл завершен, False, если его нужно повторить
+        """
+        with stage("cycle", self._name):
+            completed = self._synchronize()
+        CYCLES.inc(result="ok" if completed else "failed")
+        return completed
+
+    def _synchronize(self) -> bool:
+        """
+        Выполняет этапы цикла синхронизации и измеряет их длительность
+
+        :return: True, если цикл завершен, False, если его нужно повторить
+        """
+        if self._retry is None:
+            self._recover()
+        with stage("scan", self._name):
+            local_files, local_directories = (
+                self._locale_tracking.get_files_in_local_folder()
             )
-            files_not_replaces = self._get_files_not_replaced_on_disk(local_files)
-            if files_not_replaces is None:
-                sleep(5)
-                continue
-            self._interaction_with_api(
-                files=files_not_replaces, func=self._yandex_api.reload
+        if not self._need_reconcile():
+            with stage("diff", self._name):
+                changes = self._scan_changes(local_files, local_directories)
+        else:
+            with stage("listing", self._name):
+                cloud_listing = self._yandex_api.list_files()
+            if cloud_listing is None:
+                return False
+            with stage("diff", self._name):
+                changes = self._reconcile_changes(
+                    local_files, local_directories, cloud_listing
+                )
+        with stage("apply", self._name):
+            self._apply_changes(changes)
+        return True
+
+    def _recover(self) -> None:
+        """
+        Сверяет с облаком загрузки, прерванные при прошлом запуске
+
+        :return: None
+        """
+        for filename, local_file in self._interrupted_uploads().items():
+            self._recovered(
+                filename, local_file, self._yandex_api.file_md5(filename)
             )
-            sleep(self._interval)
+
+    def synchronize_paths(self, paths: set[str]) -> None:
+        """
+        Синхронизирует только переданные пути без сканирования всей директории
+
+        :param paths: пути файлов и директорий, о которых сообщил watcher
+        :return: None
+        """
+        with stage("events", self._name):
+            changes = self._paths_changes(paths)
+            if changes is not None:
+                self._apply_changes(changes)
+
+    def prepare(self) -> None:
+        """
+        Создает облачную директорию перед первым циклом синхронизации
+
+        :return: None
+        """
+        self._yandex_api.create_cloud_folder_if_not_exists()
+
+    def recovery_delay(self, failures: int) -> float:
+        """
+        Сколько подождать перед повтором цикла, который не удался целиком
+
+        :param failures: количество неудач подряд
+        :return: секунды
+        """
+        return self._yandex_api.recovery_delay(failures)
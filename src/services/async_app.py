@@ -0,0 +1,722 @@
+import asyncio
+from collections import defaultdict
+from collections.abc import Awaitable, Callable, Iterable, Mapping
+from functools import partial
+from time import monotonic, perf_counter
+
+from loguru import logger
+
+from api import AsyncOperationPoller, AsyncYandexApi, CloudFile
+from metrics import CYCLES, QUEUE_DEPTH, stage
+from services.base import BaseSynchronization, Changes, Countdown
+from services.digests import DigestCache
+from services.journal import TransferJournal
+from services.moves import MoveMatcher
+from services.state import SyncState
+from services.system import LocalFile, LocaleTracking
+from services.watcher import InotifyWatcher
+from services.workers import AsyncTransferPool
+
+
+class AsyncFileSynchronization(BaseSynchronization):
+    """
+    Синхронизация локальной и облачной файловых систем в одном цикле событий.
+    Количество одновременных запросов ограничено семафором, а не числом потоков,
+    поэтому тысячи маленьких файлов загружаются без пула из сотен потоков.
+    Несколько пар директорий выполняются в одном цикле событий с общим AsyncTransferPool
+    """
+
+    def __init__(
+        self,
+        yandex_api: AsyncYandexApi,
+        local_tracking: LocaleTracking,
+        state: SyncState,
+        digests: DigestCache,
+        journal: TransferJournal,
+        operations: AsyncOperationPoller,
+        pool: AsyncTransferPool,
+        interval: int,
+        reconcile_interval: int,
+        watcher: InotifyWatcher | None = None,
+        two_way: bool = False,
+        name: str = "",
+        settle_time: float = 0,
+    ) -> None:
+        """
+        Инициализатор класса
+
+        :param yandex_api: экземпляр AsyncYandexApi
+        :param local_tracking: экземпляр LocaleTracking
+        :param state: индекс последних синхронизированных состояний файлов
+        :param digests: кэш md5 локальных файлов
+        :param journal: журнал передач файлов, прерванных аварийным завершением
+        :param operations: опросчик асинхронных операций апи,
+         может быть общим для нескольких пар директорий
+        :param pool: ограничения одновременных запросов и незавершенных задач,
+         может быть общим для нескольких пар директорий
+        :param interval: интервал между проверками файлов (в секундах).
+         Если передан watcher, это интервал между страховочными полными сканированиями
+        :param reconcile_interval: интервал между полными сверками с облаком (в секундах),
+         0 - сверка только при пустом индексе
+        :param watcher: экземпляр InotifyWatcher или None для режима опроса
+        :param two_way: скачивать ли новые и измененные в облаке файлы
+         вместо удаления их из облака
+        :param name: название пары директорий для логов и общего пула задач
+        :param settle_time: сколько секунд новый или измененный файл не должен меняться,
+         чтобы его можно было загрузить. 0 - файлы загружаются сразу
+        """
+        super().__init__(
+            local_tracking=local_tracking,
+            state=state,
+            digests=digests,
+            journal=journal,
+            operations=operations,
+            interval=interval,
+            reconcile_interval=reconcile_interval,
+            watcher=watcher,
+            two_way=two_way,
+            name=name,
+            settle_time=settle_time,
+        )
+        self._yandex_api = yandex_api
+        self._pool = pool
+        operations.register(name, yandex_api)
+        self._in_flight: set[str] = set()
+        self._tasks: set[asyncio.Task] = set()
+        QUEUE_DEPTH.set_function(lambda: len(self._in_flight), pair=name)
+
+    async def _run(
+        self,
+        path: str,
+        func: Callable[..., Awaitable],
+        *args,
+        group: Countdown | None = None,
+    ) -> None:
+        """
+        Выполняет задачу, когда освободится место среди одновременных запросов
+
+        :param path: путь, к которому относится задача
+        :param func: корутинная функция для взаимодействия с api
+        :param args: аргументы функции
+        :param group: группа задачи, которая отмечается завершенной в любом случае
+        :return: None
+        """
+        try:
+            async with self._pool.concurrency:
+                await func(path, *args)
+        except Exception:
+            logger.exception("Ошибка при обработке {}", path)
+        finally:
+            self._in_flight.discard(path)
+            self._pool.release()
+            if group is not None:
+                group.done()
+
+    async def _interaction_with_api(
+        self,
+        files: Iterable[str],
+        func: Callable[..., Awaitable],
+        *args,
+        local_files: dict[str, LocalFile] | Mapping[str, CloudFile] | None = None,
+        group: Countdown | None = None,
+    ) -> list[asyncio.Task]:
+        """
+        Создает задачи для запросов к api, не дожидаясь их выполнения.
+        Задачи начинают выполняться в порядке создания, поэтому файлы
+        сортируются от маленьких к большим. Файлы, которые еще обрабатываются
+        с прошлых циклов, пропускаются
+
+        :param files: файлы, которые требуются для работы api
+        :param func: корутинная функция для взаимодействия с api
+        :param args: аргументы функции
+        :param local_files: информация о локальных файлах или о файлах в облаке,
+         их размер определяет очередность
+        :param group: группа, в которую добавляются созданные задачи
+        :return: список созданных задач
+        """
+        if local_files:
+            files = sorted(files, key=lambda file: local_files[file].size)
+        tasks = []
+        for file in files:
+            if file in self._in_flight:
+                continue
+            await self._pool.reserve(self._name)
+            self._in_flight.add(file)
+            if group is not None:
+                group.add()
+            tasks.append(self._spawn(self._run(file, func, *args, group=group)))
+        return tasks
+
+    def _spawn(self, coroutine: Awaitable) -> asyncio.Task:
+        """
+        Создает задачу, завершения которой ждет wait
+
+        :param coroutine: корутина
+        :return: созданная задача
+        """
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _delete_held(self, changes: Changes) -> None:
+        """
+        Создает задачи удаления файлов и директорий, которые не стали
+        источниками перемещений. Вызывается в цикле событий,
+        когда завершатся перемещения и сверка новых файлов по md5
+
+        :param changes: изменения текущего цикла
+        :return: None
+        """
+        self._spawn(
+            self._interaction_with_api(
+                changes.held_directories, self._delete_directory
+            )
+        )
+        if changes.matcher is not None:
+            self._spawn(
+                self._interaction_with_api(
+                    changes.matcher.unclaimed(changes.held_files), self._delete
+                )
+            )
+
+    async def _async_settle(
+        self,
+        operation: str,
+        started: float,
+        result: bool | str,
+        on_success: Callable[[], None],
+        *paths: str,
+        group: Countdown | None = None,
+    ) -> bool:
+        """
+        Учитывает результат запроса, который сервер может выполнить асинхронно,
+        как _settle, но обновляет индекс в пуле потоков
+
+        :param operation: название операции
+        :param started: время начала операции по perf_counter
+        :param result: результат метода апи: True, False или ссылка на операцию
+        :param on_success: функция, обновляющая индекс после успешного выполнения
+        :param paths: пути, к которым относится операция
+        :param group: группа, которая ждет завершения асинхронной операции
+        :return: False, если сервер не выполнил запрос и не принял его к выполнению
+        """
+        if isinstance(result, str):
+            if group is not None:
+                group.add()
+            self._operations.track(
+                href=result,
+                name=operation,
+                paths=paths,
+                on_finish=partial(
+                    self._async_finished, operation, started, on_success, group=group
+                ),
+                owner=self._name,
+            )
+            return True
+        await self._async_finished(operation, started, on_success, result)
+        return result
+
+    async def _async_finished(
+        self,
+        operation: str,
+        started: float,
+        on_success: Callable[[], None],
+        success: bool,
+        group: Countdown | None = None,
+    ) -> None:
+        """
+        Учитывает завершение операции в метриках и индексе в пуле потоков.
+        Группа отмечается в цикле событий, где работают ее обработчики
+
+        :param operation: название операции
+        :param started: время начала операции по perf_counter
+        :param on_success: функция, обновляющая индекс после успешного выполнения
+        :param success: успешно ли завершилась операция
+        :param group: группа, которая ждет завершения операции
+        :return: None
+        """
+        try:
+            await asyncio.to_thread(
+                self._finished, operation, started, on_success, success
+            )
+        finally:
+            if group is not None:
+                group.done()
+
+    async def _upload(
+        self,
+        filename: str,
+        local_files: dict[str, LocalFile],
+        func: Callable[[str], Awaitable[str | None]],
+    ) -> None:
+        """
+        Загружает файл в облако и запоминает его состояние в индексе.
+        На время загрузки файл отмечается в журнале передач
+
+        :param filename: название файла
+        :param local_files: информация о локальных файлах, полученная при сканировании
+        :param func: функция загрузки или перезаписи из AsyncYandexApi
+        :return: None
+        """
+        await asyncio.to_thread(
+            self._journal.start, filename, func.__name__, local_files[filename]
+        )
+        try:
+            started = perf_counter()
+            md5 = await func(filename)
+            self._observe(func.__name__, started, md5 is not None)
+            await asyncio.to_thread(
+                self._uploaded, filename, local_files[filename], md5
+            )
+        finally:
+            await asyncio.to_thread(self._journal.finish, filename)
+
+    async def _sync_modified(
+        self,
+        filename: str,
+        local_files: dict[str, LocalFile],
+        cloud_md5: dict[str, str | None],
+    ) -> None:
+        """
+        Сравнивает md5 измененного локального файла с md5 в облаке.
+        Хэш считается и индекс обновляется в пуле потоков,
+        чтобы не блокировать цикл событий
+
+        :param filename: название файла
+        :param local_files: информация о локальных файлах
+        :param cloud_md5: md5 файлов в облаке, если они известны
+        :return: None
+        """
+        expected = cloud_md5.get(filename)
+        if expected is not None:
+            local_file = local_files[filename]
+            md5 = await asyncio.to_thread(self._digests.get, filename, local_file)
+            if md5 == expected:
+                await asyncio.to_thread(
+                    self._unchanged, filename, local_file, expected
+                )
+                return
+        await self._upload(filename, local_files, self._yandex_api.reload)
+
+    async def _download(
+        self,
+        filename: str,
+        local_files: dict[str, LocalFile],
+        cloud_md5: dict[str, str | None],
+    ) -> None:
+        """
+        Скачивает новый или измененный в облаке файл и запоминает его в индексе.
+        Если локальный файл уже совпадает с облаком по md5, только обновляет индекс.
+        Хэш, состояние файла и записи в индекс и журнал передач
+        выполняются в пуле потоков
+
+        :param filename: название файла
+        :param local_files: информация о локальных файлах
+        :param cloud_md5: md5 файлов в облаке, если они известны
+        :return: None
+        """
+        expected = cloud_md5.get(filename)
+        local_file = local_files.get(filename)
+        if expected is not None and local_file is not None:
+            md5 = await asyncio.to_thread(self._digests.get, filename, local_file)
+            if md5 == expected:
+                await asyncio.to_thread(
+                    self._unchanged, filename, local_file, expected
+                )
+                return
+        await asyncio.to_thread(self._journal.start, filename, "download", local_file)
+        try:
+            started = perf_counter()
+            md5 = await self._yandex_api.download(filename)
+            self._observe("download", started, md5 is not None)
+            await asyncio.to_thread(self._downloaded, filename, md5)
+        finally:
+            await asyncio.to_thread(self._journal.finish, filename)
+
+    async def _move(
+        self,
+        filename: str,
+        moves: Mapping[str, str],
+        local_files: dict[str, LocalFile],
+        group: Countdown | None = None,
+    ) -> None:
+        """
+        Перемещает файл на сервере. Если это не удалось,
+        загружает файл под новым именем и удаляет старый
+
+        :param filename: новый путь к файлу
+        :param moves: новые пути и старые пути переименованных файлов
+        :param local_files: информация о локальных файлах
+        :param group: группа, которая ждет завершения перемещения на сервере
+        :return: None
+        """
+        source = moves[filename]
+        started = perf_counter()
+        result = await self._yandex_api.move(source, filename)
+        on_success = partial(
+            self._moved, filename, source, local_files[filename], remove_source=True
+        )
+        if await self._async_settle(
+            "move", started, result, on_success, filename, source, group=group
+        ):
+            return
+        await self._upload(filename, local_files, self._yandex_api.load)
+        await self._delete(source)
+
+    async def _move_directory(
+        self,
+        path: str,
+        directory_moves: Mapping[str, str],
+        local_files: dict[str, LocalFile],
+        group: Countdown | None = None,
+    ) -> None:
+        """
+        Перемещает директорию со всем содержимым на сервере одним запросом.
+        Если это не удалось, создает директорию заново, создает задачи
+        загрузки ее файлов и удаляет старую директорию
+
+        :param path: новый путь к директории
+        :param directory_moves: новые и старые пути переименованных директорий
+        :param local_files: информация о локальных файлах
+        :param group: группа, которая ждет завершения перемещения на сервере
+        :return: None
+        """
+        source = directory_moves[path]
+        started = perf_counter()
+        result = await self._yandex_api.move(source, path)
+        on_success = partial(self._moved_directory, path, source, local_files)
+        if await self._async_settle(
+            "move_directory", started, result, on_success, path, source, group=group
+        ):
+            return
+        directories, files = self._directory_contents(path, local_files)
+        for directory in directories:
+            await self._create_directory(directory)
+        self._spawn(
+            self._interaction_with_api(
+                files,
+                self._upload,
+                local_files,
+                self._yandex_api.load,
+                local_files=local_files,
+            )
+        )
+        await self._delete_directory(source)
+
+    async def _upload_new(
+        self,
+        filename: str,
+        local_files: dict[str, LocalFile],
+        matcher: MoveMatcher,
+        group: Countdown | None = None,
+    ) -> None:
+        """
+        Сверяет новый файл с индексом по md5 в пуле потоков и перемещает
+        или копирует найденный файл на сервере. Если такого файла нет,
+        загружает новый файл
+
+        :param filename: путь к новому файлу
+        :param local_files: информация о локальных файлах
+        :param matcher: сопоставление новых файлов с индексом в текущем цикле
+        :param group: группа, которая ждет завершения перемещения на сервере
+        :return: None
+        """
+        match = await asyncio.to_thread(
+            self._content_match, filename, local_files[filename], matcher
+        )
+        if match is None:
+            await self._upload(filename, local_files, self._yandex_api.load)
+        elif match.move:
+            await self._move(filename, {filename: match.source}, local_files, group)
+        else:
+            await self._copy(filename, {filename: match.source}, local_files)
+
+    async def _copy(
+        self, filename: str, copies: dict[str, str], local_files: dict[str, LocalFile]
+    ) -> None:
+        """
+        Копирует файл на сервере. Если это не удалось, загружает файл
+
+        :param filename: путь к копии
+        :param copies: пути копий и исходных файлов
+        :param local_files: информация о локальных файлах
+        :return: None
+        """
+        source = copies[filename]
+        started = perf_counter()
+        result = await self._yandex_api.copy(source, filename)
+        on_success = partial(
+            self._moved, filename, source, local_files[filename], remove_source=False
+        )
+        if await self._async_settle(
+            "copy", started, result, on_success, filename, source
+        ):
+            return
+        await self._upload(filename, local_files, self._yandex_api.load)
+
+    async def _delete(self, filename: str) -> None:
+        """
+        Удаляет файл из облака и из индекса.
+        Если сервер удаляет файл асинхронно, задача не ждет завершения операции
+
+        :param filename: путь к файлу
+        :return: None
+        """
+        started = perf_counter()
+        result = await self._yandex_api.delete(filename)
+        await self._async_settle(
+            "delete", started, result, partial(self._state.remove, filename), filename
+        )
+
+    async def _create_directory(self, path: str) -> None:
+        """
+        Создает директорию в облаке и запоминает ее в индексе
+
+        :param path: путь к директории
+        :return: None
+        """
+        started = perf_counter()
+        success = await self._yandex_api.create_folder(path)
+        self._observe("create_folder", started, success)
+        if success:
+            await asyncio.to_thread(self._state.add_directory, path)
+
+    async def _delete_directory(self, path: str) -> None:
+        """
+        Удаляет директорию со всем содержимым из облака и из индекса
+
+        :param path: путь к директории
+        :return: None
+        """
+        started = perf_counter()
+        result = await self._yandex_api.delete(path)
+        await self._async_settle(
+            "delete_directory",
+            started,
+            result,
+            partial(self._state.remove_directory, path),
+            path,
+        )
+
+    async def _create_directories(self, directories: set[str]) -> None:
+        """
+        Создает директории в облаке по уровням вложенности и ждет завершения,
+        чтобы файлы загружались только в существующие директории
+
+        :param directories: пути директорий
+        :return: None
+        """
+        levels = defaultdict(set)
+        for directory in directories:
+            levels[directory.count("/")].add(directory)
+        for depth in sorted(levels):
+            tasks = await self._interaction_with_api(
+                levels[depth], self._create_directory
+            )
+            if tasks:
+                await asyncio.wait(tasks)
+
+    async def _apply_changes(self, changes: Changes) -> None:
+        """
+        Создает в облаке новые директории до загрузки файлов,
+        отправляет в облако новые и измененные файлы и удаляет из облака удаленные.
+        Переименованные файлы и директории перемещаются на сервере.
+        Новые файлы, у которых в индексе есть файлы такого же размера,
+        сверяются по md5 в пуле потоков и перемещаются, копируются или загружаются.
+        Удаленные файлы и директории, которые могут оказаться источниками
+        перемещений, удаляются после завершения этих задач, включая операции,
+        которые сервер выполняет асинхронно, поэтому цикл их не ждет.
+        Удаления выполняются в первую очередь, загрузки - от маленьких файлов к большим.
+        В двустороннем режиме изменения из облака сначала применяются локально,
+        а файлы скачиваются с тем же ограничением одновременных запросов,
+        что и загружаются.
+        Метод не ждет завершения загрузок, скачиваний и удалений
+
+        :param changes: изменения, которые нужно применить
+        :return: None
+        """
+        await asyncio.to_thread(self._apply_local_changes, changes)
+        changes = self._detect_moves(changes)
+        if changes.new_directories:
+            await self._create_directories(changes.new_directories)
+        group = None
+        if changes.held_files or changes.held_directories:
+            group = Countdown(partial(self._delete_held, changes))
+        await self._interaction_with_api(
+            changes.directory_moves,
+            self._move_directory,
+            changes.directory_moves,
+            changes.local_files,
+            group,
+            group=group,
+        )
+        await self._interaction_with_api(
+            changes.moves,
+            self._move,
+            changes.moves,
+            changes.local_files,
+            group,
+            group=group,
+        )
+        if changes.matcher is not None:
+            await self._interaction_with_api(
+                changes.hashed,
+                self._upload_new,
+                changes.local_files,
+                changes.matcher,
+                group,
+                local_files=changes.local_files,
+                group=group,
+            )
+        if group is not None:
+            group.done()
+        await self._interaction_with_api(
+            changes.deleted_directories, self._delete_directory
+        )
+        await self._interaction_with_api(changes.deleted_files, self._delete)
+        await self._interaction_with_api(
+            changes.new_files,
+            self._upload,
+            changes.local_files,
+            self._yandex_api.load,
+            local_files=changes.local_files,
+        )
+        await self._interaction_with_api(
+            changes.modified_files,
+            self._sync_modified,
+            changes.local_files,
+            changes.cloud_md5,
+            local_files=changes.local_files,
+        )
+        await self._interaction_with_api(
+            changes.downloads,
+            self._download,
+            changes.local_files,
+            changes.cloud_md5,
+            local_files=changes.cloud_files,
+        )
+
+    async def synchronize(self) -> bool:
+        """
+        Выполняет один цикл синхронизации.
+        Сканирование директории выполняется в пуле потоков
+
+        :return: True, если цикл завершен, False, если его нужно повторить
+        """
+        with stage("cycle", self._name):
+            completed = await self._synchronize()
+        CYCLES.inc(result="ok" if completed else "failed")
+        return completed
+
+    async def _synchronize(self) -> bool:
+        """
+        Выполняет этапы цикла синхронизации и измеряет их длительность
+
+        :return: True, если цикл завершен, False, если его нужно повторить
+        """
+        if self._retry is None:
+            await self._recover()
+        with stage("scan", self._name):
+            local_files, local_directories = await asyncio.to_thread(
+                self._locale_tracking.get_files_in_local_folder
+            )
+        if not self._need_reconcile():
+            with stage("diff", self._name):
+                changes = self._scan_changes(local_files, local_directories)
+        else:
+            with stage("listing", self._name):
+                cloud_listing = await self._yandex_api.list_files()
+            if cloud_listing is None:
+                return False
+            with stage("diff", self._name):
+                changes = self._reconcile_changes(
+                    local_files, local_directories, cloud_listing
+                )
+        with stage("apply", self._name):
+            await self._apply_changes(changes)
+        return True
+
+    async def _recover(self) -> None:
+        """
+        Сверяет с облаком загрузки, прерванные при прошлом запуске.
+        Файлы проверяются одновременно, хэши считаются в пуле потоков
+
+        :return: None
+        """
+        uploads = await asyncio.to_thread(self._interrupted_uploads)
+        cloud_md5 = await asyncio.gather(
+            *(self._yandex_api.file_md5(filename) for filename in uploads)
+        )
+        for (filename, local_file), md5 in zip(uploads.items(), cloud_md5):
+            await asyncio.to_thread(self._recovered, filename, local_file, md5)
+
+    async def synchronize_paths(self, paths: set[str]) -> None:
+        """
+        Синхронизирует только переданные пути без сканирования всей директории
+
+        :param paths: пути файлов и директорий, о которых сообщил watcher
+        :return: None
+        """
+        with stage("events", self._name):
+            changes = await asyncio.to_thread(self._paths_changes, paths)
+            if changes is not None:
+                await self._apply_changes(changes)
+
+    async def _watch(self) -> None:
+        """
+        Обрабатывает события watcher до следующего полного цикла.
+        События ожидаются в цикле событий, поэтому пары директорий не занимают потоки.
+        Без watcher просто ждет следующего цикла.
+        Файлы, отложенные до окончания записи, проверяются повторно в свой срок
+
+        :return: None
+        """
+        deadline = monotonic() + self._interval
+        while (remaining := deadline - monotonic()) > 0:
+            settle_timeout = self.settle_timeout()
+            if settle_timeout is not None:
+                remaining = min(remaining, settle_timeout)
+            if self._watcher is None:
+                await asyncio.sleep(remaining)
+                changed = set()
+            else:
+                changed = await self._watcher.async_wait(remaining)
+                if changed is None:
+                    return
+                if changed:
+                    logger.debug("Получены события для {} путей", len(changed))
+            changed |= self.settled_paths()
+            if changed:
+                await self.synchronize_paths(changed)
+
+    async def wait(self) -> None:
+        """
+        Ждет завершения всех созданных задач
+
+        :return: None
+        """
+        while self._tasks:
+            await asyncio.wait(set(self._tasks))
+
+    async def endless_synchronization(self) -> None:
+        """
+        Запускает бесконечный цикл.
+        Загружает на диск новые файлы.
+        Удаляет из диска файлы, которых нет в локальной директории.
+        Перезаписывает локально измененные файлы.
+        В двустороннем режиме скачивает новые и измененные в облаке файлы.
+        :return: None
+        """
+        await self._yandex_api.create_cloud_folder_if_not_exists()
+        try:
+            failures = 0
+            while True:
+                if not await self.synchronize():
+                    await asyncio.sleep(self._yandex_api.recovery_delay(failures))
+                    failures += 1
+                    continue
+                failures = 0
+                await self._watch()
+        finally:
+            await self._yandex_api.close()
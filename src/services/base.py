@@ -0,0 +1,1012 @@
+from collections.abc import Callable, Mapping
+from datetime import timezone
+from functools import partial
+from threading import Lock
+from time import monotonic, perf_counter
+from types import MappingProxyType
+from typing import AbstractSet, NamedTuple
+
+from loguru import logger
+
+from api import BaseOperationPoller, CloudFile
+from metrics import TRANSFER_SECONDS
+from services.digests import DigestCache
+from services.journal import TransferJournal
+from services.moves import Match, MoveMatcher
+from services.settle import SettleTracker
+from services.state import SyncState
+from services.system import LocalFile, LocaleTracking, parent_directories, topmost
+from services.watcher import InotifyWatcher
+
+
+class Changes(NamedTuple):
+    """
+    Изменения, которые нужно применить к облаку,
+    и в двустороннем режиме - изменения в облаке, которые нужно применить локально.
+    Значения по умолчанию неизменяемые, потому что общие для всех экземпляров
+    """
+
+    local_files: dict[str, LocalFile]
+    new_files: set[str]
+    modified_files: set[str]
+    deleted_files: set[str]
+    new_directories: set[str]
+    deleted_directories: set[str]
+    cloud_md5: dict[str, str | None]
+    moves: Mapping[str, str] = MappingProxyType({})
+    directory_moves: Mapping[str, str] = MappingProxyType({})
+    hashed: AbstractSet[str] = frozenset()
+    matcher: MoveMatcher | None = None
+    held_files: AbstractSet[str] = frozenset()
+    held_directories: AbstractSet[str] = frozenset()
+    downloads: AbstractSet[str] = frozenset()
+    cloud_files: Mapping[str, CloudFile] = MappingProxyType({})
+    cloud_deleted_files: AbstractSet[str] = frozenset()
+    cloud_new_directories: AbstractSet[str] = frozenset()
+    cloud_deleted_directories: AbstractSet[str] = frozenset()
+
+    def is_empty(self) -> bool:
+        """
+        Проверяет, что применять нечего
+
+        :return: bool
+        """
+        return not (
+            self.new_files
+            or self.moves
+            or self.directory_moves
+            or self.hashed
+            or self.modified_files
+            or self.deleted_files
+            or self.new_directories
+            or self.deleted_directories
+            or self.held_files
+            or self.held_directories
+            or self.downloads
+            or self.cloud_deleted_files
+            or self.cloud_new_directories
+            or self.cloud_deleted_directories
+        )
+
+
+class Countdown:
+    """
+    Вызывает функцию, когда завершатся все задачи группы,
+    включая операции, которые сервер выполняет асинхронно.
+    Счетчик начинается с единицы, которую снимает done() после постановки
+    всех задач, поэтому функция не вызывается раньше времени
+    """
+
+    def __init__(self, callback: Callable[[], None]) -> None:
+        """
+        Инициализатор класса
+
+        :param callback: функция, которая будет вызвана в потоке или задаче,
+         завершившей группу
+        """
+        self._callback = callback
+        self._count = 1
+        self._lock = Lock()
+
+    def add(self) -> None:
+        """
+        Добавляет в группу задачу или операцию
+
+        :return: None
+        """
+        with self._lock:
+            self._count += 1
+
+    def done(self) -> None:
+        """
+        Отмечает задачу или операцию завершенной
+
+        :return: None
+        """
+        with self._lock:
+            self._count -= 1
+            finished = not self._count
+        if finished:
+            self._callback()
+
+
+class BaseSynchronization:
+    """
+    Общая логика синхронизации: поиск изменений по индексу, сверка с облаком
+    и обновление индекса по результатам запросов.
+    Наследники определяют, как именно выполняются запросы к api
+    """
+
+    def __init__(
+        self,
+        local_tracking: LocaleTracking,
+        state: SyncState,
+        digests: DigestCache,
+        journal: TransferJournal,
+        operations: BaseOperationPoller,
+        interval: int,
+        reconcile_interval: int,
+        watcher: InotifyWatcher | None = None,
+        two_way: bool = False,
+        name: str = "",
+        settle_time: float = 0,
+    ) -> None:
+        """
+        Инициализатор класса
+
+        :param local_tracking: экземпляр LocaleTracking
+        :param state: индекс последних синхронизированных состояний файлов
+        :param digests: кэш md5 локальных файлов
+        :param journal: журнал передач файлов, прерванных аварийным завершением
+        :param operations: опросчик асинхронных операций апи,
+         может быть общим для нескольких пар директорий
+        :param interval: интервал между проверками файлов (в секундах).
+         Если передан watcher, это интервал между страховочными полными сканированиями
+        :param reconcile_interval: интервал между полными сверками с облаком (в секундах),
+         0 - сверка только при пустом индексе
+        :param watcher: экземпляр InotifyWatcher или None для режима опроса
+        :param two_way: скачивать ли новые и измененные в облаке файлы
+         вместо удаления их из облака
+        :param name: название пары директорий для логов и общего пула задач
+        :param settle_time: сколько секунд новый или измененный файл не должен меняться,
+         чтобы его можно было загрузить. 0 - файлы загружаются сразу
+        """
+        self._locale_tracking = local_tracking
+        self._state = state
+        self._digests = digests
+        self._journal = journal
+        self._retry: set[str] | None = None
+        self._operations = operations
+        self._interval = interval
+        self._reconcile_interval = reconcile_interval
+        self._watcher = watcher
+        self._two_way = two_way
+        self._name = name
+        self._settling = SettleTracker(settle_time)
+        self._creating: set[str] = set()
+        self._creating_lock = Lock()
+        self._last_reconcile = monotonic() if len(state) else None
+
+    @property
+    def name(self) -> str:
+        """
+        Название синхронизируемой пары директорий
+
+        :return: str
+        """
+        return self._name
+
+    @property
+    def interval(self) -> int:
+        """
+        Интервал между полными сканированиями (в секундах)
+
+        :return: int
+        """
+        return self._interval
+
+    @property
+    def watcher(self) -> InotifyWatcher | None:
+        """
+        Наблюдатель за изменениями или None в режиме опроса
+
+        :return: InotifyWatcher | None
+        """
+        return self._watcher
+
+    def settle_timeout(self) -> float | None:
+        """
+        Через сколько секунд пора снова проверить файлы, загрузка которых отложена
+        до окончания записи
+
+        :return: секунды или None, если таких файлов нет
+        """
+        return self._settling.timeout()
+
+    def settled_paths(self) -> set[str]:
+        """
+        Отложенные файлы, которые пора проверить снова
+
+        :return: множество путей
+        """
+        return self._settling.due()
+
+    def _busy_paths(self) -> set[str]:
+        """
+        Пути, которые цикл синхронизации пока не должен трогать:
+        пути незавершенных операций на сервере и новые директории,
+        файлы в которых ждут создания этих директорий
+
+        :return: множество путей
+        """
+        with self._creating_lock:
+            creating = set(self._creating)
+        return self._operations.paths(self._name) | creating
+
+    def _need_reconcile(self) -> bool:
+        """
+        Проверяет, пора ли выполнить полную сверку с облаком.
+        В двустороннем режиме облако сверяется в каждом полном цикле,
+        потому что только так можно узнать об изменениях в нем
+
+        :return: bool
+        """
+        if self._last_reconcile is None or self._two_way:
+            return True
+        return (
+            self._reconcile_interval > 0
+            and monotonic() - self._last_reconcile >= self._reconcile_interval
+        )
+
+    def _changes(
+        self,
+        local_files: dict[str, LocalFile],
+        new_files: set[str],
+        modified_files: set[str],
+        deleted_files: set[str],
+        new_directories: set[str],
+        deleted_directories: set[str],
+        cloud_md5: dict[str, str | None] | None = None,
+    ) -> Changes:
+        """
+        Дополняет и логирует найденные изменения.
+        Добавляет отсутствующие в облаке родительские директории новых файлов,
+        убирает удаления, которые покрываются удалением родительской директории.
+        Пути, для которых сервер еще выполняет операцию, откладываются до ее завершения.
+        Файлы, которые еще могут записываться, откладываются до окончания записи.
+        Удаленные пути, подходящие под шаблоны ignore, в облаке не удаляются
+
+        :param local_files: информация о локальных файлах
+        :param new_files: файлы, которых нет в облаке
+        :param modified_files: файлы, измененные локально
+        :param deleted_files: файлы, удаленные локально
+        :param new_directories: директории, которых нет в облаке
+        :param deleted_directories: директории, удаленные локально
+        :param cloud_md5: md5 файлов в облаке. Если не передан, берется из индекса
+        :return: Changes
+        """
+        closed = self._watcher.pop_closed() if self._watcher is not None else ()
+        unsettled = self._settling.unsettled(
+            new_files | modified_files, local_files, closed
+        )
+        if unsettled:
+            new_files = new_files - unsettled
+            modified_files = modified_files - unsettled
+            logger.info("Файлы еще записываются, загрузка отложена {}", unsettled)
+        ignore = self._locale_tracking.ignore
+        if ignore:
+            deleted_files = {path for path in deleted_files if not ignore.ignored(path)}
+            deleted_directories = {
+                path for path in deleted_directories if not ignore.ignored(path, True)
+            }
+        if self._retry:
+            retry = new_files & self._retry
+            new_files = new_files - retry
+            modified_files = modified_files | retry
+            self._retry -= retry | modified_files | deleted_files
+        busy = self._busy_paths()
+        if busy:
+            new_files = topmost(new_files, busy) - busy
+            modified_files = topmost(modified_files, busy) - busy
+            deleted_files = topmost(deleted_files, busy) - busy
+            new_directories = topmost(new_directories, busy) - busy
+            deleted_directories = topmost(deleted_directories, busy) - busy
+        new_directories = new_directories | {
+            parent
+            for filename in new_files
+            for parent in parent_directories(filename)
+            if not self._state.has_directory(parent)
+        }
+        deleted_directories = topmost(deleted_directories, deleted_directories)
+        deleted_files = topmost(deleted_files, deleted_directories)
+        if cloud_md5 is None:
+            cloud_md5 = {
+                filename: state.revision
+                for filename in modified_files
+                if (state := self._state.get(filename)) is not None
+            }
+        if new_directories:
+            logger.info("Новые директории {}", new_directories)
+        if deleted_directories:
+            logger.info("Удаленные директории {}", deleted_directories)
+        if deleted_files:
+            logger.info("Удаленные файлы {}", deleted_files)
+        else:
+            logger.info("Нет удаленных файлов")
+        if new_files:
+            logger.info("Новые файлы {}", new_files)
+        else:
+            logger.info("Нет новых файлов")
+        if modified_files:
+            logger.info("Измененные файлы {}", modified_files)
+        else:
+            logger.info("Нет измененных файлов")
+        return Changes(
+            local_files=local_files,
+            new_files=new_files,
+            modified_files=modified_files,
+            deleted_files=deleted_files,
+            new_directories=new_directories,
+            deleted_directories=deleted_directories,
+            cloud_md5=cloud_md5,
+        )
+
+    def _scan_changes(
+        self, local_files: dict[str, LocalFile], local_directories: set[str]
+    ) -> Changes:
+        """
+        Сравнивает результат полного сканирования с индексом
+
+        :param local_files: информация о локальных файлах
+        :param local_directories: локальные директории
+        :return: Changes
+        """
+        new_files, modified_files, deleted_files = self._state.diff(local_files)
+        synced_directories = self._state.directories()
+        self._settling.retain(local_files.keys())
+        return self._changes(
+            local_files=local_files,
+            new_files=new_files,
+            modified_files=modified_files,
+            deleted_files=deleted_files,
+            new_directories=local_directories - synced_directories,
+            deleted_directories=synced_directories - local_directories,
+        )
+
+    def _paths_changes(self, paths: set[str]) -> Changes | None:
+        """
+        Сравнивает с индексом только переданные пути
+
+        :param paths: пути файлов и директорий, о которых сообщил watcher
+        :return: Changes или None, если изменений нет
+        """
+        local_files, local_directories = self._locale_tracking.get_files(paths)
+        new_files, modified_files, deleted_files = self._state.diff(
+            local_files, paths=paths
+        )
+        self._settling.discard(paths - local_files.keys())
+        new_directories = {
+            path for path in local_directories if not self._state.has_directory(path)
+        }
+        deleted_directories = {
+            path
+            for path in paths - local_directories
+            if self._state.has_directory(path)
+        }
+        if not (
+            new_files
+            or modified_files
+            or deleted_files
+            or new_directories
+            or deleted_directories
+        ):
+            return None
+        return self._changes(
+            local_files=local_files,
+            new_files=new_files,
+            modified_files=modified_files,
+            deleted_files=deleted_files,
+            new_directories=new_directories,
+            deleted_directories=deleted_directories,
+        )
+
+    def _reconcile_changes(
+        self,
+        local_files: dict[str, LocalFile],
+        local_directories: set[str],
+        cloud_listing: dict[str, CloudFile],
+    ) -> Changes:
+        """
+        Сверяет локальную директорию с полным списком файлов в облаке и перестраивает индекс.
+        Файлы, которые не совпадают с индексом, сравниваются с облаком по md5.
+        Файлы с одинаковым содержимым только записываются в индекс без повторной загрузки.
+        Ресурсы облака, подходящие под шаблоны ignore, не учитываются
+
+        :param local_files: информация о локальных файлах
+        :param local_directories: локальные директории
+        :param cloud_listing: ресурсы в облаке
+        :return: Changes
+        """
+        ignore = self._locale_tracking.ignore
+        if ignore:
+            kept = ignore.kept(
+                {path: item.type == "dir" for path, item in cloud_listing.items()}
+            )
+            cloud_listing = {path: cloud_listing[path] for path in kept}
+        if self._two_way:
+            return self._two_way_changes(local_files, local_directories, cloud_listing)
+        cloud_files = {
+            path: cloud_file
+            for path, cloud_file in cloud_listing.items()
+            if cloud_file.type == "file"
+        }
+        cloud_directories = cloud_listing.keys() - cloud_files.keys()
+        for directory in local_directories & cloud_directories:
+            if not self._state.has_directory(directory):
+                self._state.add_directory(directory)
+        for directory in self._state.directories() - cloud_directories:
+            self._state.remove_directory(directory)
+        modified_files = set()
+        for filename in local_files.keys() & cloud_files.keys():
+            state = self._state.get(filename)
+            cloud_file = cloud_files[filename]
+            if state is None or state != (*local_files[filename], cloud_file.md5):
+                modified_files.add(filename)
+        for filename in self._state.paths() - local_files.keys() - cloud_files.keys():
+            self._state.remove(filename)
+        self._digests.retain(local_files.values())
+        self._settling.retain(local_files.keys())
+        self._last_reconcile = monotonic()
+        return self._changes(
+            local_files=local_files,
+            new_files=local_files.keys() - cloud_files.keys(),
+            modified_files=modified_files,
+            deleted_files=cloud_files.keys() - local_files.keys(),
+            new_directories=local_directories - cloud_directories,
+            deleted_directories=cloud_directories - local_directories,
+            cloud_md5={
+                filename: cloud_files[filename].md5
+                for filename in modified_files
+                if cloud_files[filename].size == local_files[filename].size
+            },
+        )
+
+    @staticmethod
+    def _cloud_wins(local_file: LocalFile, cloud_file: CloudFile) -> bool:
+        """
+        Решает конфликт, когда файл изменился и локально, и в облаке:
+        побеждает версия, измененная позже
+
+        :param local_file: информация о локальном файле
+        :param cloud_file: информация о файле в облаке
+        :return: True, если нужно оставить версию из облака
+        """
+        cloud_modified = cloud_file.modified.replace(tzinfo=timezone.utc).timestamp()
+        return cloud_modified > local_file.mtime_ns / 1e9
+
+    def _two_way_changes(
+        self,
+        local_files: dict[str, LocalFile],
+        local_directories: set[str],
+        cloud_listing: dict[str, CloudFile],
+    ) -> Changes:
+        """
+        Сверяет локальную директорию с облаком в обе стороны.
+        Индекс хранит состояние каждого файла на момент последней синхронизации,
+        поэтому по нему видно, на какой стороне файл появился, изменился или был удален.
+        Если файл изменился на обеих сторонах, побеждает более поздняя версия.
+        Директория, в которой на другой стороне появились новые файлы, не удаляется
+
+        :param local_files: информация о локальных файлах
+        :param local_directories: локальные директории
+        :param cloud_listing: ресурсы в облаке
+        :return: Changes
+        """
+        cloud_files = {
+            path: cloud_file
+            for path, cloud_file in cloud_listing.items()
+            if cloud_file.type == "file"
+        }
+        cloud_directories = cloud_listing.keys() - cloud_files.keys()
+        new_files, modified_files, deleted_files = set(), set(), set()
+        downloads, cloud_deleted_files = set(), set()
+        for filename in local_files.keys() | cloud_files.keys():
+            local_file = local_files.get(filename)
+            cloud_file = cloud_files.get(filename)
+            state = self._state.get(filename)
+            if cloud_file is None:
+                if state is not None and state[:3] == local_file:
+                    cloud_deleted_files.add(filename)
+                else:
+                    new_files.add(filename)
+            elif local_file is None:
+                if state is not None and state.revision == cloud_file.md5:
+                    deleted_files.add(filename)
+                else:
+                    downloads.add(filename)
+            else:
+                local_changed = state is None or state[:3] != local_file
+                cloud_changed = state is None or state.revision != cloud_file.md5
+                if not cloud_changed:
+                    if local_changed:
+                        modified_files.add(filename)
+                elif not local_changed or self._cloud_wins(local_file, cloud_file):
+                    downloads.add(filename)
+                else:
+                    modified_files.add(filename)
+        kept_in_cloud = {
+            parent for filename in downloads for parent in parent_directories(filename)
+        }
+        deleted_directories = {
+            directory
+            for directory in cloud_directories - local_directories
+            if self._state.has_directory(directory) and directory not in kept_in_cloud
+        }
+        kept_locally = {
+            parent for filename in new_files for parent in parent_directories(filename)
+        }
+        cloud_deleted_directories = {
+            directory
+            for directory in local_directories - cloud_directories
+            if self._state.has_directory(directory) and directory not in kept_locally
+        }
+        new_directories = (
+            local_directories - cloud_directories - cloud_deleted_directories
+        )
+        cloud_new_directories = (
+            cloud_directories - local_directories - deleted_directories
+        )
+        for directory in local_directories & cloud_directories:
+            if not self._state.has_directory(directory):
+                self._state.add_directory(directory)
+        for directory in self._state.directories() - cloud_directories:
+            self._state.remove_directory(directory)
+        for filename in self._state.paths() - local_files.keys() - cloud_files.keys():
+            self._state.remove(filename)
+        self._digests.retain(local_files.values())
+        self._settling.retain(local_files.keys())
+        self._last_reconcile = monotonic()
+        changes = self._changes(
+            local_files=local_files,
+            new_files=new_files,
+            modified_files=modified_files,
+            deleted_files=deleted_files,
+            new_directories=new_directories,
+            deleted_directories=deleted_directories,
+            cloud_md5={
+                filename: cloud_files[filename].md5
+                for filename in modified_files | downloads
+                if filename in local_files
+                and cloud_files[filename].size == local_files[filename].size
+            },
+        )
+        writing = self._settling.pending()
+        if writing:
+            downloads = downloads - writing
+            cloud_deleted_files = cloud_deleted_files - writing
+        busy = self._busy_paths()
+        if busy:
+            downloads = topmost(downloads, busy) - busy
+            cloud_deleted_files = topmost(cloud_deleted_files, busy) - busy
+            cloud_deleted_directories = (
+                topmost(cloud_deleted_directories, busy) - busy
+            )
+        if downloads:
+            logger.info("Новые и измененные файлы в облаке {}", downloads)
+        if cloud_deleted_files:
+            logger.info("Файлы, удаленные из облака {}", cloud_deleted_files)
+        if cloud_new_directories:
+            logger.info("Новые директории в облаке {}", cloud_new_directories)
+        if cloud_deleted_directories:
+            logger.info("Директории, удаленные из облака {}", cloud_deleted_directories)
+        return changes._replace(
+            downloads=downloads,
+            cloud_files=cloud_files,
+            cloud_deleted_files=cloud_deleted_files,
+            cloud_new_directories=cloud_new_directories,
+            cloud_deleted_directories=cloud_deleted_directories,
+        )
+
+    def _detect_moves(self, changes: Changes) -> Changes:
+        """
+        Находит среди новых файлов переименованные и копии уже синхронизированных,
+        чтобы переместить или скопировать их на сервере вместо повторной загрузки.
+        Файл с тем же inode, размером и временем изменения, что и удаленный,
+        считается переименованным без чтения содержимого.
+        Если так переименованы все файлы удаленной директории,
+        директория перемещается одним запросом.
+        Остальные новые файлы, для которых в индексе есть файл такого же размера,
+        переносятся в hashed: их md5 считается в задачах пула, а не в цикле
+        синхронизации. Удаленные файлы и директории, которые могут оказаться
+        источниками перемещений, переносятся в held_files и held_directories:
+        их нужно удалить только после завершения перемещений и этих задач
+
+        :param changes: найденные изменения
+        :return: Changes, в которых такие файлы перенесены в moves,
+         directory_moves и hashed
+        """
+        if not changes.new_files:
+            return changes
+        local_files = changes.local_files
+        candidates = self._state.with_sizes(
+            {local_files[filename].size for filename in changes.new_files}
+        )
+        if not candidates:
+            return changes
+        removed = set(changes.deleted_files)
+        for directory in changes.deleted_directories:
+            prefix = f"{directory}/"
+            removed.update(
+                path
+                for entries in candidates.values()
+                for path, _ in entries
+                if path.startswith(prefix)
+            )
+        matcher = MoveMatcher(candidates, removed, changes.modified_files)
+        renamed = {}
+        for filename in sorted(changes.new_files):
+            source = matcher.same_file(local_files[filename])
+            if source is not None:
+                renamed[filename] = source
+        directory_moves = self._directory_moves(changes, renamed)
+        moves = {
+            filename: source
+            for filename, source in renamed.items()
+            if topmost({filename}, directory_moves.keys())
+        }
+        hashed = {
+            filename
+            for filename in changes.new_files - renamed.keys()
+            if matcher.has_candidates(local_files[filename])
+        }
+        if not renamed and not hashed:
+            return changes
+        if moves:
+            logger.info("Перемещенные файлы {}", moves)
+        if hashed:
+            logger.info("Файлы, которые будут сверены с индексом по md5 {}", hashed)
+        deleted_directories = changes.deleted_directories - set(
+            directory_moves.values()
+        )
+        sources = matcher.sources(local_files[filename].size for filename in hashed)
+        held_files = changes.deleted_files & sources
+        pending = set(moves.values()) | sources
+        held_directories = {
+            directory
+            for directory in deleted_directories
+            if any(path.startswith(f"{directory}/") for path in pending)
+        }
+        return changes._replace(
+            new_files=changes.new_files - renamed.keys() - hashed,
+            deleted_files=changes.deleted_files - set(moves.values()) - held_files,
+            new_directories=topmost(
+                changes.new_directories - directory_moves.keys(),
+                directory_moves.keys(),
+            ),
+            deleted_directories=deleted_directories - held_directories,
+            moves=moves,
+            directory_moves=directory_moves,
+            hashed=hashed,
+            matcher=matcher if hashed else None,
+            held_files=held_files,
+            held_directories=held_directories,
+        )
+
+    def _directory_moves(
+        self, changes: Changes, renamed: dict[str, str]
+    ) -> dict[str, str]:
+        """
+        Находит переименованные директории: все файлы удаленной директории
+        переименованы с теми же относительными путями в одну новую директорию,
+        а других новых файлов и директорий, кроме бывших поддиректорий, в ней нет
+
+        :param changes: найденные изменения
+        :param renamed: новые и старые пути файлов, переименованных без изменения inode
+        :return: словарь из новых и старых путей директорий
+        """
+        if not changes.deleted_directories or not renamed:
+            return {}
+        indexed = self._state.paths()
+        indexed_directories = self._state.directories()
+        directory_moves = {}
+        for directory in changes.deleted_directories:
+            prefix = f"{directory}/"
+            moved = {
+                filename: source.removeprefix(prefix)
+                for filename, source in renamed.items()
+                if source.startswith(prefix)
+            }
+            if not moved or len(moved) != sum(
+                path.startswith(prefix) for path in indexed
+            ):
+                continue
+            targets = {
+                filename.removesuffix(f"/{relative}")
+                if filename.endswith(f"/{relative}")
+                else None
+                for filename, relative in moved.items()
+            }
+            if len(targets) != 1 or None in targets:
+                continue
+            (target,) = targets
+            if target not in changes.new_directories:
+                continue
+            target_prefix = f"{target}/"
+            if any(
+                filename.startswith(target_prefix) and filename not in moved
+                for filename in changes.new_files
+            ):
+                continue
+            subdirectories = {
+                target + path.removeprefix(directory)
+                for path in indexed_directories
+                if path.startswith(prefix)
+            }
+            if any(
+                path.startswith(target_prefix) and path not in subdirectories
+                for path in changes.new_directories
+            ):
+                continue
+            directory_moves[target] = directory
+        if directory_moves:
+            logger.info("Перемещенные директории {}", directory_moves)
+        return directory_moves
+
+    def _content_match(
+        self, filename: str, local_file: LocalFile, matcher: MoveMatcher
+    ) -> Match | None:
+        """
+        Считает md5 нового файла и ищет в индексе файл с тем же содержимым.
+        Вызывается в потоке пула
+
+        :param filename: путь к новому файлу
+        :param local_file: информация о новом файле
+        :param matcher: сопоставление новых файлов с индексом в текущем цикле
+        :return: Match или None, если файл нужно загрузить
+        """
+        md5 = self._digests.get(filename, local_file)
+        if md5 is None:
+            return None
+        match = matcher.match(local_file, md5)
+        if match is not None:
+            logger.info(
+                "{} {} совпадает с {}",
+                "Перемещенный файл" if match.move else "Копия",
+                filename,
+                match.source,
+            )
+        return match
+
+    @staticmethod
+    def _directory_contents(
+        path: str, local_files: dict[str, LocalFile]
+    ) -> tuple[list[str], set[str]]:
+        """
+        Содержимое новой директории, которое нужно загрузить,
+        если ее не удалось переместить на сервере
+
+        :param path: путь к директории
+        :param local_files: информация о локальных файлах
+        :return: директории от внешних к вложенным, начиная с самой path, и файлы
+        """
+        prefix = f"{path}/"
+        files = {filename for filename in local_files if filename.startswith(prefix)}
+        directories = {path} | {
+            parent
+            for filename in files
+            for parent in parent_directories(filename)
+            if parent.startswith(prefix)
+        }
+        return sorted(directories, key=lambda directory: directory.count("/")), files
+
+    def _moved(
+        self, filename: str, source: str, local_file: LocalFile, remove_source: bool
+    ) -> None:
+        """
+        Запоминает результат перемещения или копирования файла на сервере
+
+        :param filename: путь к новому файлу
+        :param source: путь к исходному файлу
+        :param local_file: информация о новом файле на момент сканирования
+        :param remove_source: удалить ли исходный файл из индекса
+        :return: None
+        """
+        state = self._state.get(source)
+        if state is None:
+            return
+        if remove_source:
+            self._state.remove(source)
+        self._state.update(filename, local_file, state.revision)
+        self._digests.put(local_file, state.revision)
+
+    def _moved_directory(
+        self, path: str, source: str, local_files: dict[str, LocalFile]
+    ) -> None:
+        """
+        Запоминает результат перемещения директории на сервере
+
+        :param path: новый путь к директории
+        :param source: старый путь к директории
+        :param local_files: информация о локальных файлах на момент сканирования
+        :return: None
+        """
+        self._state.move_directory(source, path, local_files)
+
+    def _settle(
+        self,
+        operation: str,
+        started: float,
+        result: bool | str,
+        on_success: Callable[[], None],
+        *paths: str,
+        group: Countdown | None = None,
+    ) -> bool:
+        """
+        Учитывает результат запроса, который сервер может выполнить асинхронно.
+        Если сервер вернул ссылку на операцию, индекс обновляется после ее завершения,
+        а до этого пути не обрабатываются повторно
+
+        :param operation: название операции
+        :param started: время начала операции по perf_counter
+        :param result: результат метода апи: True, False или ссылка на операцию
+        :param on_success: функция, обновляющая индекс после успешного выполнения
+        :param paths: пути, к которым относится операция
+        :param group: группа, которая ждет завершения асинхронной операции
+        :return: False, если сервер не выполнил запрос и не принял его к выполнению
+        """
+        if isinstance(result, str):
+            if group is not None:
+                group.add()
+            self._operations.track(
+                href=result,
+                name=operation,
+                paths=paths,
+                on_finish=partial(
+                    self._finished, operation, started, on_success, group=group
+                ),
+                owner=self._name,
+            )
+            return True
+        self._finished(operation, started, on_success, result)
+        return result
+
+    def _finished(
+        self,
+        operation: str,
+        started: float,
+        on_success: Callable[[], None],
+        success: bool,
+        group: Countdown | None = None,
+    ) -> None:
+        """
+        Учитывает завершение операции в метриках и индексе
+
+        :param operation: название операции
+        :param started: время начала операции по perf_counter
+        :param on_success: функция, обновляющая индекс после успешного выполнения
+        :param success: успешно ли завершилась операция
+        :param group: группа, которая ждет завершения операции
+        :return: None
+        """
+        try:
+            self._observe(operation, started, success)
+            if success:
+                on_success()
+        finally:
+            if group is not None:
+                group.done()
+
+    def _apply_local_changes(self, changes: Changes) -> None:
+        """
+        Применяет к локальной директории изменения, найденные в облаке
+        в двустороннем режиме: создает новые директории, удаляет файлы,
+        которые не изменялись локально, и опустевшие директории.
+        Скачивание файлов выполняется отдельно, в общем пуле задач
+
+        :param changes: изменения, которые нужно применить
+        :return: None
+        """
+        for directory in sorted(changes.cloud_new_directories):
+            if self._locale_tracking.create_directory(directory):
+                self._state.add_directory(directory)
+        for filename in changes.cloud_deleted_files:
+            if self._locale_tracking.remove_file(
+                filename, changes.local_files[filename]
+            ):
+                self._state.remove(filename)
+        for directory in sorted(changes.cloud_deleted_directories, reverse=True):
+            if self._locale_tracking.remove_directory(directory):
+                self._state.remove_directory(directory)
+
+    def _downloaded(self, filename: str, md5: str | None) -> None:
+        """
+        Запоминает результат скачивания файла.
+        Состояние берется у файла, который получился после переименования
+
+        :param filename: путь к файлу
+        :param md5: md5 скачанного содержимого или None, если скачать не удалось
+        :return: None
+        """
+        if md5 is None:
+            return
+        local_files, _ = self._locale_tracking.get_files({filename})
+        local_file = local_files.get(filename)
+        if local_file is None:
+            return
+        for parent in parent_directories(filename):
+            if not self._state.has_directory(parent):
+                self._state.add_directory(parent)
+        self._state.update(filename, local_file, md5)
+        self._digests.put(local_file, md5)
+
+    def _interrupted_uploads(self) -> dict[str, LocalFile]:
+        """
+        Разбирает передачи, прерванные при прошлом запуске.
+        Временные файлы прерванных скачиваний удаляются, файл скачается заново.
+        Загрузка считается завершенной, если индекс уже содержит файл в том же состоянии.
+        Если файла больше нет, загрузка не нужна
+
+        :return: прерванные загрузки, которые нужно сверить с облаком:
+         пути файлов и их текущее состояние
+        """
+        self._retry = set()
+        uploads = {}
+        interrupted = self._journal.interrupted()
+        local_files, _ = self._locale_tracking.get_files(set(interrupted))
+        for path, transfer in interrupted.items():
+            local_file = local_files.get(path)
+            state = self._state.get(path)
+            if transfer.kind == "download":
+                self._locale_tracking.remove_partial_downloads(path)
+            elif local_file is not None and (
+                state is None or state[:3] != local_file
+            ):
+                uploads[path] = local_file
+                continue
+            self._journal.finish(path)
+        return uploads
+
+    def _recovered(
+        self, filename: str, local_file: LocalFile, cloud_md5: str | None
+    ) -> None:
+        """
+        Завершает разбор прерванной загрузки.
+        Если в облаке уже лежит то же содержимое, загрузка успела завершиться
+        и файл только записывается в индекс. Иначе файл загружается заново
+        с перезаписью в ближайшем цикле
+
+        :param filename: путь к файлу
+        :param local_file: текущее состояние файла
+        :param cloud_md5: md5 файла в облаке или None, если его нет или он неизвестен
+        :return: None
+        """
+        if cloud_md5 is not None and self._digests.get(filename, local_file) == (
+            cloud_md5
+        ):
+            logger.info("Прерванная загрузка {} успела завершиться", filename)
+            self._unchanged(filename, local_file, cloud_md5)
+            self._journal.finish(filename)
+            return
+        logger.info("Прерванная загрузка {} будет повторена", filename)
+        self._retry.add(filename)
+
+    def _uploaded(self, filename: str, local_file: LocalFile, md5: str | None) -> None:
+        """
+        Запоминает результат загрузки файла
+
+        :param filename: путь к файлу
+        :param local_file: информация о файле на момент сканирования
+        :param md5: md5 загруженного содержимого или None, если загрузка не удалась
+        :return: None
+        """
+        if md5 is not None:
+            self._state.update(filename, local_file, md5)
+            self._digests.put(local_file, md5)
+
+    def _unchanged(self, filename: str, local_file: LocalFile, expected: str) -> None:
+        """
+        Запоминает файл, содержимое которого совпадает с облаком
+
+        :param filename: путь к файлу
+        :param local_file: информация о файле на момент сканирования
+        :param expected: md5 файла в облаке
+        :return: None
+        """
+        logger.debug("Содержимое {} не изменилось", filename)
+        self._state.update(filename, local_file, expected)
+
+    @staticmethod
+    def _observe(operation: str, started: float, success: bool) -> None:
+        """
+        Учитывает операцию с файлом или директорией в метриках
+
+        :param operation: название операции
+        :param started: время начала операции по perf_counter
+        :param success: успешно ли завершилась операция
+        :return: None
+        """
+        TRANSFER_SECONDS.observe(
+            perf_counter() - started,
+            operation=operation,
+            result="ok" if success else "failed",
+        )
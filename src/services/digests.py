@@ -0,0 +1,144 @@
+import hashlib
+import os
+import sqlite3
+from collections.abc import Iterable
+from threading import Lock
+
+from loguru import logger
+
+from services.system import LocalFile
+
+
+class DigestCache:
+    """
+    Кэш md5 локальных файлов.
+    Ключ - (inode, размер, время изменения), поэтому неизмененный файл никогда
+    не хешируется повторно, а замена файла другим с тем же временем изменения
+    (например, при переименовании поверх) обнаруживается по смене inode
+    """
+
+    def __init__(self, path: str, local_folder: str, chunk_size: int) -> None:
+        """
+        Инициализатор класса
+
+        :param path: путь к файлу базы данных
+        :param local_folder: локальная директория для отслеживания
+        :param chunk_size: размер блока (в байтах), которыми читается файл при хешировании
+        """
+        self._local_folder = local_folder
+        self._chunk_size = chunk_size
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS digests ("
+            "inode INTEGER NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, "
+            "md5 TEXT NOT NULL, "
+            "PRIMARY KEY (inode, size, mtime_ns))"
+        )
+        self._connection.commit()
+        self._digests: dict[tuple[int, int, int], str] = {
+            (inode, size, mtime_ns): md5
+            for inode, size, mtime_ns, md5 in self._connection.execute(
+                "SELECT inode, size, mtime_ns, md5 FROM digests"
+            )
+        }
+
+    @staticmethod
+    def _key(local_file: LocalFile) -> tuple[int, int, int]:
+        """
+        Формирует ключ кэша
+
+        :param local_file: информация о локальном файле
+        :return: кортеж из inode, размера и времени изменения
+        """
+        return local_file.inode, local_file.size, local_file.mtime_ns
+
+    def put(self, local_file: LocalFile, md5: str) -> None:
+        """
+        Сохраняет md5 файла
+
+        :param local_file: информация о локальном файле
+        :param md5: md5 содержимого
+        :return: None
+        """
+        key = self._key(local_file)
+        with self._lock:
+            if self._digests.get(key) == md5:
+                return
+            self._digests[key] = md5
+            self._connection.execute(
+                "INSERT OR REPLACE INTO digests (inode, size, mtime_ns, md5) "
+                "VALUES (?, ?, ?, ?)",
+                (*key, md5),
+            )
+            self._connection.commit()
+
+    def _compute(self, filename: str, local_file: LocalFile) -> str | None:
+        """
+        Считает md5 файла блоками фиксированного размера
+
+        :param filename: название файла
+        :param local_file: информация о файле, полученная при сканировании
+        :return: md5 или None, если файл удален или изменился во время чтения
+        """
+        md5 = hashlib.md5()
+        try:
+            with open(os.path.join(self._local_folder, filename), "rb") as file:
+                while chunk := file.read(self._chunk_size):
+                    md5.update(chunk)
+                stat = os.fstat(file.fileno())
+        except OSError:
+            logger.exception("Не удалось прочитать файл {} для хеширования", filename)
+            return None
+        if (stat.st_size, stat.st_mtime_ns) != (local_file.size, local_file.mtime_ns):
+            logger.info("Файл {} изменился во время хеширования", filename)
+            return None
+        return md5.hexdigest()
+
+    def get(self, filename: str, local_file: LocalFile) -> str | None:
+        """
+        Возвращает md5 файла из кэша или считает его.
+        Вызывается из потоков пула, чтобы хеширование больших файлов не блокировало цикл синхронизации
+
+        :param filename: название файла
+        :param local_file: информация о файле, полученная при сканировании
+        :return: md5 или None, если его не удалось получить
+        """
+        md5 = self._digests.get(self._key(local_file))
+        if md5 is not None:
+            return md5
+        md5 = self._compute(filename, local_file)
+        if md5 is not None:
+            self.put(local_file, md5)
+        return md5
+
+    def retain(self, local_files: Iterable[LocalFile]) -> None:
+        """
+        Удаляет из кэша записи о файлах, которых больше нет
+
+        :param local_files: информация обо всех существующих локальных файлах
+        :return: None
+        """
+        keys = {self._key(local_file) for local_file in local_files}
+        with self._lock:
+            stale = self._digests.keys() - keys
+            if not stale:
+                return
+            for key in stale:
+                del self._digests[key]
+            self._connection.executemany(
+                "DELETE FROM digests WHERE inode = ? AND size = ? AND mtime_ns = ?",
+                stale,
+            )
+            self._connection.commit()
+
+    def close(self) -> None:
+        """
+        Закрывает соединение с базой данных
+
+        :return: None
+        """
+        with self._lock:
+            self._connection.close()
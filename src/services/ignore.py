@@ -0,0 +1,181 @@
+import posixpath
+import re
+from collections.abc import Iterable, Mapping
+from typing import NamedTuple
+
+
+class _Rules(NamedTuple):
+    """Идущие подряд шаблоны с одинаковым знаком, собранные в общие выражения"""
+
+    negate: bool
+    files: re.Pattern | None
+    directories: re.Pattern | None
+
+
+def _translate(pattern: str) -> str:
+    """
+    Переводит шаблон в формате .gitignore в регулярное выражение.
+    * и ? не совпадают с /, ** совпадает с любым количеством директорий
+
+    :param pattern: шаблон без ! в начале и / в конце
+    :return: регулярное выражение для пути относительно отслеживаемой директории
+    """
+    anchored = "/" in pattern
+    pattern = pattern.removeprefix("/")
+    parts = [] if anchored else ["(?:.*/)?"]
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        at_start = index == 0 or pattern[index - 1] == "/"
+        if at_start and pattern.startswith("**/", index):
+            parts.append("(?:.*/)?")
+            index += 3
+            continue
+        if at_start and pattern[index:] == "**":
+            parts.append(".*")
+            break
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "\\" and index + 1 < len(pattern):
+            index += 1
+            parts.append(re.escape(pattern[index]))
+        elif char == "[" and (end := pattern.find("]", index + 2)) != -1:
+            chars = pattern[index + 1 : end]
+            if chars[0] in "!^":
+                chars = "^" + chars[1:]
+            parts.append("[" + chars.replace("\\", "\\\\") + "]")
+            index = end
+        else:
+            parts.append(re.escape(char))
+        index += 1
+    return "".join(parts)
+
+
+def _compile(expressions: list[str]) -> re.Pattern | None:
+    """
+    Объединяет регулярные выражения в одно
+
+    :param expressions: регулярные выражения
+    :return: скомпилированное выражение или None, если выражений нет
+    """
+    if not expressions:
+        return None
+    return re.compile("(?:" + "|".join(expressions) + r")\Z", re.DOTALL)
+
+
+class IgnorePatterns:
+    """
+    Шаблоны путей в формате .gitignore, которые не синхронизируются:
+    временные файлы и файлы подкачки редакторов и т.п.
+    Шаблон без / совпадает с именем на любом уровне, шаблон с / - с путем от корня
+    отслеживаемой директории, шаблон с / в конце - только с директориями,
+    ! в начале возвращает путь, исключенный предыдущими шаблонами.
+    Идущие подряд шаблоны компилируются в одно регулярное выражение,
+    поэтому проверка пути стоит одного-двух вызовов match.
+    Содержимое исключенной директории исключено целиком
+    """
+
+    def __init__(self, patterns: Iterable[str]) -> None:
+        """
+        Инициализатор класса
+
+        :param patterns: шаблоны. Пустые строки и строки, начинающиеся с #, пропускаются
+        """
+        self._rules: list[_Rules] = []
+        files: list[str] = []
+        directories: list[str] = []
+        negate = False
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            negated = pattern.startswith("!")
+            if negated != negate:
+                self._add_rules(negate, files, directories)
+                files, directories = [], []
+                negate = negated
+            pattern = pattern.removeprefix("!")
+            expression = _translate(pattern.rstrip("/"))
+            if not pattern.endswith("/"):
+                files.append(expression)
+            directories.append(expression)
+        self._add_rules(negate, files, directories)
+
+    def _add_rules(
+        self, negate: bool, files: list[str], directories: list[str]
+    ) -> None:
+        """
+        Компилирует очередную группу шаблонов с одинаковым знаком
+
+        :param negate: возвращают ли шаблоны группы исключенные пути
+        :param files: выражения, которые применяются к файлам
+        :param directories: выражения, которые применяются к директориям
+        :return: None
+        """
+        if directories:
+            self._rules.append(_Rules(negate, _compile(files), _compile(directories)))
+
+    def __bool__(self) -> bool:
+        """
+        Проверяет, что задан хотя бы один шаблон
+
+        :return: bool
+        """
+        return bool(self._rules)
+
+    def match(self, path: str, is_dir: bool = False) -> bool:
+        """
+        Проверяет сам путь без учета родительских директорий.
+        Из нескольких подходящих шаблонов действует последний
+
+        :param path: путь относительно отслеживаемой директории с разделителем /
+        :param is_dir: является ли путь директорией
+        :return: True, если путь исключен
+        """
+        for rules in reversed(self._rules):
+            expression = rules.directories if is_dir else rules.files
+            if expression is not None and expression.match(path):
+                return not rules.negate
+        return False
+
+    def ignored(self, path: str, is_dir: bool = False) -> bool:
+        """
+        Проверяет путь и все его родительские директории
+
+        :param path: путь относительно отслеживаемой директории с разделителем /
+        :param is_dir: является ли путь директорией
+        :return: True, если путь исключен
+        """
+        if not self._rules:
+            return False
+        if self.match(path, is_dir):
+            return True
+        while path := posixpath.dirname(path):
+            if self.match(path, True):
+                return True
+        return False
+
+    def kept(self, paths: Mapping[str, bool]) -> set[str]:
+        """
+        Оставляет из полного дерева путей только неисключенные.
+        Каждый путь проверяется один раз, содержимое исключенных директорий
+        отбрасывается по множеству этих директорий
+
+        :param paths: словарь из путей и признаков директории
+        :return: множество неисключенных путей
+        """
+        if not self._rules:
+            return set(paths)
+        excluded = {path for path, is_dir in paths.items() if self.match(path, is_dir)}
+        if not excluded:
+            return set(paths)
+        kept = set()
+        for path in paths.keys() - excluded:
+            parent = posixpath.dirname(path)
+            while parent and parent not in excluded:
+                parent = posixpath.dirname(parent)
+            if not parent:
+                kept.add(path)
+        return kept
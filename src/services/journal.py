@@ -0,0 +1,175 @@
+import json
+import os
+from threading import Lock
+from typing import NamedTuple
+
+from loguru import logger
+
+from services.system import LocalFile
+
+COMPACT_RECORDS = 10000
+
+
+class Transfer(NamedTuple):
+    """Передача файла, начатая, но еще не завершенная"""
+
+    kind: str
+    local_file: LocalFile | None
+
+
+class TransferJournal:
+    """
+    Журнал передач файлов, который переживает аварийное завершение процесса.
+    Перед загрузкой или скачиванием в файл дописывается запись о начале,
+    после завершения - запись о конце. Записи только дописываются в конец файла.
+    Запись о начале сбрасывается на диск через fsync до начала передачи,
+    иначе при отключении питания передача может пропасть из журнала.
+    Запись о конце не сбрасывается: если она потеряется, завершенная передача
+    только лишний раз будет проверена как прерванная.
+    Незавершенные передачи хранятся в памяти. Когда записей в файле становится
+    намного больше, чем незавершенных передач, файл переписывается заново только с ними.
+    Передачи, оставшиеся незавершенными после перезапуска, считаются прерванными
+    """
+
+    def __init__(self, path: str, compact_records: int = COMPACT_RECORDS) -> None:
+        """
+        Инициализатор класса
+
+        :param path: путь к файлу журнала
+        :param compact_records: количество записей, после которого журнал может быть сжат
+        """
+        self._path = path
+        self._compact_records = compact_records
+        self._lock = Lock()
+        self._transfers: dict[str, Transfer] = {}
+        self._records = 0
+        self._fd: int | None = None
+        self._load()
+        self._interrupted = dict(self._transfers)
+        if self._interrupted:
+            logger.warning(
+                "Прервано передач файлов при прошлом запуске: {}",
+                len(self._interrupted),
+            )
+        self._compact()
+
+    def _load(self) -> None:
+        """
+        Восстанавливает незавершенные передачи из файла.
+        Недописанная при аварийном завершении последняя запись пропускается
+
+        :return: None
+        """
+        try:
+            file = open(self._path, encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Пропущена поврежденная запись журнала передач")
+                    continue
+                if record[0] == "start":
+                    _, path, kind, local_file = record
+                    self._transfers[path] = Transfer(
+                        kind, LocalFile(*local_file) if local_file else None
+                    )
+                else:
+                    self._transfers.pop(record[1], None)
+
+    def _compact(self) -> None:
+        """
+        Переписывает журнал, оставляя только незавершенные передачи.
+        Новый файл записывается рядом и атомарно заменяет старый
+
+        :return: None
+        """
+        temp_path = f"{self._path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            for path, transfer in self._transfers.items():
+                file.write(self._start_record(path, transfer))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self._path)
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_APPEND)
+        self._records = len(self._transfers)
+
+    @staticmethod
+    def _start_record(path: str, transfer: Transfer) -> str:
+        """
+        Запись о начале передачи
+
+        :param path: путь к файлу
+        :param transfer: передача
+        :return: строка журнала
+        """
+        record = ["start", path, transfer.kind, transfer.local_file]
+        return json.dumps(record, ensure_ascii=False) + "\n"
+
+    def _append(self, line: str, durable: bool = False) -> None:
+        """
+        Дописывает запись в конец журнала и при необходимости сжимает его
+
+        :param line: строка журнала
+        :param durable: дождаться ли записи на диск
+        :return: None
+        """
+        os.write(self._fd, line.encode())
+        if durable:
+            os.fsync(self._fd)
+        self._records += 1
+        if self._records >= max(self._compact_records, 4 * len(self._transfers)):
+            self._compact()
+
+    def interrupted(self) -> dict[str, Transfer]:
+        """
+        Передачи, прерванные при прошлом запуске и еще не завершенные
+
+        :return: словарь из путей файлов и передач
+        """
+        with self._lock:
+            return {
+                path: transfer
+                for path, transfer in self._interrupted.items()
+                if self._transfers.get(path) == transfer
+            }
+
+    def start(self, path: str, kind: str, local_file: LocalFile | None) -> None:
+        """
+        Записывает начало передачи и дожидается записи на диск
+
+        :param path: путь к файлу относительно отслеживаемой директории
+        :param kind: load, reload или download
+        :param local_file: информация о локальном файле на момент начала
+         или None, если скачивается файл, которого нет локально
+        :return: None
+        """
+        transfer = Transfer(kind, local_file)
+        with self._lock:
+            self._transfers[path] = transfer
+            self._append(self._start_record(path, transfer), durable=True)
+
+    def finish(self, path: str) -> None:
+        """
+        Записывает завершение передачи, успешное или нет
+
+        :param path: путь к файлу относительно отслеживаемой директории
+        :return: None
+        """
+        with self._lock:
+            if self._transfers.pop(path, None) is None:
+                return
+            self._append(json.dumps(["finish", path], ensure_ascii=False) + "\n")
+
+    def close(self) -> None:
+        """
+        Закрывает файл журнала
+
+        :return: None
+        """
+        with self._lock:
+            os.close(self._fd)
@@ -0,0 +1,131 @@
+from collections.abc import Iterable
+from threading import Lock
+from typing import NamedTuple
+
+from services.state import FileState
+from services.system import LocalFile
+
+
+class Match(NamedTuple):
+    """Синхронизированный файл с тем же содержимым, что у нового файла"""
+
+    source: str
+    move: bool
+
+
+class MoveMatcher:
+    """
+    Ищет для новых файлов синхронизированные файлы с тем же содержимым,
+    чтобы переместить или скопировать их на сервере вместо повторной загрузки.
+    Источником перемещения может быть только файл, удаленный в том же цикле,
+    причем только для одного нового файла. Источником копии - файл,
+    который не удален и не изменен.
+    Файлы с тем же inode, размером и временем изменения сопоставляются
+    в цикле синхронизации без чтения содержимого, остальные - по md5
+    в задачах пула, поэтому занятые источники защищены блокировкой
+    """
+
+    def __init__(
+        self,
+        candidates: dict[int, list[tuple[str, FileState]]],
+        removed: set[str],
+        modified: set[str],
+    ) -> None:
+        """
+        Инициализатор класса
+
+        :param candidates: синхронизированные файлы с размерами новых файлов
+        :param removed: удаленные файлы, которые могут стать источниками перемещений
+        :param modified: измененные файлы, которые не могут стать источниками копий
+        """
+        self._candidates = candidates
+        self._removed = removed
+        self._modified = modified
+        self._available = set(removed)
+        self._identities = {
+            (state.size, state.mtime_ns, state.inode): path
+            for entries in candidates.values()
+            for path, state in entries
+            if path in removed and state.inode
+        }
+        self._lock = Lock()
+
+    def has_candidates(self, local_file: LocalFile) -> bool:
+        """
+        Проверяет, есть ли в индексе файлы такого же размера
+
+        :param local_file: информация о новом файле
+        :return: bool
+        """
+        return local_file.size in self._candidates
+
+    def same_file(self, local_file: LocalFile) -> str | None:
+        """
+        Находит удаленный файл с тем же inode, размером и временем изменения
+        и занимает его как источник перемещения
+
+        :param local_file: информация о новом файле
+        :return: путь к источнику или None
+        """
+        source = self._identities.get(
+            (local_file.size, local_file.mtime_ns, local_file.inode)
+        )
+        with self._lock:
+            if source is None or source not in self._available:
+                return None
+            self._available.discard(source)
+        return source
+
+    def match(self, local_file: LocalFile, md5: str) -> Match | None:
+        """
+        Находит файл с тем же содержимым. Удаленный файл занимается
+        как источник перемещения, иначе подходит неизмененный файл для копирования
+
+        :param local_file: информация о новом файле
+        :param md5: md5 нового файла
+        :return: Match или None, если такого файла нет
+        """
+        matches = [
+            path
+            for path, state in self._candidates.get(local_file.size, ())
+            if state.revision == md5
+        ]
+        with self._lock:
+            source = next((path for path in matches if path in self._available), None)
+            if source is not None:
+                self._available.discard(source)
+                return Match(source, move=True)
+        source = next(
+            (
+                path
+                for path in matches
+                if path not in self._removed and path not in self._modified
+            ),
+            None,
+        )
+        return None if source is None else Match(source, move=False)
+
+    def sources(self, sizes: Iterable[int]) -> set[str]:
+        """
+        Удаленные файлы, которые еще могут стать источниками перемещений
+
+        :param sizes: размеры новых файлов, которые будут сопоставлены по md5
+        :return: множество путей
+        """
+        with self._lock:
+            return {
+                path
+                for size in set(sizes)
+                for path, _ in self._candidates.get(size, ())
+                if path in self._available
+            }
+
+    def unclaimed(self, paths: set[str]) -> set[str]:
+        """
+        Оставляет файлы, которые не стали источниками перемещений
+
+        :param paths: пути удаленных файлов
+        :return: множество путей
+        """
+        with self._lock:
+            return paths & self._available
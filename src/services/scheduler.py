@@ -0,0 +1,104 @@
+from time import monotonic, sleep
+
+from loguru import logger
+
+from services.app import FileSynchronization
+from services.watcher import wait_many
+
+
+class SyncScheduler:
+    """
+    Выполняет циклы синхронизации нескольких пар директорий в одном потоке.
+    Для каждой пары хранится время следующего полного цикла,
+    события всех наблюдателей inotify ожидаются одним вызовом poll.
+    Циклы только ставят задачи в общий пул потоков и не ждут загрузок,
+    поэтому долгая загрузка в одной паре не задерживает остальные.
+    Файлы, отложенные до окончания записи, проверяются повторно без полного цикла
+    """
+
+    def __init__(self, synchronizations: list[FileSynchronization]) -> None:
+        """
+        Инициализатор класса
+
+        :param synchronizations: синхронизации пар директорий
+        """
+        self._synchronizations = synchronizations
+        self._due = [0.0] * len(synchronizations)
+        self._failures = [0] * len(synchronizations)
+        self._watchers = {
+            synchronization.watcher: index
+            for index, synchronization in enumerate(synchronizations)
+            if synchronization.watcher is not None
+        }
+
+    def _run_due(self) -> None:
+        """
+        Выполняет полные циклы пар, для которых подошло время.
+        Неудачный цикл повторяется после паузы, которая растет с каждой неудачей
+
+        :return: None
+        """
+        for index, synchronization in enumerate(self._synchronizations):
+            if self._due[index] > monotonic():
+                continue
+            logger.debug("Полный цикл синхронизации {}", synchronization.name)
+            if synchronization.synchronize():
+                self._failures[index] = 0
+                self._due[index] = monotonic() + synchronization.interval
+            else:
+                delay = synchronization.recovery_delay(self._failures[index])
+                self._failures[index] += 1
+                self._due[index] = monotonic() + delay
+
+    def _wait(self, timeout: float) -> None:
+        """
+        Ждет событий наблюдателей до следующего полного цикла
+        и синхронизирует пути, о которых они сообщили.
+        Если у пары есть файлы, отложенные до окончания записи,
+        ожидание заканчивается к моменту их повторной проверки.
+        Если события потеряны, полный цикл пары выполняется сразу
+
+        :param timeout: время до следующего полного цикла (в секундах)
+        :return: None
+        """
+        for synchronization in self._synchronizations:
+            settle_timeout = synchronization.settle_timeout()
+            if settle_timeout is not None:
+                timeout = min(timeout, settle_timeout)
+        if self._watchers:
+            events = wait_many(self._watchers, timeout)
+        else:
+            sleep(timeout)
+            events = {}
+        changed: list[set[str] | None] = [set() for _ in self._synchronizations]
+        for watcher, paths in events.items():
+            changed[self._watchers[watcher]] = paths
+        for index, synchronization in enumerate(self._synchronizations):
+            paths = changed[index]
+            if paths is None:
+                self._due[index] = 0
+                continue
+            if paths:
+                logger.debug(
+                    "Получены события для {} путей в {}",
+                    len(paths),
+                    synchronization.name,
+                )
+            paths |= synchronization.settled_paths()
+            if paths:
+                synchronization.synchronize_paths(paths)
+
+    def run(self) -> None:
+        """
+        Запускает бесконечный цикл для всех пар директорий.
+        Загружает на диск новые файлы.
+        Удаляет из диска файлы, которых нет в локальной директории.
+        Перезаписывает локально измененные файлы.
+        В двустороннем режиме скачивает новые и измененные в облаке файлы.
+        :return: None
+        """
+        for synchronization in self._synchronizations:
+            synchronization.prepare()
+        while True:
+            self._run_due()
+            self._wait(max(min(self._due) - monotonic(), 0))
@@ -0,0 +1,136 @@
+from collections.abc import Collection, Iterable
+from time import monotonic, time_ns
+from typing import NamedTuple
+
+from services.system import LocalFile
+
+RECHECK_DELAY = 1.0
+
+
+class _Pending(NamedTuple):
+    """Файл, который, возможно, еще записывается"""
+
+    local_file: LocalFile
+    deadline: float
+
+
+class SettleTracker:
+    """
+    Откладывает загрузку файлов, которые, возможно, еще записываются.
+    Файл считается дописанным, если его размер и время изменения не менялись
+    settle_time секунд или если inotify сообщил, что файл закрыт после записи
+    или перемещен в директорию. Время изменения может быть сохранено из архива
+    или при копировании, поэтому даже давно не менявшийся файл отпускается
+    только после повторного stat с теми же размером и временем изменения.
+    Для отложенных файлов в памяти хранятся увиденные размер и время изменения
+    и момент, когда их можно проверить снова, поэтому повторная проверка
+    обходится stat только этих файлов без сканирования всей директории
+    """
+
+    def __init__(self, settle_time: float) -> None:
+        """
+        Инициализатор класса
+
+        :param settle_time: сколько секунд файл не должен меняться,
+         чтобы считаться дописанным. 0 - файлы не откладываются
+        """
+        self._settle_time = settle_time
+        self._pending: dict[str, _Pending] = {}
+
+    def _deadline(self, local_file: LocalFile, now: float) -> float:
+        """
+        Момент, после которого файл считается дописанным, если не изменится.
+        Время с последнего изменения файла засчитывается,
+        но повторная проверка выполняется не раньше чем через RECHECK_DELAY секунд
+
+        :param local_file: информация о файле
+        :param now: текущее время по monotonic
+        :return: время по monotonic
+        """
+        age = (time_ns() - local_file.mtime_ns) / 1e9
+        recheck = min(RECHECK_DELAY, self._settle_time)
+        return now + min(max(self._settle_time - age, recheck), self._settle_time)
+
+    def unsettled(
+        self,
+        paths: Iterable[str],
+        local_files: dict[str, LocalFile],
+        closed: Collection[str] = (),
+    ) -> set[str]:
+        """
+        Находит среди файлов те, которые еще могут записываться, и запоминает их
+
+        :param paths: пути новых и измененных файлов
+        :param local_files: информация о локальных файлах
+        :param closed: файлы, которые закрыты после записи с момента прошлой проверки
+        :return: множество путей файлов, загрузку которых нужно отложить
+        """
+        if self._settle_time <= 0:
+            return set()
+        now = monotonic()
+        unsettled = set()
+        for path in paths:
+            local_file = local_files[path]
+            pending = self._pending.get(path)
+            if path in closed:
+                deadline = now
+            elif pending is not None and pending.local_file == local_file:
+                deadline = pending.deadline
+            else:
+                deadline = self._deadline(local_file, now)
+            if deadline <= now:
+                self._pending.pop(path, None)
+            else:
+                self._pending[path] = _Pending(local_file, deadline)
+                unsettled.add(path)
+        return unsettled
+
+    def pending(self) -> set[str]:
+        """
+        Отложенные файлы
+
+        :return: множество путей
+        """
+        return set(self._pending)
+
+    def due(self) -> set[str]:
+        """
+        Отложенные файлы, которые пора проверить снова
+
+        :return: множество путей
+        """
+        now = monotonic()
+        return {
+            path for path, pending in self._pending.items() if pending.deadline <= now
+        }
+
+    def timeout(self) -> float | None:
+        """
+        Через сколько секунд пора проверить снова хотя бы один отложенный файл
+
+        :return: секунды или None, если отложенных файлов нет
+        """
+        if not self._pending:
+            return None
+        deadline = min(pending.deadline for pending in self._pending.values())
+        return max(deadline - monotonic(), 0)
+
+    def discard(self, paths: Iterable[str]) -> None:
+        """
+        Забывает файлы, которых больше нет
+
+        :param paths: пути файлов
+        :return: None
+        """
+        for path in paths:
+            self._pending.pop(path, None)
+
+    def retain(self, paths: Collection[str]) -> None:
+        """
+        Забывает отложенные файлы, которых нет среди существующих
+
+        :param paths: пути всех существующих файлов
+        :return: None
+        """
+        for path in self._pending.keys() - paths:
+            del self._pending[path]
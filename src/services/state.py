@@ -0,0 +1,300 @@
+import sqlite3
+from threading import Lock
+from typing import NamedTuple
+
+from loguru import logger
+
+from services.system import LocalFile
+
+SCHEMA_VERSION = 3
+
+
+class FileState(NamedTuple):
+    """Состояние файла на момент последней успешной синхронизации"""
+
+    size: int
+    mtime_ns: int
+    inode: int
+    revision: str | None
+
+
+class SyncState:
+    """
+    Постоянный индекс синхронизированных файлов и директорий.
+    Хранится в SQLite, при запуске полностью загружается в память,
+    поэтому сравнение с локальной директорией не требует обращений к диску
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Инициализатор класса
+
+        :param path: путь к файлу базы данных
+        """
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        self._files: dict[str, FileState] = {
+            path: FileState(size, mtime_ns, inode, revision)
+            for path, size, mtime_ns, inode, revision in self._connection.execute(
+                "SELECT path, size, mtime_ns, inode, revision FROM files"
+            )
+        }
+        self._directories: set[str] = {
+            path for (path,) in self._connection.execute("SELECT path FROM directories")
+        }
+
+    def _migrate(self) -> None:
+        """
+        Создает таблицы или пересоздает их, если индекс сохранен в старом формате.
+        Пустой индекс приводит к полной сверке с облаком при запуске
+
+        :return: None
+        """
+        (version,) = self._connection.execute("PRAGMA user_version").fetchone()
+        if version == SCHEMA_VERSION:
+            return
+        if version:
+            logger.warning(
+                "Индекс синхронизированных файлов устарел и будет перестроен"
+            )
+        self._connection.executescript(f"""
+            DROP TABLE IF EXISTS files;
+            DROP TABLE IF EXISTS directories;
+            CREATE TABLE files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                revision TEXT
+            );
+            CREATE TABLE directories (path TEXT PRIMARY KEY);
+            PRAGMA user_version = {SCHEMA_VERSION};
+            """)
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._files
+
+    def get(self, path: str) -> FileState | None:
+        """
+        Возвращает сохраненное состояние файла
+
+        :param path: путь к файлу относительно отслеживаемой директории
+        :return: FileState или None, если файл еще не синхронизировался
+        """
+        return self._files.get(path)
+
+    def paths(self) -> set[str]:
+        """
+        Возвращает пути всех синхронизированных файлов
+
+        :return: множество путей
+        """
+        with self._lock:
+            return set(self._files)
+
+    def with_sizes(self, sizes: set[int]) -> dict[int, list[tuple[str, FileState]]]:
+        """
+        Возвращает синхронизированные файлы с известным md5 и одним из переданных размеров
+
+        :param sizes: размеры файлов в байтах
+        :return: словарь из размера и списка путей с состояниями
+        """
+        result = {}
+        with self._lock:
+            for path, state in self._files.items():
+                if state.size in sizes and state.revision is not None:
+                    result.setdefault(state.size, []).append((path, state))
+        return result
+
+    def directories(self) -> set[str]:
+        """
+        Возвращает пути всех директорий, созданных в облаке
+
+        :return: множество путей
+        """
+        with self._lock:
+            return set(self._directories)
+
+    def has_directory(self, path: str) -> bool:
+        """
+        Проверяет, есть ли директория в индексе
+
+        :param path: путь к директории относительно отслеживаемой директории
+        :return: bool
+        """
+        return path in self._directories
+
+    def diff(
+        self, local_files: dict[str, LocalFile], paths: set[str] | None = None
+    ) -> tuple[set[str], set[str], set[str]]:
+        """
+        Сравнивает локальные файлы с индексом
+
+        :param local_files: словарь из путей локальных файлов и их размеров и времени изменения
+        :param paths: если передано, сравниваются только эти пути,
+         а local_files содержит информацию только о них
+        :return: кортеж из множеств новых, измененных и удаленных файлов
+        """
+        new_files = set()
+        modified_files = set()
+        with self._lock:
+            for path, local_file in local_files.items():
+                state = self._files.get(path)
+                if state is None:
+                    new_files.add(path)
+                elif (state.size, state.mtime_ns, state.inode) != local_file:
+                    modified_files.add(path)
+            if paths is None:
+                deleted_files = self._files.keys() - local_files.keys()
+            else:
+                deleted_files = {
+                    path
+                    for path in paths
+                    if path in self._files and path not in local_files
+                }
+        return new_files, modified_files, deleted_files
+
+    def update(
+        self, path: str, local_file: LocalFile, revision: str | None = None
+    ) -> None:
+        """
+        Запоминает состояние успешно синхронизированного файла
+
+        :param path: путь к файлу относительно отслеживаемой директории
+        :param local_file: размер, время изменения и inode файла на момент синхронизации
+        :param revision: md5 содержимого файла в облаке, если известен
+        :return: None
+        """
+        with self._lock:
+            self._files[path] = FileState(*local_file, revision)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, revision) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (path, *local_file, revision),
+            )
+            self._connection.commit()
+
+    def remove(self, path: str) -> None:
+        """
+        Удаляет файл из индекса
+
+        :param path: путь к файлу относительно отслеживаемой директории
+        :return: None
+        """
+        with self._lock:
+            self._files.pop(path, None)
+            self._connection.execute("DELETE FROM files WHERE path = ?", (path,))
+            self._connection.commit()
+
+    def add_directory(self, path: str) -> None:
+        """
+        Запоминает директорию, которая есть в облаке
+
+        :param path: путь к директории относительно отслеживаемой директории
+        :return: None
+        """
+        with self._lock:
+            self._directories.add(path)
+            self._connection.execute(
+                "INSERT OR IGNORE INTO directories (path) VALUES (?)", (path,)
+            )
+            self._connection.commit()
+
+    def remove_directory(self, path: str) -> None:
+        """
+        Удаляет из индекса директорию вместе со всем ее содержимым
+
+        :param path: путь к директории относительно отслеживаемой директории
+        :return: None
+        """
+        prefix = path + "/"
+        # "0" следует за "/" в таблице символов, поэтому диапазон [prefix, upper)
+        # содержит ровно все пути, начинающиеся с prefix
+        upper = path + "0"
+        with self._lock:
+            for nested in [item for item in self._files if item.startswith(prefix)]:
+                del self._files[nested]
+            self._directories = {
+                item
+                for item in self._directories
+                if item != path and not item.startswith(prefix)
+            }
+            self._connection.execute(
+                "DELETE FROM files WHERE path >= ? AND path < ?", (prefix, upper)
+            )
+            self._connection.execute(
+                "DELETE FROM directories WHERE path = ? OR (path >= ? AND path < ?)",
+                (path, prefix, upper),
+            )
+            self._connection.commit()
+
+    def move_directory(
+        self, source: str, target: str, local_files: dict[str, LocalFile]
+    ) -> None:
+        """
+        Переносит в индексе директорию вместе со всем ее содержимым.
+        md5 файлов сохраняются, размер, время изменения и inode берутся
+        из локальных файлов, если они есть
+
+        :param source: старый путь к директории
+        :param target: новый путь к директории
+        :param local_files: информация о локальных файлах на момент сканирования
+        :return: None
+        """
+        prefix = source + "/"
+        upper = source + "0"
+        with self._lock:
+            moved = {
+                target + path.removeprefix(source): state
+                for path, state in self._files.items()
+                if path.startswith(prefix)
+            }
+            for path in moved:
+                del self._files[source + path.removeprefix(target)]
+            for path, state in moved.items():
+                local_file = local_files.get(path)
+                if local_file is not None:
+                    state = FileState(*local_file, state.revision)
+                self._files[path] = state
+            directories = {
+                target + path.removeprefix(source)
+                for path in self._directories
+                if path == source or path.startswith(prefix)
+            }
+            self._directories = {
+                path
+                for path in self._directories
+                if path != source and not path.startswith(prefix)
+            } | directories
+            self._connection.execute(
+                "DELETE FROM files WHERE path >= ? AND path < ?", (prefix, upper)
+            )
+            self._connection.execute(
+                "DELETE FROM directories WHERE path = ? OR (path >= ? AND path < ?)",
+                (source, prefix, upper),
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, revision) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(path, *self._files[path]) for path in moved],
+            )
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO directories (path) VALUES (?)",
+                [(path,) for path in directories],
+            )
+            self._connection.commit()
+
+    def close(self) -> None:
+        """
+        Закрывает соединение с базой данных
+
+        :return: None
+        """
+        with self._lock:
+            self._connection.close()
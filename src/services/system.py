@@ -1,38 +1,220 @@
 import os
-from datetime import datetime
+import posixpath
+from collections.abc import Iterable, Iterator
+from contextlib import suppress
+from stat import S_ISDIR, S_ISREG
+from typing import NamedTuple
+
+from loguru import logger
+
+from api import DOWNLOAD_SUFFIX
+from services.ignore import IgnorePatterns
+
+
+class LocalFile(NamedTuple):
+    """Размер, время последней модификации и номер inode локального файла"""
+
+    size: int
+    mtime_ns: int
+    inode: int
+
+
+def parent_directories(path: str) -> Iterator[str]:
+    """
+    Перечисляет все родительские директории пути, начиная с ближайшей
+
+    :param path: путь относительно отслеживаемой директории с разделителем /
+    :return: генератор путей родительских директорий
+    """
+    path = posixpath.dirname(path)
+    while path:
+        yield path
+        path = posixpath.dirname(path)
+
+
+def topmost(paths: Iterable[str], directories: set[str]) -> set[str]:
+    """
+    Оставляет только пути, ни одна из родительских директорий которых не входит в directories
+
+    :param paths: пути относительно отслеживаемой директории
+    :param directories: директории, которые покрывают свое содержимое
+    :return: множество путей
+    """
+    return {
+        path
+        for path in paths
+        if not any(parent in directories for parent in parent_directories(path))
+    }
 
 
 class LocaleTracking:
     """Предоставляет методы для работы с локальной файловой системой"""
 
-    def __init__(self, local_folder: str) -> None:
+    def __init__(
+        self, local_folder: str, ignore: IgnorePatterns | None = None
+    ) -> None:
         """
         Инициализатор класса
 
         :param local_folder: локальная директория для отслеживания
+        :param ignore: шаблоны путей, которые не синхронизируются
         """
         self._local_folder = local_folder
+        self._ignore = ignore or IgnorePatterns(())
+
+    @property
+    def ignore(self) -> IgnorePatterns:
+        """
+        Шаблоны путей, которые не синхронизируются
+
+        :return: IgnorePatterns
+        """
+        return self._ignore
+
+    def get_files_in_local_folder(self) -> tuple[dict[str, LocalFile], set[str]]:
+        """
+        Рекурсивно собирает файлы и директории в локальной директории.
+        Обходит дерево через os.scandir без рекурсии и использует результаты stat,
+        которые DirEntry получает вместе с содержимым директории.
+        Символьные ссылки на директории не обходятся.
+        Временные файлы незавершенных скачиваний и пути, подходящие под шаблоны ignore,
+        пропускаются, в исключенные директории обход не заходит
+
+        :return: кортеж из словаря с путями файлов и информацией о них и множества путей директорий.
+         Пути указываются относительно отслеживаемой директории с разделителем /
+        """
+        files = {}
+        directories = set()
+        stack = [""]
+        while stack:
+            prefix = stack.pop()
+            try:
+                entries = os.scandir(os.path.join(self._local_folder, prefix))
+            except FileNotFoundError:
+                directories.discard(prefix.rstrip("/"))
+                continue
+            with entries:
+                for entry in entries:
+                    path = prefix + entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        if self._ignore.match(path, True):
+                            continue
+                        directories.add(path)
+                        stack.append(path + "/")
+                    elif (
+                        entry.is_file()
+                        and not entry.name.endswith(DOWNLOAD_SUFFIX)
+                        and not self._ignore.match(path)
+                    ):
+                        stat = entry.stat()
+                        files[path] = LocalFile(
+                            stat.st_size, stat.st_mtime_ns, stat.st_ino
+                        )
+        return files, directories
+
+    def get_files(self, paths: set[str]) -> tuple[dict[str, LocalFile], set[str]]:
+        """
+        Собирает информацию только о переданных путях.
+        Отсутствующие пути, временные файлы скачиваний
+        и пути, подходящие под шаблоны ignore, не попадают в результат
+
+        :param paths: пути относительно отслеживаемой директории
+        :return: кортеж из словаря с путями существующих файлов и информацией о них
+         и множества путей существующих директорий
+        """
+        files = {}
+        directories = set()
+        for path in paths:
+            if path.endswith(DOWNLOAD_SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self._local_folder, path))
+            except OSError:
+                continue
+            is_dir = S_ISDIR(stat.st_mode)
+            if self._ignore.ignored(path, is_dir):
+                continue
+            if S_ISREG(stat.st_mode):
+                files[path] = LocalFile(stat.st_size, stat.st_mtime_ns, stat.st_ino)
+            elif is_dir:
+                directories.add(path)
+        return files, directories
+
+    def create_directory(self, path: str) -> bool:
+        """
+        Создает локальную директорию вместе с родительскими
+
+        :param path: путь относительно отслеживаемой директории
+        :return: True, если директория создана или уже существовала
+        """
+        try:
+            os.makedirs(os.path.join(self._local_folder, path), exist_ok=True)
+        except OSError:
+            logger.exception("Не удалось создать локальную директорию {}", path)
+            return False
+        logger.info("Локальная директория {} создана", path)
+        return True
+
+    def remove_file(self, path: str, local_file: LocalFile) -> bool:
+        """
+        Удаляет локальный файл, если он не изменился с момента сканирования
+
+        :param path: путь относительно отслеживаемой директории
+        :param local_file: информация о файле, полученная при сканировании
+        :return: True, если файла больше нет
+        """
+        file_path = os.path.join(self._local_folder, path)
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return True
+        if (stat.st_size, stat.st_mtime_ns, stat.st_ino) != local_file:
+            logger.info("Файл {} изменился и не будет удален локально", path)
+            return False
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            return True
+        except OSError:
+            logger.exception("Не удалось удалить локальный файл {}", path)
+            return False
+        logger.info("Локальный файл {} удален", path)
+        return True
 
-    def get_files_in_local_folder(self) -> set[str]:
+    def remove_directory(self, path: str) -> bool:
         """
-        Собирает названия файлов в локальной директории
+        Удаляет локальную директорию вместе с пустыми вложенными директориями.
+        Файлы не удаляются: если они есть, директория остается
 
-        :return: множество из названий файлов
+        :param path: путь относительно отслеживаемой директории
+        :return: True, если директории больше нет
         """
-        return set(os.listdir(self._local_folder))
+        root = os.path.join(self._local_folder, path)
+        for directory, _, _ in os.walk(root, topdown=False):
+            try:
+                os.rmdir(directory)
+            except FileNotFoundError:
+                continue
+            except OSError:
+                logger.info("Локальная директория {} не пуста и не удалена", path)
+                return False
+        logger.info("Локальная директория {} удалена", path)
+        return True
 
-    def get_files_and_latest_modification(
-        self, locale_files: set[str]
-    ) -> dict[str, datetime]:
+    def remove_partial_downloads(self, path: str) -> None:
         """
-        Собирает информацию о датах последних модификаций файлов
+        Удаляет временные файлы скачиваний файла, прерванных аварийным завершением
 
-        :param locale_files: названия локальных файлов
-        :return: словарь из названий файлов и дат их последних модификаций
+        :param path: путь к файлу относительно отслеживаемой директории
+        :return: None
         """
-        return {
-            filename: datetime.utcfromtimestamp(
-                os.path.getmtime(os.path.join(self._local_folder, filename))
-            )
-            for filename in locale_files
-        }
+        directory, name = os.path.split(os.path.join(self._local_folder, path))
+        try:
+            entries = os.listdir(directory)
+        except OSError:
+            return
+        for entry in entries:
+            if entry.startswith(f".{name}.") and entry.endswith(DOWNLOAD_SUFFIX):
+                with suppress(FileNotFoundError):
+                    os.remove(os.path.join(directory, entry))
+                logger.info("Удален временный файл прерванного скачивания {}", entry)
@@ -0,0 +1,362 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from collections.abc import Iterable
+from time import monotonic
+
+from loguru import logger
+
+from services.ignore import IgnorePatterns
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+ROOT_LOST_MASK = IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED
+
+EVENT_HEADER = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+
+class InotifyWatcher:
+    """
+    Отслеживает изменения в дереве локальной директории через inotify (только Linux).
+    На каждую поддиректорию ставится отдельное наблюдение, новые поддиректории
+    подключаются по мере появления. На директории, подходящие под шаблоны ignore,
+    наблюдения не ставятся.
+    Пачки событий, пришедших подряд, объединяются в одно множество измененных путей.
+    События нескольких наблюдателей можно ждать в одном потоке через wait_many
+    """
+
+    def __init__(
+        self,
+        local_folder: str,
+        debounce: float,
+        ignore: IgnorePatterns | None = None,
+    ) -> None:
+        """
+        Инициализатор класса. Бросает OSError, если inotify недоступен
+
+        :param local_folder: локальная директория для отслеживания
+        :param debounce: время тишины (в секундах), после которого пачка событий считается завершенной
+        :param ignore: шаблоны путей, которые не синхронизируются
+        """
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("Не найдена библиотека libc")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify не поддерживается в этой системе")
+        self._libc = libc
+        self._local_folder = local_folder
+        self._debounce = debounce
+        self._ignore = ignore or IgnorePatterns(())
+        self._watches: dict[int, str] = {}
+        self._closed: set[str] = set()
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        try:
+            self._root = self._add_watch("")
+            if not self._add_tree("", changed=None):
+                raise OSError("Не удалось поставить наблюдения на все поддиректории")
+        except OSError:
+            os.close(self._fd)
+            raise
+
+    @property
+    def debounce(self) -> float:
+        """
+        Время тишины (в секундах), после которого пачка событий считается завершенной
+
+        :return: float
+        """
+        return self._debounce
+
+    def fileno(self) -> int:
+        """
+        Дескриптор inotify, который становится доступным для чтения при появлении событий
+
+        :return: int
+        """
+        return self._fd
+
+    def _add_watch(self, path: str) -> int:
+        """
+        Ставит наблюдение на одну директорию
+
+        :param path: путь к директории относительно отслеживаемой директории
+        :return: дескриптор наблюдения
+        """
+        full_path = os.path.join(self._local_folder, path)
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(full_path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), full_path)
+        self._watches[wd] = path
+        return wd
+
+    def _add_tree(self, path: str, changed: set[str] | None) -> bool:
+        """
+        Ставит наблюдения на все поддиректории path, кроме исключенных шаблонами ignore.
+        Файлы, появившиеся до установки наблюдения, добавляются в changed.
+        Директории, которые не удалось прочитать или поставить на наблюдение
+        (например, при исчерпании max_user_watches), пропускаются
+
+        :param path: путь к директории относительно отслеживаемой директории
+        :param changed: множество измененных путей или None при запуске
+        :return: False, если часть поддиректорий осталась без наблюдения
+        """
+        complete = True
+        stack = [path]
+        while stack:
+            directory = stack.pop()
+            prefix = f"{directory}/" if directory else ""
+            try:
+                with os.scandir(os.path.join(self._local_folder, directory)) as entries:
+                    for entry in entries:
+                        nested = prefix + entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            if self._ignore.match(nested, True):
+                                continue
+                            try:
+                                self._add_watch(nested)
+                            except FileNotFoundError:
+                                continue
+                            except OSError as error:
+                                self._unwatched(nested, error)
+                                complete = False
+                            else:
+                                stack.append(nested)
+                        if changed is not None:
+                            changed.add(nested)
+            except FileNotFoundError:
+                continue
+            except OSError as error:
+                self._unwatched(directory, error)
+                complete = False
+        return complete
+
+    @staticmethod
+    def _unwatched(path: str, error: OSError) -> None:
+        """
+        Сообщает, что изменения в директории не отслеживаются
+
+        :param path: путь к директории относительно отслеживаемой директории
+        :param error: ошибка inotify или чтения директории
+        :return: None
+        """
+        logger.error(
+            "Не удалось отслеживать {}: {}. Изменения найдет полное сканирование",
+            path,
+            error,
+        )
+
+    def _remove_tree(self, path: str) -> None:
+        """
+        Снимает наблюдения с директории, перемещенной или удаленной из дерева
+
+        :param path: путь к директории относительно отслеживаемой директории
+        :return: None
+        """
+        prefix = path + "/"
+        for wd, directory in list(self._watches.items()):
+            if directory == path or directory.startswith(prefix):
+                del self._watches[wd]
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def read_events(self, changed: set[str]) -> bool:
+        """
+        Читает все доступные события и добавляет пути файлов и директорий в changed.
+        Запоминает файлы, которые закрыты после записи или перемещены в директорию
+        и с тех пор не изменялись
+
+        :param changed: множество, в которое собираются измененные пути
+        :return: True, если требуется полное сканирование директории:
+         очередь событий переполнена или новую директорию не удалось поставить на наблюдение
+        """
+        try:
+            data = os.read(self._fd, READ_SIZE)
+        except BlockingIOError:
+            return False
+        rescan = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                rescan = True
+                continue
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            if mask & ROOT_LOST_MASK:
+                if wd == self._root:
+                    rescan = True
+                elif mask & IN_IGNORED:
+                    del self._watches[wd]
+                continue
+            if not name:
+                continue
+            path = (
+                f"{directory}/{os.fsdecode(name)}" if directory else os.fsdecode(name)
+            )
+            changed.add(path)
+            if not mask & IN_ISDIR:
+                if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    self._closed.add(path)
+                elif mask & (IN_MODIFY | IN_CREATE):
+                    self._closed.discard(path)
+                continue
+            if mask & IN_MOVED_FROM:
+                self._remove_tree(path)
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                if self._ignore.match(path, True):
+                    continue
+                try:
+                    self._add_watch(path)
+                except FileNotFoundError:
+                    continue
+                except OSError as error:
+                    self._unwatched(path, error)
+                    rescan = True
+                    continue
+                if not self._add_tree(path, changed):
+                    rescan = True
+        return rescan
+
+    def pop_closed(self) -> set[str]:
+        """
+        Забирает файлы, которые закрыты после записи с момента прошлого вызова
+
+        :return: множество путей относительно отслеживаемой директории
+        """
+        closed, self._closed = self._closed, set()
+        return closed
+
+    def wait(self, timeout: float) -> set[str] | None:
+        """
+        Ждет изменений в директории не дольше timeout секунд.
+        После первого события продолжает собирать события, пока они не перестанут
+        приходить в течение debounce секунд, но не дольше 10 * debounce
+
+        :param timeout: максимальное время ожидания первого события (в секундах)
+        :return: множество измененных путей (пустое, если изменений не было)
+         или None, если события потеряны и нужно полное сканирование
+        """
+        return wait_many([self], timeout)[self]
+
+    async def async_wait(self, timeout: float) -> set[str] | None:
+        """
+        То же, что wait, но ожидает события в цикле событий, не занимая поток
+
+        :param timeout: максимальное время ожидания первого события (в секундах)
+        :return: множество измененных путей (пустое, если изменений не было)
+         или None, если события потеряны и нужно полное сканирование
+        """
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        loop.add_reader(self._fd, ready.set)
+        changed: set[str] = set()
+        try:
+            try:
+                await asyncio.wait_for(ready.wait(), max(timeout, 0))
+            except TimeoutError:
+                return changed
+            rescan = False
+            deadline = monotonic() + self._debounce * 10
+            while True:
+                ready.clear()
+                rescan |= self.read_events(changed)
+                if (remaining := deadline - monotonic()) <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(
+                        ready.wait(), min(self._debounce, remaining)
+                    )
+                except TimeoutError:
+                    break
+        finally:
+            loop.remove_reader(self._fd)
+        if rescan:
+            logger.warning("События inotify получены не полностью, требуется сканирование")
+            return None
+        return changed
+
+    def close(self) -> None:
+        """
+        Закрывает дескриптор inotify
+
+        :return: None
+        """
+        os.close(self._fd)
+
+
+def wait_many(
+    watchers: Iterable[InotifyWatcher], timeout: float
+) -> dict[InotifyWatcher, set[str] | None]:
+    """
+    Ждет изменений в директориях нескольких наблюдателей в одном потоке
+    не дольше timeout секунд. После первого события продолжает собирать события
+    всех наблюдателей, пока они не перестанут приходить в течение наибольшего debounce,
+    но не дольше 10 * debounce
+
+    :param watchers: наблюдатели
+    :param timeout: максимальное время ожидания первого события (в секундах)
+    :return: для каждого наблюдателя множество измененных путей (пустое, если изменений не было)
+     или None, если события потеряны и нужно полное сканирование
+    """
+    changed: dict[InotifyWatcher, set[str] | None] = {}
+    by_fd: dict[int, InotifyWatcher] = {}
+    poll = select.poll()
+    for watcher in watchers:
+        changed[watcher] = set()
+        by_fd[watcher.fileno()] = watcher
+        poll.register(watcher.fileno(), select.POLLIN)
+    ready = poll.poll(max(timeout, 0) * 1000)
+    if not ready:
+        return changed
+    debounce = max(watcher.debounce for watcher in changed)
+    rescan = set()
+    deadline = monotonic() + debounce * 10
+    while ready:
+        for fd, _ in ready:
+            watcher = by_fd[fd]
+            if watcher.read_events(changed[watcher]):
+                rescan.add(watcher)
+        if (remaining := deadline - monotonic()) <= 0:
+            break
+        ready = poll.poll(min(debounce, remaining) * 1000)
+    if rescan:
+        logger.warning("События inotify получены не полностью, требуется сканирование")
+    for watcher in rescan:
+        changed[watcher] = None
+    return changed
@@ -0,0 +1,334 @@
+import asyncio
+from collections import Counter, OrderedDict, defaultdict, deque
+from collections.abc import Callable
+from concurrent.futures import Future
+from itertools import count
+from queue import Full, PriorityQueue
+from threading import Condition, Thread
+
+from loguru import logger
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+SHUTDOWN = (float("inf"),)
+
+
+class TransferPool:
+    """
+    Долгоживущий пул потоков для запросов к api с очередями задач по приоритету.
+    Маленькие файлы и удаления обрабатываются в основной полосе,
+    большие файлы - в отдельной, чтобы не задерживать остальные задачи.
+    Очереди ограничены: если они заполнены, добавление задачи ждет освобождения места.
+    Задачи, которые ставятся из потоков пула и обратных вызовов, не ждут:
+    при заполненной очереди они откладываются в список переполнения,
+    который потоки полосы переносят в очередь по мере ее освобождения,
+    иначе потоки, ждущие места в своей же очереди, никогда бы его не дождались.
+    Пул может быть общим для нескольких синхронизируемых директорий.
+    Задачи каждой директории (owner) распределяются по раундам:
+    за раунд директория получает не больше задач, чем потоков в полосе,
+    поэтому директория с тысячами файлов не задерживает остальные
+    """
+
+    def __init__(
+        self, workers: int, large_workers: int, large_file_size: int, queue_size: int
+    ) -> None:
+        """
+        Инициализатор класса
+
+        :param workers: количество потоков для маленьких файлов и удалений
+        :param large_workers: количество потоков для больших файлов,
+         0 - большие файлы обрабатываются в основной полосе
+        :param large_file_size: размер файла (в байтах), начиная с которого он считается большим
+        :param queue_size: максимальное количество ожидающих задач в каждой полосе
+        """
+        self._large_file_size = large_file_size
+        self._large_workers = large_workers
+        self._small = PriorityQueue(maxsize=queue_size)
+        self._large = PriorityQueue(maxsize=queue_size)
+        self._lanes = ((self._small, workers), (self._large, large_workers))
+        self._overflow: tuple[deque, deque] = (deque(), deque())
+        self._counter = count()
+        self._in_flight: set[tuple[str, str]] = set()
+        self._owners: Counter[str] = Counter()
+        self._rounds: dict[tuple[int, str], float] = defaultdict(float)
+        self._current_round = [0, 0]
+        self._idle = Condition()
+        self._threads = [
+            Thread(target=self._work, args=(index,), daemon=True)
+            for index, (_, amount) in enumerate(self._lanes)
+            for _ in range(amount)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def size(self) -> int:
+        """
+        Общее количество потоков
+
+        :return: int
+        """
+        return len(self._threads)
+
+    def submit(
+        self,
+        path: str,
+        func: Callable,
+        *args,
+        priority: int = PRIORITY_NORMAL,
+        size: int = 0,
+        owner: str = "",
+        block: bool = True,
+    ) -> Future | None:
+        """
+        Ставит задачу в очередь.
+        Задачи с меньшим приоритетом выполняются раньше, затем задачи более ранних раундов,
+        внутри раунда - задачи меньшего размера.
+        Если для path уже есть незавершенная задача, новая не добавляется
+
+        :param path: путь, к которому относится задача
+        :param func: функция, которая будет вызвана в потоке пула
+        :param args: аргументы функции
+        :param priority: приоритет задачи
+        :param size: размер файла в байтах, определяет полосу и порядок в ней
+        :param owner: синхронизируемая директория, к которой относится path
+        :param block: ждать ли места в заполненной очереди. False - для задач,
+         которые ставятся из потоков пула и обратных вызовов
+        :return: Future с результатом функции или None, если задача уже выполняется
+        """
+        if self._large_workers and size >= self._large_file_size:
+            index = 1
+        else:
+            index = 0
+        lane, workers = self._lanes[index]
+        with self._idle:
+            if (owner, path) in self._in_flight:
+                return None
+            self._in_flight.add((owner, path))
+            self._owners[owner] += 1
+            start = max(self._rounds[index, owner], self._current_round[index])
+            self._rounds[index, owner] = start + 1 / workers
+        future = Future()
+        job = (
+            priority,
+            int(start),
+            size,
+            next(self._counter),
+            owner,
+            path,
+            func,
+            args,
+            future,
+        )
+        if block:
+            lane.put(job)
+        else:
+            self._put_nowait(index, job)
+        return future
+
+    def _put_nowait(self, index: int, job: tuple) -> None:
+        """
+        Ставит задачу в очередь без ожидания. Если очередь заполнена
+        или в списке переполнения уже есть задачи, задача добавляется в его конец.
+        Список переполнения не пуст только при непустой очереди,
+        поэтому его задачи не остаются без потока
+
+        :param index: номер полосы
+        :param job: задача
+        :return: None
+        """
+        lane, _ = self._lanes[index]
+        with self._idle:
+            overflow = self._overflow[index]
+            if not overflow:
+                try:
+                    lane.put_nowait(job)
+                    return
+                except Full:
+                    pass
+            overflow.append(job)
+
+    def _drain(self, index: int) -> None:
+        """
+        Переносит отложенные задачи в освободившиеся места очереди
+
+        :param index: номер полосы
+        :return: None
+        """
+        lane, _ = self._lanes[index]
+        with self._idle:
+            overflow = self._overflow[index]
+            while overflow:
+                try:
+                    lane.put_nowait(overflow[0])
+                except Full:
+                    return
+                overflow.popleft()
+
+    def is_busy(self, path: str, owner: str = "") -> bool:
+        """
+        Проверяет, есть ли незавершенная задача для пути
+
+        :param path: путь
+        :param owner: синхронизируемая директория, к которой относится path
+        :return: bool
+        """
+        with self._idle:
+            return (owner, path) in self._in_flight
+
+    def pending(self, owner: str | None = None) -> int:
+        """
+        Количество незавершенных задач, включая выполняющиеся
+
+        :param owner: считать только задачи этой директории, None - задачи всех директорий
+        :return: int
+        """
+        with self._idle:
+            if owner is None:
+                return len(self._in_flight)
+            return self._owners[owner]
+
+    def _work(self, index: int) -> None:
+        """
+        Выполняет задачи из очереди, пока не получит сигнал остановки
+
+        :param index: номер полосы
+        :return: None
+        """
+        lane, _ = self._lanes[index]
+        while True:
+            job = lane.get()
+            if job == SHUTDOWN:
+                return
+            self._drain(index)
+            _, current_round, _, _, owner, path, func, args, future = job
+            with self._idle:
+                self._current_round[index] = max(
+                    self._current_round[index], current_round
+                )
+            try:
+                result = func(path, *args)
+            except Exception as exc:
+                logger.exception("Ошибка при обработке {}", path)
+                self._finish(owner, path)
+                future.set_exception(exc)
+            else:
+                self._finish(owner, path)
+                future.set_result(result)
+
+    def _finish(self, owner: str, path: str) -> None:
+        """
+        Отмечает задачу для пути завершенной
+
+        :param owner: синхронизируемая директория, к которой относится path
+        :param path: путь
+        :return: None
+        """
+        with self._idle:
+            self._in_flight.discard((owner, path))
+            self._owners[owner] -= 1
+            if not self._owners[owner]:
+                del self._owners[owner]
+                self._idle.notify_all()
+
+    def wait(self, owner: str | None = None) -> None:
+        """
+        Ждет завершения всех задач
+
+        :param owner: ждать только задач этой директории, None - задач всех директорий
+        :return: None
+        """
+        with self._idle:
+            while self._owners if owner is None else owner in self._owners:
+                self._idle.wait()
+
+    def shutdown(self) -> None:
+        """
+        Дожидается выполнения задач и останавливает потоки
+
+        :return: None
+        """
+        self.wait()
+        for lane, amount in self._lanes:
+            for _ in range(amount):
+                lane.put(SHUTDOWN)
+        for thread in self._threads:
+            thread.join()
+
+
+class AsyncTransferPool:
+    """
+    Ограничения для задач цикла событий, общие для нескольких синхронизируемых директорий:
+    количество одновременных запросов и количество незавершенных задач.
+    Места для новых задач выдаются ожидающим директориям по кругу,
+    поэтому директория с тысячами файлов не задерживает остальные
+    """
+
+    def __init__(self, concurrency: int, queue_size: int) -> None:
+        """
+        Инициализатор класса
+
+        :param concurrency: максимальное количество одновременных запросов к api
+        :param queue_size: максимальное количество незавершенных задач
+        """
+        self._concurrency = asyncio.Semaphore(concurrency)
+        self._free = queue_size
+        self._pending = 0
+        self._waiters: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+
+    @property
+    def concurrency(self) -> asyncio.Semaphore:
+        """
+        Семафор, ограничивающий количество одновременных запросов
+
+        :return: asyncio.Semaphore
+        """
+        return self._concurrency
+
+    def pending(self) -> int:
+        """
+        Количество незавершенных задач, включая выполняющиеся
+
+        :return: int
+        """
+        return self._pending
+
+    async def reserve(self, owner: str = "") -> None:
+        """
+        Занимает место для новой задачи, ожидая его освобождения, если мест нет
+
+        :param owner: синхронизируемая директория, которой нужно место
+        :return: None
+        """
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault(owner, deque()).append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._pending += 1
+                    self.release()
+                raise
+        self._pending += 1
+
+    def release(self) -> None:
+        """
+        Освобождает место завершенной задачи и отдает его следующей по кругу директории
+
+        :return: None
+        """
+        self._pending -= 1
+        while self._waiters:
+            owner, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            if waiters:
+                self._waiters.move_to_end(owner)
+            else:
+                del self._waiters[owner]
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free += 1